@@ -0,0 +1,379 @@
+"""Micro-benchmarks for the VW serving hot paths.
+
+Run inside the serving image against a trained model, e.g.::
+
+    python -m vw_serving.benchmark backends --model-dir /opt/ml/model --num-features 100
+    python -m vw_serving.benchmark formatter --num-features 100 1000
+    python -m vw_serving.benchmark batch --num-rows 10000
+    python -m vw_serving.benchmark csv --num-features 100
+    python -m vw_serving.benchmark microbatch --model-dir /opt/ml/model --num-threads 16 --max-delay-us 0 200 500
+    python -m vw_serving.benchmark firehose --record-size 1000 --latency-ms 20 --max-in-flight 1 4 8
+"""
+import argparse
+import functools
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import tracemalloc
+from io import BytesIO, StringIO
+from pathlib import Path
+
+import numpy as np
+
+from vw_serving.example_formatter import format_examples
+from vw_serving.linear_model import LinearVWModel, export_linear_model
+from vw_serving.micro_batcher import MicroBatchingModel
+from vw_serving.vw_model import VWModel
+from vw_serving.experience_publisher import ExperiencePublisher
+from vw_serving.firehose_producer import FirehoseProducer, MAX_BATCH_BYTES, MAX_BATCH_RECORDS
+import vw_serving.sagemaker.config.environment as environment
+from vw_serving.serve import VW_MODEL_CLASSES, CONTENT_TYPE_JSONLINES, REDIS_PUBLISHER_CHANNEL, ScoringService, \
+    _score_json, _score_batch, _iter_csv_chunks
+
+
+def find_model_files(model_dir):
+    """Returns a tuple (str, str) of metadata and weights locations found under model_dir
+    """
+    model_path = Path(model_dir)
+    metadata_path = next(model_path.rglob("vw.metadata"))
+    weights_path = next(model_path.rglob("vw.model"))
+    return metadata_path.as_posix(), weights_path.as_posix()
+
+
+def summarize_latencies(latencies):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "items_per_sec": float(len(latencies) / latencies_ms.sum() * 1000),
+    }
+
+
+def benchmark_backends(metadata_path, weights_path, num_features=10, num_requests=10000):
+    """Compares the single request scoring latency of every scoring backend.
+    """
+    contexts = np.random.rand(num_requests, num_features).tolist()
+    models = {backend: model_class.load_vw_model(metadata_loc=metadata_path, weights_loc=weights_path)
+              for backend, model_class in VW_MODEL_CLASSES.items()}
+    linear_weights_dir = tempfile.mkdtemp()
+    linear_weights_path = export_linear_model(metadata_path, weights_path, output_dir=linear_weights_dir)
+    if linear_weights_path:
+        models["linear"] = LinearVWModel.load_linear_model(linear_weights_path)
+
+    results = {}
+    for backend, model in models.items():
+        model.start()
+        latencies = []
+        for context in contexts:
+            start = time.perf_counter()
+            model.predict(context)
+            latencies.append(time.perf_counter() - start)
+        model.close()
+        results[backend] = summarize_latencies(latencies)
+    return results
+
+
+def _format_examples_per_feature(context_vectors):
+    # formatting used before the example formatter, kept as the benchmark baseline
+    return "".join(["| %s\n" % " ".join(["%s:%s" % (i + 1, j) for i, j in enumerate(context_vector)])
+                    for context_vector in context_vectors])
+
+
+def benchmark_formatter(feature_sizes=(10, 100, 1000), num_examples=1000, repeats=5):
+    """Compares per feature formatting of VW examples with the cached template formatter.
+    """
+    results = {}
+    for num_features in feature_sizes:
+        context_vectors = np.random.rand(num_examples, num_features).tolist()
+        for name, formatter in (("per_feature", _format_examples_per_feature), ("template", format_examples)):
+            latencies = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                formatter(context_vectors)
+                latencies.append((time.perf_counter() - start) / num_examples)
+            results["{}_{}".format(name, num_features)] = summarize_latencies(latencies)
+    return results
+
+
+class FixedScoresModel:
+    """Scoring engine returning constant action probabilities, isolates the serving overhead from VW
+    """
+
+    def __init__(self, num_actions):
+        self.scores = np.full(num_actions, 1.0 / num_actions)
+
+    def predict(self, context_vector):
+        return self.scores
+
+    def predict_many(self, context_vectors):
+        return np.tile(self.scores, (len(context_vectors), 1))
+
+
+class NullRedis:
+    """Redis client stand-in that drops every published message
+    """
+
+    def publish(self, channel, message):
+        pass
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        pass
+
+
+def benchmark_batch(num_rows=10000, num_features=100, num_actions=10, repeats=5):
+    """Compares scoring a batch request row by row with the vectorized batch scorer, in rows per second.
+    """
+    ScoringService._redis_client = NullRedis()
+    ScoringService._experience_publisher = ExperiencePublisher(NullRedis(), REDIS_PUBLISHER_CHANNEL)
+    ScoringService._model_id = "benchmark-model"
+    model = FixedScoresModel(num_actions)
+    observations = np.random.rand(num_rows, num_features).tolist()
+    json_observations = [json.dumps(observation) for observation in observations]
+
+    def score_per_row():
+        return "\n".join([_score_json(model, observation, response_content_type=CONTENT_TYPE_JSONLINES)
+                          for observation in observations])
+
+    def score_batch():
+        return _score_batch(model, observations, response_content_type=CONTENT_TYPE_JSONLINES,
+                            json_observations=json_observations)
+
+    results = {}
+    for name, score in (("per_row", score_per_row), ("batch", score_batch)):
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            score()
+            latencies.append((time.perf_counter() - start) / num_rows)
+        results[name] = summarize_latencies(latencies)
+    ScoringService._experience_publisher.close()
+    return results
+
+
+class StubFirehoseClient:
+    """Firehose client stand-in that takes latency_ms per call and checks the PutRecordBatch limits.
+
+    Counts the delivered lines, which differ from the Firehose records when they are aggregated, and the KB
+    billed by Firehose, which rounds each record up to 5 KB.
+    """
+
+    def __init__(self, latency_ms=20):
+        self.latency_ms = latency_ms
+        self.num_calls = 0
+        self.num_records = 0
+        self.num_lines = 0
+        self.billed_kb = 0
+        self._lock = threading.Lock()
+
+    def put_record_batch(self, DeliveryStreamName, Records):
+        if len(Records) > MAX_BATCH_RECORDS or sum(len(record["Data"]) for record in Records) > MAX_BATCH_BYTES:
+            raise ValueError("Batch exceeds the PutRecordBatch limits")
+        time.sleep(self.latency_ms / 1000)
+        num_lines = 0
+        billed_kb = 0
+        for record in Records:
+            data = record["Data"]
+            billed_kb += -(-len(data) // 5120) * 5
+            num_lines += (gzip.decompress(data) if data[:2] == b"\x1f\x8b" else data).count(b"\n")
+        with self._lock:
+            self.num_calls += 1
+            self.num_records += len(Records)
+            self.num_lines += num_lines
+            self.billed_kb += billed_kb
+        return {"FailedPutCount": 0, "RequestResponses": [{} for _ in Records]}
+
+
+def benchmark_firehose(num_records=100000, record_size=1000, latency_ms=20, max_in_flight=(1, 4, 8)):
+    """Compares the delivery throughput of the buffered Firehose producer, in records per second, with the former
+    batches of 50 records sent one at a time, with full batches and several batches in flight, and with records
+    aggregated, gzipped or not. Also reports the Firehose calls, records and billed KB.
+    """
+    os.environ[environment.FIREHOSE_BUFFER_ON] = "true"
+    # JSON lines of random digits, as compressible as the logged observations
+    records = [json.dumps({"observation": np.round(np.random.rand(max(record_size // 10, 1)), 6).tolist()})
+               [:record_size] for _ in range(1000)]
+    records = (records * (num_records // len(records) + 1))[:num_records]
+    configs = [("batch_50_in_flight_1", 50, 1, False, False)]
+    configs += [("packed_in_flight_{}".format(n), MAX_BATCH_RECORDS, n, False, False) for n in max_in_flight]
+    configs += [("aggregated_in_flight_{}".format(max(max_in_flight)), MAX_BATCH_RECORDS, max(max_in_flight),
+                 True, False),
+                ("aggregated_gzip_in_flight_{}".format(max(max_in_flight)), MAX_BATCH_RECORDS, max(max_in_flight),
+                 True, True)]
+    results = {}
+    for name, batch_size, in_flight, aggregate, compress in configs:
+        client = StubFirehoseClient(latency_ms)
+        producer = FirehoseProducer("benchmark", batch_size=batch_size, max_in_flight=in_flight,
+                                    aggregate=aggregate, compress=compress, firehose_client=client)
+        start = time.perf_counter()
+        producer.put_records(records)
+        producer.close()
+        elapsed = time.perf_counter() - start
+        results[name] = {"records_per_sec": client.num_lines / elapsed, "calls": client.num_calls,
+                         "firehose_records": client.num_records, "delivered": client.num_lines,
+                         "billed_kb": client.billed_kb}
+    return results
+
+
+def benchmark_csv(payload_size=ScoringService.MAX_CONTENT_LENGTH, num_features=100,
+                  chunk_rows=ScoringService.BATCH_CHUNK_ROWS, repeats=3):
+    """Compares parsing a CSV batch payload with np.genfromtxt and with the chunked pandas reader.
+
+    Reports rows per second and the peak memory traced by tracemalloc.
+    """
+    row = ",".join(["%.6f" % value for value in np.random.rand(num_features)]) + "\n"
+    payload = (row * max(int(payload_size) // len(row), 1)).encode()
+    num_rows = payload.count(b"\n")
+
+    def parse_genfromtxt():
+        return np.genfromtxt(StringIO(payload.decode("utf-8")), delimiter=",").astype(float).tolist()
+
+    def parse_chunked():
+        for rows in _iter_csv_chunks(BytesIO(payload), chunk_rows):
+            pass
+
+    results = {}
+    for name, parse in (("genfromtxt", parse_genfromtxt), ("pandas_chunked", parse_chunked)):
+        # warm up, e.g. imports
+        parse()
+        latencies = []
+        for _ in range(repeats):
+            tracemalloc.start()
+            start = time.perf_counter()
+            parse()
+            latencies.append((time.perf_counter() - start) / num_rows)
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        results[name] = summarize_latencies(latencies)
+        results[name]["peak_memory_mb"] = peak_memory / (1024 * 1024)
+    return results
+
+
+class LockedModel:
+    """Serializes the predictions of request threads on one model, as a threaded worker without micro batching
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.model.start()
+
+    def predict(self, context_vector):
+        with self._lock:
+            return self.model.predict(context_vector)
+
+    def close(self):
+        return self.model.close()
+
+
+def benchmark_micro_batching(metadata_path, weights_path, num_features=10, num_requests=10000, num_threads=16,
+                             max_batch_size=32, delays_us=(0, 200, 500, 1000)):
+    """Compares concurrent single request scoring on one VW process with and without micro batching.
+
+    Every request thread scores its requests one after the other. Reports the per request latency and the
+    throughput of all threads in requests per second for every micro batching delay.
+    """
+    contexts = np.random.rand(num_requests, num_features).tolist()
+    models = {"locked": LockedModel(VWModel.load_vw_model(metadata_loc=metadata_path, weights_loc=weights_path))}
+    for delay_us in delays_us:
+        models["micro_batch_{}us".format(delay_us)] = MicroBatchingModel(
+            VWModel.load_vw_model(metadata_loc=metadata_path, weights_loc=weights_path),
+            max_batch_size=max_batch_size, max_delay_us=delay_us)
+
+    def score(model, context):
+        start = time.perf_counter()
+        model.predict(context)
+        return time.perf_counter() - start
+
+    results = {}
+    with ThreadPoolExecutor(num_threads) as executor:
+        for name, model in models.items():
+            model.start()
+            start = time.perf_counter()
+            latencies = list(executor.map(functools.partial(score, model), contexts))
+            elapsed = time.perf_counter() - start
+            if isinstance(model, MicroBatchingModel):
+                mean_batch_size = model.stats()["mean_batch_size"]
+            else:
+                mean_batch_size = 1.0
+            model.close()
+            results[name] = summarize_latencies(latencies)
+            results[name]["requests_per_sec"] = num_requests / elapsed
+            results[name]["mean_batch_size"] = mean_batch_size
+    return results
+
+
+def print_results(results):
+    for name, stats in results.items():
+        print("{:<24} {}".format(name, "  ".join("{}={:.4f}".format(k, v) for k, v in stats.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VW serving micro-benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    backends_parser = subparsers.add_parser("backends", help="single request latency per scoring backend")
+    backends_parser.add_argument("--model-dir", required=True)
+    backends_parser.add_argument("--num-features", type=int, default=10)
+    backends_parser.add_argument("--num-requests", type=int, default=10000)
+
+    formatter_parser = subparsers.add_parser("formatter", help="VW example formatting throughput")
+    formatter_parser.add_argument("--num-features", type=int, nargs="+", default=[10, 100, 1000])
+    formatter_parser.add_argument("--num-examples", type=int, default=1000)
+
+    batch_parser = subparsers.add_parser("batch", help="batch request scoring throughput in rows per second")
+    batch_parser.add_argument("--num-rows", type=int, default=10000)
+    batch_parser.add_argument("--num-features", type=int, default=100)
+    batch_parser.add_argument("--num-actions", type=int, default=10)
+
+    csv_parser = subparsers.add_parser("csv", help="CSV batch payload parsing throughput and memory")
+    csv_parser.add_argument("--payload-size", type=int, default=ScoringService.MAX_CONTENT_LENGTH)
+    csv_parser.add_argument("--num-features", type=int, default=100)
+    csv_parser.add_argument("--chunk-rows", type=int, default=ScoringService.BATCH_CHUNK_ROWS)
+
+    micro_batch_parser = subparsers.add_parser("microbatch",
+                                               help="concurrent single request throughput with micro batching")
+    micro_batch_parser.add_argument("--model-dir", required=True)
+    micro_batch_parser.add_argument("--num-features", type=int, default=10)
+    micro_batch_parser.add_argument("--num-requests", type=int, default=10000)
+    micro_batch_parser.add_argument("--num-threads", type=int, default=16)
+    micro_batch_parser.add_argument("--max-batch-size", type=int, default=32)
+    micro_batch_parser.add_argument("--max-delay-us", type=int, nargs="+", default=[0, 200, 500, 1000])
+
+    firehose_parser = subparsers.add_parser("firehose",
+                                            help="Firehose delivery throughput in records per second, stubbed client")
+    firehose_parser.add_argument("--num-records", type=int, default=100000)
+    firehose_parser.add_argument("--record-size", type=int, default=1000)
+    firehose_parser.add_argument("--latency-ms", type=float, default=20)
+    firehose_parser.add_argument("--max-in-flight", type=int, nargs="+", default=[1, 4, 8])
+
+    args = parser.parse_args()
+    if args.benchmark == "backends":
+        metadata_path, weights_path = find_model_files(args.model_dir)
+        print_results(benchmark_backends(metadata_path, weights_path, args.num_features, args.num_requests))
+    elif args.benchmark == "formatter":
+        print_results(benchmark_formatter(args.num_features, args.num_examples))
+    elif args.benchmark == "batch":
+        print_results(benchmark_batch(args.num_rows, args.num_features, args.num_actions))
+    elif args.benchmark == "csv":
+        print_results(benchmark_csv(args.payload_size, args.num_features, args.chunk_rows))
+    elif args.benchmark == "microbatch":
+        metadata_path, weights_path = find_model_files(args.model_dir)
+        print_results(benchmark_micro_batching(metadata_path, weights_path, args.num_features, args.num_requests,
+                                               args.num_threads, args.max_batch_size, args.max_delay_us))
+    elif args.benchmark == "firehose":
+        print_results(benchmark_firehose(args.num_records, args.record_size, args.latency_ms, args.max_in_flight))
+
+
+if __name__ == "__main__":
+    main()
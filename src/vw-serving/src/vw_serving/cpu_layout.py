@@ -0,0 +1,67 @@
+"""Layout of the available CPUs into the core groups Gunicorn workers are pinned to.
+
+Hyper-threading siblings are kept in the same group, so a worker and the VW processes it talks to
+share the caches of one physical core instead of bouncing the data of every request between cores.
+"""
+import logging
+import os
+
+CPU_SIBLINGS_PATH = "/sys/devices/system/cpu/cpu{}/topology/thread_siblings_list"
+
+
+def cpu_affinity_supported():
+    return hasattr(os, "sched_setaffinity") and hasattr(os, "sched_getaffinity")
+
+
+def get_available_cpus():
+    """Returns the sorted CPUs this process may run on, e.g. restricted by the container cpuset
+    """
+    if cpu_affinity_supported():
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _parse_cpu_list(cpu_list):
+    # e.g. "0,32" or "0-1"
+    cpus = []
+    for cpu_range in cpu_list.strip().split(","):
+        start, _, end = cpu_range.partition("-")
+        cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def get_cpu_siblings(cpu):
+    try:
+        with open(CPU_SIBLINGS_PATH.format(cpu)) as f:
+            return _parse_cpu_list(f.read())
+    except (OSError, ValueError):
+        return [cpu]
+
+
+def get_cpu_layout(cores_per_worker):
+    """Splits the available CPUs into groups of cores_per_worker CPUs, hyper-threading siblings first.
+
+    :param cores_per_worker: (int) number of CPUs of every group
+    :return: (list) tuples of CPUs, at least one group even with fewer CPUs than cores_per_worker
+    """
+    available_cpus = get_available_cpus()
+    ordered_cpus = []
+    for cpu in available_cpus:
+        if cpu in ordered_cpus:
+            continue
+        ordered_cpus.extend(sibling for sibling in get_cpu_siblings(cpu)
+                            if sibling in available_cpus and sibling not in ordered_cpus)
+        if cpu not in ordered_cpus:
+            ordered_cpus.append(cpu)
+
+    num_groups = max(len(ordered_cpus) // cores_per_worker, 1)
+    if num_groups == 1:
+        return [tuple(ordered_cpus)]
+    return [tuple(ordered_cpus[i * cores_per_worker:(i + 1) * cores_per_worker]) for i in range(num_groups)]
+
+
+def pin_process(cpus):
+    """Restricts the calling process, and the processes it starts afterwards, to cpus
+    """
+    os.sched_setaffinity(0, cpus)
+    logging.info("Pinned process %s to CPUs %s", os.getpid(), ",".join(str(cpu) for cpu in cpus))
@@ -0,0 +1,124 @@
+"""Formatting of dense context vectors into VW text examples.
+
+Features are named by their 1-based position, e.g. [0.1, 0.2] becomes "| 1:0.1 2:0.2".
+The format template of every observation dimension is built once and cached, so a slice of up
+to FORMAT_SLICE_ROWS equally sized contexts is formatted with a single string formatting operation.
+Values are written with 9 significant digits, which round trips the 32 bit floats VW
+parses features into. Values that are not numbers are converted with float(), e.g. "0.5",
+and a CustomerError is raised for the values that cannot be, and for NaN and infinity.
+"""
+import functools
+import math
+from itertools import chain
+
+import numpy as np
+
+from vw_serving.sagemaker.exceptions import CustomerError
+
+
+# rows formatted by one string formatting operation
+FORMAT_SLICE_ROWS = 500
+
+
+@functools.lru_cache(maxsize=1024)
+def _features_template(num_features):
+    return " ".join(["%d:%%.9g" % (i + 1) for i in range(num_features)])
+
+
+@functools.lru_cache(maxsize=1024)
+def _example_template(num_features):
+    return "| %s\n" % _features_template(num_features)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise CustomerError("Observation values must be numbers, got {!r}".format(value))
+
+
+def _format_values(template, values):
+    try:
+        text = template % tuple(values)
+    except TypeError:
+        # e.g. numbers sent as strings
+        text = template % tuple([_to_float(value) for value in values])
+    # the feature names and the formatted numbers only hold an "n" in "nan" and "inf"
+    if "n" in text:
+        raise CustomerError("Observation values must be finite numbers")
+    return text
+
+
+def format_features(context_vector):
+    """Returns the VW features of a context vector, e.g. "1:0.1 2:0.2"
+    """
+    return _format_values(_features_template(len(context_vector)), context_vector)
+
+
+def format_example(context_vector):
+    """Returns the VW example of a context vector, e.g. "| 1:0.1 2:0.2"
+    """
+    return "| " + format_features(context_vector)
+
+
+def iter_example_slices(context_vectors, slice_rows=FORMAT_SLICE_ROWS):
+    """Yields the VW text of consecutive slices of at most slice_rows context vectors, so that the text and the
+    format arguments of a large batch are never built at once.
+
+    :param context_vectors: 2-D numpy array or list of context vectors
+    :return: generator of tuples (str, int) of VW examples and their number
+    """
+    for start in range(0, len(context_vectors), slice_rows):
+        context_slice = context_vectors[start:start + slice_rows]
+        yield _format_example_slice(context_slice), len(context_slice)
+
+
+def format_examples(context_vectors):
+    """Returns the VW text of a batch of context vectors, one newline terminated example per context.
+
+    :param context_vectors: 2-D numpy array or list of context vectors
+    :return: (str) VW examples
+    """
+    return "".join([examples for examples, _ in iter_example_slices(context_vectors)])
+
+
+def _format_example_slice(context_vectors):
+    if isinstance(context_vectors, np.ndarray) and context_vectors.ndim == 2:
+        num_examples, num_features = context_vectors.shape
+        values = context_vectors.ravel().tolist()
+    else:
+        num_examples = len(context_vectors)
+        num_features = {len(context_vector) for context_vector in context_vectors}
+        if len(num_features) != 1:
+            # contexts of different lengths are formatted one by one
+            return "".join([_format_values(_example_template(len(context_vector)), context_vector)
+                            for context_vector in context_vectors])
+        num_features = num_features.pop()
+        values = list(chain.from_iterable(context_vectors))
+    return _format_values(_example_template(num_features) * num_examples, values)
+
+
+@functools.lru_cache(maxsize=1024)
+def _json_array_template(num_features):
+    return "[%s]" % ", ".join(["%.9g"] * num_features)
+
+
+def format_json_arrays(context_vectors):
+    """Returns the JSON arrays of a batch of context vectors, e.g. ["[0.1, 0.2]", "[0.3, 0.4]"]
+
+    NaN and infinity, which JSON cannot represent, are written as null.
+
+    :param context_vectors: list of context vectors
+    :return: (list) JSON array of every context vector
+    """
+    json_arrays = []
+    for context_vector in context_vectors:
+        try:
+            json_array = _json_array_template(len(context_vector)) % tuple(context_vector)
+        except TypeError:
+            json_array = _json_array_template(len(context_vector)) % tuple([_to_float(v) for v in context_vector])
+        if "n" in json_array:
+            json_array = "[%s]" % ", ".join(["%.9g" % value if math.isfinite(value) else "null"
+                                             for value in map(_to_float, context_vector)])
+        json_arrays.append(json_array)
+    return json_arrays
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+from collections import deque
+
+OVERFLOW_DROP = "drop"
+OVERFLOW_BLOCK = "block"
+OVERFLOW_POLICIES = (OVERFLOW_DROP, OVERFLOW_BLOCK)
+
+EXPERIENCE_TRANSPORT_PUBSUB = "pubsub"
+EXPERIENCE_TRANSPORT_STREAM = "stream"
+EXPERIENCE_TRANSPORT_SHM = "shm"
+EXPERIENCE_TRANSPORTS = (EXPERIENCE_TRANSPORT_PUBSUB, EXPERIENCE_TRANSPORT_STREAM, EXPERIENCE_TRANSPORT_SHM)
+
+
+class ExperiencePublisher:
+    def __init__(self, redis_client, channel, buffer_size=10000, flush_count=100, flush_interval=0.05,
+                 overflow_policy=OVERFLOW_DROP, stream_maxlen=None):
+        """
+        Publishes experience records to a redis channel from a background
+        thread, so that requests only append to an in-memory buffer. The
+        buffer is sent in one redis pipeline whenever it holds flush_count
+        records or flush_interval seconds after the previous flush. When redis
+        is slow and the buffer is full, records are dropped or the callers are
+        blocked until the buffer is flushed, depending on overflow_policy.
+        If stream_maxlen is set, the records are appended to the redis stream
+        named channel instead, trimmed to about stream_maxlen records, so that
+        they wait for the consumers instead of being lost when none listens.
+        Args:
+            redis_client (redis.Redis): client of the redis server
+            channel (str): channel the records are published to
+            buffer_size (int): maximum number of buffered records
+            flush_count (int): number of buffered records that triggers a flush
+            flush_interval (float): maximum seconds between two flushes
+            overflow_policy (str): "drop" or "block"
+            stream_maxlen (int): approximate maximum length of the stream, None to publish to the channel
+        """
+        self.logger = logging.getLogger("vw_model.ExperiencePublisher")
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError("Overflow policy '{}' not supported. Supported policies are: {}".format(
+                overflow_policy, ", ".join(OVERFLOW_POLICIES)))
+        self.redis_client = redis_client
+        self.channel = channel
+        self.buffer_size = buffer_size
+        self.flush_count = flush_count
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.stream_maxlen = stream_maxlen
+        self.num_published = 0
+        self.num_dropped = 0
+        self.num_blocked = 0
+        self.num_failed = 0
+        self.closed = False
+        # callers blocked on a full buffer, flushed without waiting for flush_interval
+        self._num_waiting = 0
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._flush_ready = threading.Condition(self._lock)
+        self._space_ready = threading.Condition(self._lock)
+        self._thread = threading.Thread(target=self._flush_forever, daemon=True)
+        self._thread.start()
+
+    def _make_room(self, num_records):
+        # called with the lock held, returns False when the records are dropped
+        if len(self._buffer) + num_records <= self.buffer_size:
+            return True
+        if self.overflow_policy == OVERFLOW_DROP:
+            self.num_dropped += num_records
+            return False
+        self.num_blocked += 1
+        self._num_waiting += 1
+        self._flush_ready.notify()
+        while len(self._buffer) + num_records > self.buffer_size and len(self._buffer) and not self.closed:
+            self._space_ready.wait()
+        self._num_waiting -= 1
+        return True
+
+    def publish(self, message):
+        """
+        Buffers a record, returns False if it was dropped
+        """
+        return self.publish_many([message])
+
+    def publish_many(self, messages):
+        """
+        Buffers a list of records, returns False if they were dropped
+        """
+        with self._lock:
+            if self.closed:
+                self.num_dropped += len(messages)
+                return False
+            if not self._make_room(len(messages)):
+                return False
+            self._buffer.extend(messages)
+            if len(self._buffer) >= self.flush_count:
+                self._flush_ready.notify()
+        return True
+
+    def _take_batch(self):
+        with self._lock:
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._buffer) < self.flush_count and not (self._num_waiting and self._buffer) and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._flush_ready.wait(remaining)
+            batch = list(self._buffer)
+            self._buffer.clear()
+            self._space_ready.notify_all()
+            return batch
+
+    def _send(self, batch):
+        try:
+            pipeline = self.redis_client.pipeline(transaction=False)
+            for message in batch:
+                if self.stream_maxlen:
+                    pipeline.xadd(self.channel, {"data": message}, maxlen=self.stream_maxlen, approximate=True)
+                else:
+                    pipeline.publish(self.channel, message)
+            pipeline.execute()
+            self.num_published += len(batch)
+        except Exception:
+            self.num_failed += len(batch)
+            self.logger.exception("Unable to publish %s experience records", len(batch))
+
+    def _flush_forever(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._send(batch)
+            elif self.closed:
+                return
+
+    def stats(self):
+        return {
+            "published": self.num_published,
+            "dropped": self.num_dropped,
+            "blocked": self.num_blocked,
+            "failed": self.num_failed,
+            "buffered": len(self._buffer),
+        }
+
+    def close(self):
+        """
+        Publishes the buffered records and stops the background thread.
+        """
+        with self._lock:
+            self.closed = True
+            self._flush_ready.notify()
+            self._space_ready.notify_all()
+        self._thread.join()
+        self.logger.info("Experience publisher stats: %s", self.stats())
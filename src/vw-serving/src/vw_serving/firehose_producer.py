@@ -1,7 +1,8 @@
 import boto3
+import gzip
 from concurrent.futures import ThreadPoolExecutor
 import logging
-from queue import Queue
+from collections import deque
 import threading
 import time
 import uuid
@@ -13,10 +14,20 @@ from botocore.exceptions import ClientError
 
 import vw_serving.sagemaker.config.environment as environment
 from vw_serving.serve import REDIS_PUBLISHER_CHANNEL
+from vw_serving.shm_ring import ShmRingBuffer, find_rings
 
 
 logger = logging.getLogger(__name__)
 
+REDIS_STREAM_GROUP = "firehose"
+
+# limits of PutRecordBatch
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+MAX_RECORD_BYTES = 1000 * 1024
+# compresses JSON lines about as well as the default level, several times faster
+AGGREGATE_GZIP_LEVEL = 1
+
 
 def encode_data(data, encoding='utf_8'):
     if isinstance(data, bytes):
@@ -25,6 +36,86 @@ def encode_data(data, encoding='utf_8'):
         return str(data + '\n').encode(encoding)
 
 
+def pack_batches(records, max_records=MAX_BATCH_RECORDS, max_bytes=MAX_BATCH_BYTES):
+    """Pack records into as few PutRecordBatch batches as the Firehose limits allow.
+
+    Parameters
+    ----------
+    records : list
+        Formated records, in order.
+    max_records : int
+        Maximum number of records per batch.
+    max_bytes : int
+        Maximum bytes of data per batch.
+
+    Returns
+    -------
+    tuple
+        List of batches, list of the records larger than MAX_RECORD_BYTES, which Firehose rejects.
+    """
+    batches = []
+    oversized = []
+    batch = []
+    batch_bytes = 0
+    for record in records:
+        record_bytes = len(record['Data'])
+        if record_bytes > MAX_RECORD_BYTES:
+            oversized.append(record)
+            continue
+        if batch and (len(batch) >= max_records or batch_bytes + record_bytes > max_bytes):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append(record)
+        batch_bytes += record_bytes
+    if batch:
+        batches.append(batch)
+    return batches, oversized
+
+
+def _seal_aggregate(records, compress):
+    data = b''.join(record['Data'] for record in records)
+    if compress:
+        data = gzip.compress(data, compresslevel=AGGREGATE_GZIP_LEVEL)
+    return {'Data': data}, records
+
+
+def aggregate_records(records, max_bytes=MAX_RECORD_BYTES, compress=False):
+    """Join newline delimited records into aggregate records of up to max_bytes bytes.
+
+    An aggregate holds whole lines, so it reads like the records it joins once
+    delivered. A compressed aggregate is a complete gzip member, and the
+    concatenation of aggregates in a delivered object is a valid gzip stream.
+
+    Parameters
+    ----------
+    records : list
+        Formated records, in order.
+    max_bytes : int
+        Maximum bytes of an aggregate before compression.
+    compress : bool
+        Gzip each aggregate.
+
+    Returns
+    -------
+    list
+        Tuples of an aggregate record and the list of records it holds.
+    """
+    aggregates = []
+    parts = []
+    parts_bytes = 0
+    for record in records:
+        if parts and parts_bytes + len(record['Data']) > max_bytes:
+            aggregates.append(_seal_aggregate(parts, compress))
+            parts = []
+            parts_bytes = 0
+        parts.append(record)
+        parts_bytes += len(record['Data'])
+    if parts:
+        aggregates.append(_seal_aggregate(parts, compress))
+    return aggregates
+
+
 class FirehoseProducer:
     """Basic Firehose Producer.
 
@@ -38,51 +129,89 @@ class FirehoseProducer:
         Maximum of seconds to wait before flushing the queue.
     max_retries: int
         Maximum number of times to retry the put operation.
+    max_in_flight: int
+        Maximum number of PutRecordBatch calls in flight, FIREHOSE_MAX_IN_FLIGHT by default.
+    aggregate: bool
+        Join records into Firehose records of up to MAX_RECORD_BYTES bytes, FIREHOSE_AGGREGATE by default.
+        Implies buffering.
+    compress: bool
+        Gzip each aggregate, FIREHOSE_AGGREGATE_GZIP by default.
     firehose_client: boto3.client
         Firehose client.
 
     Attributes
     ----------
-    records : array
+    records : collections.deque
         Queue of formated records.
     pool: concurrent.futures.ThreadPoolExecutor
         Pool of threads handling client I/O.
     """
 
-    def __init__(self, stream_name, batch_size=50,
-                 batch_time=.2, max_retries=5, threads=2,
-                 firehose_client=None):
+    def __init__(self, stream_name, batch_size=MAX_BATCH_RECORDS,
+                 batch_time=.2, max_retries=5, threads=2, max_in_flight=None,
+                 aggregate=None, compress=None, firehose_client=None):
         self.stream_name = stream_name
-        self.buffer_on = os.getenv(environment.FIREHOSE_BUFFER_ON, 'false').lower() == 'true'
+        if aggregate is None:
+            aggregate = os.getenv(environment.FIREHOSE_AGGREGATE, 'false').lower() == 'true'
+        if compress is None:
+            compress = os.getenv(environment.FIREHOSE_AGGREGATE_GZIP, 'false').lower() == 'true'
+        self.aggregate = aggregate
+        self.compress = compress
+        self.buffer_on = os.getenv(environment.FIREHOSE_BUFFER_ON, 'false').lower() == 'true' or aggregate
 
         self.max_retries = max_retries
         if firehose_client is None:
             firehose_client = boto3.client('firehose')
         self.firehose_client = firehose_client
-        self.pool = ThreadPoolExecutor(threads)
+        if max_in_flight is None:
+            max_in_flight = int(os.getenv(environment.FIREHOSE_MAX_IN_FLIGHT, 4))
+        self.max_in_flight = max_in_flight
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.num_oversized = 0
+        # records put or sent that could not be delivered, counted before they are aggregated
+        self.num_failed = 0
+        # one more thread than batches in flight for the monitor
+        self.pool = ThreadPoolExecutor(max(threads, max_in_flight + 1))
 
         if self.buffer_on:
-            self.queue = Queue()
-            self.batch_size = batch_size
+            self.queue = deque()
+            self.queue_bytes = 0
+            self.queue_ready = threading.Condition()
+            # records of the aggregate being filled, not in the queue yet
+            self.aggregate_parts = []
+            self.aggregate_bytes = 0
+            self.batch_size = min(batch_size, MAX_BATCH_RECORDS)
             self.batch_time = batch_time
             self.last_flush = time.time()
             self.monitor_running = threading.Event()
             self.monitor_running.set()
-            self.pool.submit(self.monitor)
-            logger.info(f"Buffering data with batch_size {self.batch_size} and batch_time {self.batch_time}s before push to Firehose")
+            self.monitor_future = self.pool.submit(self.monitor)
+            logger.info(f"Buffering data with batch_size {self.batch_size} and batch_time {self.batch_time}s "
+                        f"before push to Firehose, with up to {self.max_in_flight} batches in flight")
+            if self.aggregate:
+                logger.info(f"Aggregating records up to {MAX_RECORD_BYTES} bytes, gzip: {self.compress}")
         else:
             logger.info("Write data directly to Firehose without batching")
 
         atexit.register(self.close)
 
+    def _batch_ready(self):
+        # more than MAX_BATCH_BYTES bytes always make a full batch and a partial one
+        return len(self.queue) >= self.batch_size or self.queue_bytes > MAX_BATCH_BYTES
+
     def monitor(self):
-        """Flushes the queue periodically."""
+        """Flushes the queue when a batch is full or batch_time after the previous flush."""
         while self.monitor_running.is_set():
-            if time.time() - self.last_flush > self.batch_time:
-                if not self.queue.empty():
-                    logger.info(f"Queue Flush: Data flushed to Firehose stream: {self.stream_name}")
-                    self.flush_queue()
-            time.sleep(self.batch_time)
+            with self.queue_ready:
+                timeout = self.last_flush + self.batch_time - time.time()
+                if timeout > 0 and not self._batch_ready():
+                    self.queue_ready.wait(timeout)
+                flush_all = time.time() - self.last_flush >= self.batch_time
+                if not self._batch_ready() and not (flush_all and (self.queue or self.aggregate_parts)):
+                    if flush_all:
+                        self.last_flush = time.time()
+                    continue
+            self.flush_queue(flush_all=flush_all)
 
     def put_records(self, records):
         """Add a list of data records to the record queue in the proper format.
@@ -114,14 +243,19 @@ class FirehoseProducer:
             'Data': data
         }
         if self.buffer_on:
-            # Flush the queue if it reaches the batch size
-            if self.queue.qsize() >= self.batch_size:
-                logger.info("Queue Flush: batch size reached")
-                self.pool.submit(self.flush_queue)
-
-            # Append the record
+            # Append the record, the monitor flushes the queue once it holds a full batch
             logger.debug('Putting record "{}"'.format(record['Data'][:100]))
-            self.queue.put(record)
+            with self.queue_ready:
+                if self.aggregate:
+                    if self.aggregate_parts and self.aggregate_bytes + len(data) > MAX_RECORD_BYTES:
+                        self._queue_aggregate()
+                    self.aggregate_parts.append(record)
+                    self.aggregate_bytes += len(data)
+                else:
+                    self.queue.append(record)
+                    self.queue_bytes += len(data)
+                if self._batch_ready():
+                    self.queue_ready.notify()
         else:
             if pool_submit:
                 self.pool.submit(self.send_record, record)
@@ -131,22 +265,118 @@ class FirehoseProducer:
     def close(self):
         """Flushes the queue and waits for the executor to finish."""
         logger.info('Closing producer')
-        self.flush_queue()
-        self.monitor_running.clear()
+        if self.buffer_on:
+            self.monitor_running.clear()
+            with self.queue_ready:
+                self.queue_ready.notify()
+            self.monitor_future.result()
+            self.flush_queue(flush_all=True)
         self.pool.shutdown()
         logger.info('Producer closed')
 
-    def flush_queue(self):
-        """Grab all the current records in the queue and send them."""
-        records = []
+    def flush_queue(self, flush_all=True):
+        """Grab the current records in the queue and send them in full batches.
 
-        while not self.queue.empty() and len(records) < self.batch_size:
-            records.append(self.queue.get())
-
-        if records:
-            self.send_records(records)
+        Batches are sent on the thread pool with up to max_in_flight batches in
+        flight, this call blocks while that many are. A last partial batch is
+        left in the queue unless flush_all is set.
+        """
+        with self.queue_ready:
+            if flush_all and self.aggregate_parts:
+                self._queue_aggregate()
+            records = list(self.queue)
+            self.queue.clear()
+            self.queue_bytes = 0
             self.last_flush = time.time()
-        
+
+        batches, oversized = pack_batches(records, max_records=self.batch_size)
+        self._drop_oversized(oversized)
+        if batches and not flush_all and len(batches[-1]) < self.batch_size:
+            # not full yet, given back to the queue ahead of the records put meanwhile
+            with self.queue_ready:
+                partial = batches.pop()
+                self.queue.extendleft(reversed(partial))
+                self.queue_bytes += sum(len(record['Data']) for record in partial)
+        for batch in batches:
+            self._submit_batch(batch)
+
+    def _queue_aggregate(self):
+        # called with the queue lock held
+        aggregate, _ = _seal_aggregate(self.aggregate_parts, self.compress)
+        self.queue.append(aggregate)
+        self.queue_bytes += len(aggregate['Data'])
+        self.aggregate_parts = []
+        self.aggregate_bytes = 0
+
+    def _drop_oversized(self, oversized):
+        if oversized:
+            self.num_oversized += len(oversized)
+            logger.warning(f'Dropping {len(oversized)} records larger than {MAX_RECORD_BYTES} bytes')
+
+    def _submit_batch(self, batch):
+        self.in_flight.acquire()
+        try:
+            future = self.pool.submit(self.send_records, batch)
+        except Exception:
+            self.in_flight.release()
+            raise
+        future.add_done_callback(lambda done_future: self._batch_done(batch, done_future))
+        return future
+
+    def _batch_done(self, batch, future):
+        self.in_flight.release()
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self.num_failed += self._count_source_records(batch)
+            logger.error(f"Unable to send {len(batch)} records to Firehose stream: {self.stream_name}",
+                         exc_info=error)
+        elif future.result():
+            self.num_failed += self._count_source_records(future.result())
+
+    def _count_source_records(self, records):
+        # an aggregate holds one record per line, only failed records are counted so decompressing is cheap
+        if not self.aggregate:
+            return len(records)
+        if self.compress:
+            return sum(gzip.decompress(record['Data']).count(b'\n') for record in records)
+        return sum(record['Data'].count(b'\n') for record in records)
+
+    def send_batches(self, records):
+        """Pack records into batches and send them with up to max_in_flight batches in flight.
+
+        Parameters
+        ----------
+        records : list
+            Formated records to send.
+
+        Returns
+        -------
+        list
+            Records that could not be sent, the records of an aggregate that could not
+            be sent when aggregating. Records larger than MAX_RECORD_BYTES are dropped,
+            they are never accepted by Firehose.
+        """
+        sources = None
+        if self.aggregate:
+            aggregates = aggregate_records(records, compress=self.compress)
+            records = [aggregate for aggregate, _ in aggregates]
+            sources = {id(aggregate): parts for aggregate, parts in aggregates}
+        batches, oversized = pack_batches(records)
+        self._drop_oversized(oversized)
+        futures = [self._submit_batch(batch) for batch in batches]
+        failed_records = []
+        for batch, future in zip(batches, futures):
+            try:
+                failed_records += future.result()
+            except Exception:
+                # logged when the batch is done
+                failed_records += batch
+        if sources is not None:
+            failed_records = [record for aggregate in failed_records for record in sources[id(aggregate)]]
+        return failed_records
+
     def listen_to_redis_channel(self, channel):
         redis_client = redis.Redis()
         pubsub = redis_client.pubsub()
@@ -156,6 +386,122 @@ class FirehoseProducer:
             if item['type'] == 'message':
                 self.put_record(item['data'])
 
+    def consume_redis_stream(self, stream, group=REDIS_STREAM_GROUP, consumer="consumer-0", count=500,
+                             block_ms=1000, redis_client=None):
+        """Deliver the records of a redis stream to Firehose as a member of a consumer group.
+
+        Up to count records are read at once and sent in one batch, and only the
+        delivered records are acknowledged. Records read but not acknowledged stay
+        pending for the consumer, they are read again after a failed delivery or a
+        restart with the same consumer name. Consumers of the group with different
+        names share the records of the stream.
+
+        Parameters
+        ----------
+        stream : str
+            Key of the stream.
+        group : str
+            Consumer group, created at the end of the stream if it does not exist.
+        consumer : str
+            Name of the consumer in the group.
+        count : int
+            Maximum number of records per read and per Firehose batch.
+        block_ms : int
+            Milliseconds a read waits for new records.
+        """
+        if redis_client is None:
+            redis_client = redis.Redis()
+        try:
+            redis_client.xgroup_create(stream, group, id='$', mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        logger.info(f"Consuming redis stream: {stream} as {consumer} of group {group}")
+
+        # records pending since the last run are read from the beginning of the pending list first
+        last_id = '0'
+        while True:
+            response = redis_client.xreadgroup(group, consumer, {stream: last_id}, count=count,
+                                               block=None if last_id != '>' else block_ms)
+            entries = response[0][1] if response else []
+            if last_id != '>':
+                if not entries:
+                    last_id = '>'
+                    continue
+                last_id = entries[-1][0]
+            # pending entries deleted by MAXLEN trimming are returned without fields
+            records = [({'Data': encode_data(fields[b'data'])}, entry_id) for entry_id, fields in entries
+                       if fields and b'data' in fields]
+            failed_records = self.send_batches([record for record, _ in records])
+            failed_ids = set(id(record) for record in failed_records)
+            delivered_ids = [entry_id for record, entry_id in records if id(record) not in failed_ids]
+            delivered_ids += [entry_id for entry_id, fields in entries if not fields or b'data' not in fields]
+            if delivered_ids:
+                redis_client.xack(stream, group, *delivered_ids)
+            if failed_records:
+                logger.warning(f"{len(failed_records)} records are left pending in stream {stream}")
+                last_id = '0'
+                time.sleep(block_ms / 1000)
+
+    def consume_shm_rings(self, ring_dir, batch_size=500, poll_interval=.01, stats_interval=60):
+        """Deliver the records of the shared memory rings of the workers to Firehose.
+
+        Up to batch_size records are read from each ring found in ring_dir, and
+        they are sent together with send_batches. Rings of new workers are
+        picked up as they appear. Rings of workers that exited, or died, are
+        drained and released. The overflow counters of the rings are logged
+        every stats_interval seconds.
+
+        Parameters
+        ----------
+        ring_dir : str
+            Directory of the ring files of the workers.
+        batch_size : int
+            Maximum number of records read from a ring at once.
+        poll_interval : float
+            Seconds to wait when all the rings are empty.
+        stats_interval : float
+            Seconds between two logs of the ring counters.
+        """
+        logger.info(f"Consuming shared memory rings in: {ring_dir}")
+        rings = {}
+        last_stats = time.time()
+        while True:
+            records = []
+            for path, ring in list(rings.items()):
+                if ring.is_orphaned():
+                    records += ring.read_all()
+                    # removes the ring of a worker that died, the one of a worker that exited is already removed
+                    ring.unlink()
+                    ring.close()
+                    del rings[path]
+                    logger.info(f"Released ring: {path}")
+            for path in find_rings(ring_dir):
+                if path not in rings:
+                    try:
+                        rings[path] = ShmRingBuffer(path)
+                    except FileNotFoundError:
+                        # removed by a worker that exited right away
+                        continue
+                    logger.info(f"Consuming ring: {path}")
+
+            for ring in rings.values():
+                records += ring.read_all(max_records=batch_size)
+            if records:
+                # the batches of all the rings are in flight together
+                failed_records = self.send_batches([{'Data': encode_data(record)} for record in records])
+                if failed_records:
+                    logger.warning(f"Dropping {len(failed_records)} records read from the rings")
+
+            if time.time() - last_stats > stats_interval:
+                for path, ring in rings.items():
+                    stats = ring.stats()
+                    log = logger.warning if stats['dropped'] else logger.info
+                    log(f"Ring {path}: {stats}")
+                last_stats = time.time()
+            if not records:
+                time.sleep(poll_interval)
+
     def send_records(self, records, attempt=0):
         """Send records to the Firehose stream.
 
@@ -167,12 +513,17 @@ class FirehoseProducer:
             Array of formated records to send.
         attempt: int
             Number of times the records have been sent without success.
+
+        Returns
+        -------
+        list
+            Records that could not be sent.
         """
 
         # If we already tried more times than we wanted, save to a file
         if attempt > self.max_retries:
             logger.warning('Writing {} records to file'.format(len(records)))
-            return
+            return records
 
         # Sleep before retrying
         if attempt:
@@ -192,7 +543,8 @@ class FirehoseProducer:
 
             # Recursive call
             attempt += 1
-            self.send_records(failed_records, attempt=attempt)
+            return self.send_records(failed_records, attempt=attempt)
+        return []
     
     def send_record(self, record, attempt=0):
         """Send single record to the Firehose stream.
@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+from vw_serving.sagemaker.exceptions import CustomerError
+from vw_serving.vw_model import VWError, VWModel
+
+# VW hashes the constant (bias) feature to this index
+VW_CONSTANT_HASH = 11650396
+DEFAULT_EPSILON = 0.05
+# Number of regressors per action for each cost estimator of the cb reduction
+CB_TYPE_PROBLEM_MULTIPLIER = {"dr": 2, "ips": 1, "dm": 1}
+# Arguments that do not change how a linear --cb_explore model is scored
+IGNORED_ARGS = {"--quiet", "--testonly", "-t"}
+IGNORED_ARGS_WITH_VALUE = {"-i", "--initial_regressor", "-f", "--final_regressor", "--random_seed", "--cb",
+                           "--csoaa"}
+
+LINEAR_WEIGHTS_FILE = "vw.linear.npy"
+LINEAR_METADATA_FILE = "vw.linear.json"
+
+
+def parse_linear_cli_args(cli_args):
+    """Parses the VW arguments of a model into the settings of the linear scorer.
+
+    Returns None if the arguments use a reduction the linear scorer does not support.
+    """
+    tokens = cli_args.split()
+    settings = {"cb_type": "dr", "epsilon": DEFAULT_EPSILON}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        value = tokens[i + 1] if i + 1 < len(tokens) else None
+        if token in IGNORED_ARGS:
+            i += 1
+            continue
+        if value is None:
+            return None
+        if token == "--cb_explore":
+            settings["num_actions"] = int(value)
+        elif token == "--epsilon":
+            settings["epsilon"] = float(value)
+        elif token == "--cb_type":
+            if value not in CB_TYPE_PROBLEM_MULTIPLIER:
+                return None
+            settings["cb_type"] = value
+        elif token in ("-b", "--bit_precision"):
+            settings["bits"] = int(value)
+        elif token not in IGNORED_ARGS_WITH_VALUE:
+            return None
+        i += 2
+
+    if "num_actions" not in settings:
+        return None
+    return settings
+
+
+def read_readable_model(readable_model_path):
+    """Reads a model written with --readable_model.
+
+    Returns a tuple (dict, dict) of header values and {weight index: weight}.
+    """
+    header = {}
+    weights = {}
+    with open(readable_model_path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("bits:"):
+                header["bits"] = int(line.split(":", 1)[1])
+            elif line.startswith("options:"):
+                header["options"] = line.split(":", 1)[1].strip()
+            elif line[:1].isdigit() and ":" in line and " " not in line:
+                index, weight = line.split(":", 1)
+                weights[int(index)] = float(weight)
+    return header, weights
+
+
+def export_linear_model(metadata_loc, weights_loc, output_dir=None, num_parity_checks=200):
+    """Compiles a VW model into a dense weight array for the linear scorer.
+
+    The weights are exported once with --readable_model and saved as a .npy file next to the model, so that
+    every worker can memory map the same copy. The compiled model is checked against the VW process on random
+    contexts before it is used.
+
+    Returns the location of the .npy weights, or None if the model cannot be scored by the linear scorer.
+    """
+    with open(metadata_loc) as f:
+        cli_args = f.read().strip()
+    settings = parse_linear_cli_args(cli_args)
+    if settings is None:
+        logging.info("Model arguments '%s' are not supported by the linear scorer.", cli_args)
+        return None
+
+    output_dir = output_dir or os.path.dirname(weights_loc)
+    with tempfile.NamedTemporaryFile(suffix=".txt") as readable_model:
+        subprocess.run(["vw", "-i", weights_loc, "--testonly", "--quiet", "-d", "/dev/null",
+                        "--readable_model", readable_model.name], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        header, weight_items = read_readable_model(readable_model.name)
+
+    # the options stored in the model take precedence over the metadata
+    stored_settings = parse_linear_cli_args(header.get("options", ""))
+    if stored_settings is not None:
+        settings.update(stored_settings)
+    elif header.get("options"):
+        logging.info("Model options '%s' are not supported by the linear scorer.", header["options"])
+        return None
+    settings["bits"] = header.get("bits", settings.get("bits", 18))
+    settings["weights_per_feature"] = settings["num_actions"] * CB_TYPE_PROBLEM_MULTIPLIER[settings["cb_type"]]
+
+    weights = np.zeros(2 ** settings["bits"], dtype=np.float32)
+    for index, weight in weight_items.items():
+        weights[index] = weight
+
+    weights_path = os.path.join(output_dir, LINEAR_WEIGHTS_FILE)
+    np.save(weights_path, weights)
+    with open(os.path.join(output_dir, LINEAR_METADATA_FILE), "w") as f:
+        json.dump(settings, f)
+
+    if not check_linear_model_parity(metadata_loc, weights_loc, weights_path, num_parity_checks):
+        logging.warning("Linear scorer does not match VW for model %s. Falling back to the VW process.", weights_loc)
+        return None
+    return weights_path
+
+
+def check_linear_model_parity(metadata_loc, weights_loc, linear_weights_loc, num_examples=200, num_features=20):
+    """Compares the pmf of the linear scorer with the VW process on random contexts.
+    """
+    contexts = np.random.uniform(-1, 1, size=(num_examples, num_features)).round(4).tolist()
+    vw_model = VWModel.load_vw_model(metadata_loc=metadata_loc, weights_loc=weights_loc)
+    vw_model.start()
+    try:
+        expected = vw_model.predict_many(contexts)
+    finally:
+        vw_model.close()
+    actual = LinearVWModel.load_linear_model(linear_weights_loc).predict_many(contexts)
+    # VW prints the pmf with 6 decimal digits
+    return expected.shape == actual.shape and np.allclose(expected, actual, atol=1e-4)
+
+
+class LinearVWModel:
+    def __init__(self, weights, num_actions, weights_per_feature, epsilon=DEFAULT_EPSILON, **kwargs):
+        """
+        Scores a linear --cb_explore model with vectorized numpy math.
+        Args:
+            weights (np.array): dense VW weight vector, usually memory mapped
+            num_actions (int): number of actions of the --cb_explore model
+            weights_per_feature (int): number of interleaved weights VW keeps per feature
+            epsilon (float): exploration probability of the epsilon greedy policy
+        """
+        self.logger = logging.getLogger("vw_model.LinearVWModel")
+        self.weights = weights
+        self.num_actions = num_actions
+        self.weights_per_feature = weights_per_feature
+        self.epsilon = epsilon
+        self.mask = len(weights) - 1
+        self.closed = False
+        self.bias = self._gather_weights(np.array([VW_CONSTANT_HASH]))[0]
+        self._feature_weights = {}
+
+    def _gather_weights(self, feature_hashes):
+        # VW interleaves the per-action weights of a feature: (hash * weights_per_feature + action) & mask
+        feature_hashes = feature_hashes.astype(np.int64) & self.mask
+        indices = (feature_hashes[:, None] * self.weights_per_feature + np.arange(self.num_actions)) & self.mask
+        return np.asarray(self.weights[indices], dtype=np.float64)
+
+    def _get_feature_weights(self, num_features):
+        feature_weights = self._feature_weights.get(num_features)
+        if feature_weights is None:
+            # features are named by their 1-based position, which VW hashes to the number itself
+            feature_weights = self._gather_weights(np.arange(1, num_features + 1))
+            self._feature_weights[num_features] = feature_weights
+        return feature_weights
+
+    def start(self):
+        if self.closed:
+            raise VWError("Cannot start a closed model")
+
+    def predict(self, context_vector):
+        """
+        Scores an example
+        Args:
+            context_vector (list): A vector of context features
+        Returns:
+            np.array: A numpy array of action probabilities
+        """
+        return self.predict_many([context_vector])[0]
+
+    def predict_many(self, context_vectors):
+        """
+        Scores a batch of examples with one matrix product
+        Args:
+            context_vectors (list): A list of context feature vectors
+        Returns:
+            np.array: A 2-D numpy array of action probabilities, one row per example
+        """
+        if len(context_vectors) == 0:
+            return np.empty((0, 0))
+        try:
+            contexts = np.asarray(context_vectors, dtype=np.float64)
+        except (TypeError, ValueError):
+            if len({len(np.atleast_1d(context_vector)) for context_vector in context_vectors}) > 1:
+                # contexts of different lengths are scored one by one
+                return np.vstack([self.predict(context_vector) for context_vector in context_vectors])
+            raise CustomerError("Observation values must be numbers")
+        if contexts.ndim == 1:
+            contexts = contexts.reshape(len(context_vectors), -1)
+        if not np.isfinite(contexts).all():
+            raise CustomerError("Observation values must be finite numbers")
+
+        costs = contexts.dot(self._get_feature_weights(contexts.shape[1])) + self.bias
+        greedy_actions = costs.argmin(axis=1)
+        scores = np.full(costs.shape, self.epsilon / self.num_actions)
+        scores[np.arange(len(scores)), greedy_actions] += 1 - self.epsilon
+        return scores
+
+    @staticmethod
+    def load_linear_model(linear_weights_loc):
+        """Initialize the linear scorer from weights exported by export_linear_model
+        """
+        with open(os.path.join(os.path.dirname(linear_weights_loc), LINEAR_METADATA_FILE)) as f:
+            settings = json.load(f)
+        weights = np.load(linear_weights_loc, mmap_mode="r")
+        return LinearVWModel(weights, **settings)
+
+    def close(self):
+        self.closed = True
+        return ""
@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from vw_serving.vw_model import VWError
+
+
+class _PendingPrediction:
+    __slots__ = ("context_vector", "scores", "error", "done")
+
+    def __init__(self, context_vector):
+        self.context_vector = context_vector
+        self.scores = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatchingModel:
+    def __init__(self, model, max_batch_size=32, max_delay_us=500):
+        """
+        Coalesces single predictions of concurrent request threads into one
+        predict_many call of the wrapped model. A batch is scored as soon as
+        it holds max_batch_size examples or max_delay_us microseconds after
+        its first example arrived, whichever comes first, so every prediction
+        waits at most max_delay_us before being scored. The wrapped model is
+        only called by one thread at a time.
+        Args:
+            model: scoring engine with predict and predict_many
+            max_batch_size (int): maximum number of examples scored together
+            max_delay_us (int): maximum microseconds the first example of a batch waits for others
+        """
+        self.logger = logging.getLogger("vw_model.MicroBatchingModel")
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_us / 1e6
+        self.closed = False
+        self.num_batches = 0
+        self.num_examples = 0
+        self._pending = deque()
+        self._pending_ready = threading.Condition()
+        self._model_lock = threading.Lock()
+        self._dispatcher = None
+
+    def start(self):
+        """
+        Starts the wrapped model and the thread scoring the batches
+        """
+        if self.closed:
+            raise VWError("Cannot start a closed model")
+        self.model.start()
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def _next_batch(self):
+        with self._pending_ready:
+            while not self._pending and not self.closed:
+                self._pending_ready.wait()
+            deadline = time.perf_counter() + self.max_delay
+            while len(self._pending) < self.max_batch_size and not self.closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._pending_ready.wait(remaining)
+            num_examples = min(len(self._pending), self.max_batch_size)
+            return [self._pending.popleft() for _ in range(num_examples)]
+
+    def _dispatch(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                # closed and drained
+                return
+            try:
+                with self._model_lock:
+                    scores = self.model.predict_many([pending.context_vector for pending in batch])
+                for pending, row in zip(batch, scores):
+                    pending.scores = row
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            self.num_batches += 1
+            self.num_examples += len(batch)
+            for pending in batch:
+                pending.done.set()
+
+    def predict(self, context_vector):
+        """
+        Scores an example together with the examples of concurrent calls
+        Args:
+            context_vector (list): A vector of context features
+        Returns:
+            np.array: A numpy array of action probabilities
+        """
+        pending = _PendingPrediction(context_vector)
+        with self._pending_ready:
+            if self.closed:
+                raise VWError("trying to score a closed model")
+            self._pending.append(pending)
+            self._pending_ready.notify()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.scores
+
+    def predict_many(self, context_vectors):
+        """
+        Scores a batch of examples directly on the wrapped model
+        """
+        with self._model_lock:
+            return self.model.predict_many(context_vectors)
+
+    def stats(self):
+        return {
+            "batches": self.num_batches,
+            "examples": self.num_examples,
+            "mean_batch_size": self.num_examples / self.num_batches if self.num_batches else 0.0,
+        }
+
+    def close(self):
+        """
+        Scores the pending examples, then closes the wrapped model.
+        """
+        with self._pending_ready:
+            self.closed = True
+            self._pending_ready.notify_all()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+        self.logger.info("Micro batching stats: %s", self.stats())
+        return self.model.close()
@@ -0,0 +1,204 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from vw_serving.utils import gen_random_string
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+LOCK_FILE = "index.lock"
+STAGING_PREFIX = ".staging-"
+
+
+def etag_cache_key(etag):
+    """Returns the cache key of an S3 object ETag, e.g. '"9b2cf535f27731c974343645a3985328-2"'
+    """
+    return "etag-" + re.sub(r"[^0-9A-Za-z-]", "", etag)
+
+
+def content_cache_key(md5):
+    """Returns the cache key of an artifact from the MD5 hex digest of its content
+    """
+    return "md5-" + md5
+
+
+def find_model_files(model_dir):
+    """Returns a tuple (str, str) of the vw.metadata and vw.model paths under model_dir, None if one is missing
+    """
+    model_path = Path(model_dir)
+    metadata_path = next(model_path.rglob("vw.metadata"), None)
+    weights_path = next(model_path.rglob("vw.model"), None)
+    if metadata_path is None or weights_path is None:
+        return None
+    return metadata_path.as_posix(), weights_path.as_posix()
+
+
+def get_dir_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+
+class ModelArtifactCache:
+    def __init__(self, cache_dir, max_size_bytes):
+        """
+        Local cache of extracted model artifacts keyed by S3 ETag or content hash.
+        Every entry is a directory of cache_dir. An index file records the
+        vw.metadata and vw.model paths, the size, the last use and the model
+        ids of every entry. Least recently used entries are evicted once the
+        cache grows over max_size_bytes, except the entry of the active model.
+        The index is guarded by a file lock so that several processes can
+        share the cache.
+        Args:
+            cache_dir (str): directory of the cache
+            max_size_bytes (int): size of the cache above which entries are evicted
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size_bytes = max_size_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._remove_staging_dirs()
+
+    @contextmanager
+    def _index(self):
+        """Yields the index dict under an exclusive lock and saves it afterwards
+        """
+        with open((self.cache_dir / LOCK_FILE).as_posix(), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            index_path = self.cache_dir / INDEX_FILE
+            try:
+                with open(index_path.as_posix()) as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = {"entries": {}, "active": None}
+            yield index
+            tmp_index_path = self.cache_dir / (INDEX_FILE + ".tmp")
+            with open(tmp_index_path.as_posix(), "w") as f:
+                json.dump(index, f, indent=2)
+            os.replace(tmp_index_path.as_posix(), index_path.as_posix())
+
+    def _remove_staging_dirs(self):
+        # staging directories of interrupted downloads
+        with self._index():
+            for path in self.cache_dir.glob(STAGING_PREFIX + "*"):
+                shutil.rmtree(path.as_posix(), ignore_errors=True)
+
+    def staging_dir(self):
+        """Returns a new directory to download and extract an artifact into before it is added to the cache
+        """
+        path = self.cache_dir / (STAGING_PREFIX + gen_random_string())
+        path.mkdir(parents=True)
+        return path.as_posix()
+
+    def get(self, key, model_id=None):
+        """
+        Returns a tuple (str, str) of metadata and weights paths of the entry of key, or None
+        """
+        with self._index() as index:
+            entry = index["entries"].get(key)
+            if entry is None:
+                return None
+            if not (os.path.isfile(entry["metadata_path"]) and os.path.isfile(entry["weights_path"])):
+                logger.warning(f"Dropping incomplete cache entry {key}")
+                del index["entries"][key]
+                shutil.rmtree(entry["dir"], ignore_errors=True)
+                return None
+            entry["last_used"] = time.time()
+            if model_id and model_id not in entry["model_ids"]:
+                entry["model_ids"].append(model_id)
+            return entry["metadata_path"], entry["weights_path"]
+
+    def add(self, key, staging_dir, model_id=None, model_files=None):
+        """
+        Moves an extracted artifact from staging_dir into the cache under key
+        Args:
+            key (str): cache key of the artifact
+            staging_dir (str): directory the artifact was extracted into
+            model_id (str): id of the model of the artifact
+            model_files (tuple): (str, str) of metadata and weights paths in staging_dir, found if None
+        Returns:
+            tuple: (str, str) of metadata and weights paths in the cache, None if the artifact has no model files
+        """
+        entry_dir = self.cache_dir / key
+        with self._index() as index:
+            if key in index["entries"] and entry_dir.is_dir():
+                # already added, e.g. by a concurrent prefetch
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            else:
+                shutil.rmtree(entry_dir.as_posix(), ignore_errors=True)
+                os.rename(staging_dir, entry_dir.as_posix())
+                if model_files is None:
+                    model_files = find_model_files(entry_dir.as_posix())
+                else:
+                    model_files = tuple(os.path.join(entry_dir.as_posix(), os.path.relpath(path, staging_dir))
+                                        for path in model_files)
+                if model_files is None:
+                    shutil.rmtree(entry_dir.as_posix(), ignore_errors=True)
+                    return None
+                # the downloaded archive is not needed once extracted
+                for archive in entry_dir.glob("*.tar.gz"):
+                    archive.unlink()
+                metadata_path, weights_path = model_files
+                index["entries"][key] = {
+                    "dir": entry_dir.as_posix(),
+                    "metadata_path": metadata_path,
+                    "weights_path": weights_path,
+                    "size": get_dir_size(entry_dir.as_posix()),
+                    "last_used": time.time(),
+                    "model_ids": [],
+                }
+            entry = index["entries"][key]
+            entry["last_used"] = time.time()
+            if model_id and model_id not in entry["model_ids"]:
+                entry["model_ids"].append(model_id)
+            self._evict(index)
+            return entry["metadata_path"], entry["weights_path"]
+
+    def set_active(self, model_id):
+        """
+        Protects the entry of model_id from eviction, unprotecting the entry of the previously active model
+        """
+        with self._index() as index:
+            index["active"] = next((key for key, entry in index["entries"].items()
+                                    if model_id in entry["model_ids"]), None)
+            self._evict(index)
+
+    def set_validated(self, model_id, validated):
+        """
+        Records whether the model files of model_id were loaded and scored successfully
+        """
+        with self._index() as index:
+            for entry in index["entries"].values():
+                if model_id in entry["model_ids"]:
+                    entry["validated"] = validated
+
+    def get_validated(self, model_id):
+        """
+        Returns whether the model files of model_id were validated, None if model_id is not cached or not validated
+        """
+        with self._index() as index:
+            for entry in index["entries"].values():
+                if model_id in entry["model_ids"]:
+                    return entry.get("validated")
+        return None
+
+    def _evict(self, index):
+        entries = index["entries"]
+        cache_size = sum(entry["size"] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if cache_size <= self.max_size_bytes:
+                break
+            if key == index["active"]:
+                continue
+            entry = entries.pop(key)
+            shutil.rmtree(entry["dir"], ignore_errors=True)
+            cache_size -= entry["size"]
+            logger.info(f"Evicted model artifact {key} of models {entry['model_ids']} from the model cache")
+
+    def size(self):
+        with self._index() as index:
+            return sum(entry["size"] for entry in index["entries"].values())
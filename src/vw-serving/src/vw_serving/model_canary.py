@@ -0,0 +1,151 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from vw_serving.vw_model import VWModel
+
+logger = logging.getLogger(__name__)
+
+
+class ObservationSampler:
+    def __init__(self, redis_client, channel, max_samples=1000, stream=False):
+        """
+        Keeps the most recent observations logged by the workers on the
+        experience channel, to be replayed by the canary.
+        Args:
+            redis_client (redis.Redis): client of the redis server the workers log to
+            channel (str): experience channel, or stream key if stream is True
+            max_samples (int): maximum number of observations kept
+            stream (bool): read the observations from a redis stream instead of a channel
+        """
+        self.redis_client = redis_client
+        self.channel = channel
+        self.stream = stream
+        self._observations = deque(maxlen=max_samples)
+        self._thread = threading.Thread(target=self._sample_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _sample(self, data):
+        try:
+            record = json.loads(data)
+            if record.get("type") == "actions":
+                self._observations.append(record["observation"])
+        except (ValueError, KeyError, AttributeError, TypeError):
+            pass
+
+    def _sample_forever(self):
+        if self.stream:
+            # reads past the consumer group, the records are still delivered by the stream consumers
+            last_id = "$"
+            while True:
+                for _, entries in self.redis_client.xread({self.channel: last_id}, count=100, block=1000) or []:
+                    for entry_id, fields in entries:
+                        last_id = entry_id
+                        self._sample(fields.get(b"data"))
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        for message in pubsub.listen():
+            self._sample(message["data"])
+
+    def samples(self):
+        return list(self._observations)
+
+
+def is_valid_pmf(scores, num_actions, tolerance=1e-3):
+    scores = np.asarray(scores, dtype=float)
+    return bool(scores.shape == (num_actions,) and np.all(np.isfinite(scores)) and np.all(scores >= 0)
+                and abs(scores.sum() - 1.0) <= tolerance)
+
+
+class ModelCanary:
+    def __init__(self, max_p50_ratio=1.5, max_p99_ratio=2.0, latency_slack_ms=0.5, max_invalid_pmf_rate=0.0,
+                 min_samples=1, read_timeout=None):
+        """
+        Replays observations through the hosted model and a candidate model
+        in throwaway VW processes, and refuses the candidate if its scoring
+        latency regresses or its action probabilities are not valid.
+        A latency percentile regresses when the candidate exceeds both the
+        baseline times the maximum ratio and the baseline plus latency_slack_ms,
+        so that sub-millisecond noise does not refuse a model.
+        Args:
+            max_p50_ratio (float): maximum candidate to baseline ratio of the median latency
+            max_p99_ratio (float): maximum candidate to baseline ratio of the 99th percentile latency
+            latency_slack_ms (float): latency regressions up to this many milliseconds are accepted
+            max_invalid_pmf_rate (float): maximum fraction of observations with invalid action probabilities
+            min_samples (int): minimum number of observations to compare latencies
+            read_timeout (float): seconds a VW process may take to answer
+        """
+        self.max_p50_ratio = max_p50_ratio
+        self.max_p99_ratio = max_p99_ratio
+        self.latency_slack_ms = latency_slack_ms
+        self.max_invalid_pmf_rate = max_invalid_pmf_rate
+        self.min_samples = min_samples
+        self.read_timeout = read_timeout
+
+    def _replay(self, model_files, observations):
+        metadata_path, weights_path = model_files
+        model = VWModel.load_vw_model(metadata_loc=metadata_path, weights_loc=weights_path, test_only=True,
+                                      quiet_mode=True, read_timeout=self.read_timeout)
+        model.start()
+        try:
+            # the first example waits for VW to load the model
+            model.predict(observations[0])
+            latencies = []
+            pmfs = []
+            for observation in observations:
+                start = time.perf_counter()
+                pmfs.append(model.predict(observation))
+                latencies.append(time.perf_counter() - start)
+        finally:
+            model.close()
+        latencies_ms = np.array(latencies) * 1000
+        return float(np.percentile(latencies_ms, 50)), float(np.percentile(latencies_ms, 99)), pmfs
+
+    def _regressed(self, baseline_ms, candidate_ms, max_ratio):
+        return candidate_ms > baseline_ms * max_ratio and candidate_ms > baseline_ms + self.latency_slack_ms
+
+    def evaluate(self, baseline_files, candidate_files, observations):
+        """
+        Compares the candidate model with the baseline model on observations
+        Args:
+            baseline_files (tuple): (str, str) metadata and weights paths of the hosted model
+            candidate_files (tuple): (str, str) metadata and weights paths of the candidate model
+            observations (list): context vectors to replay, an empty context is scored if there are none
+        Returns:
+            dict: the decision "passed", the reasons of a refusal and the measured statistics
+        """
+        observations = list(observations) or [[]]
+        reasons = []
+        result = {"num_samples": len(observations)}
+        try:
+            baseline_p50, baseline_p99, baseline_pmfs = self._replay(baseline_files, observations)
+            candidate_p50, candidate_p99, candidate_pmfs = self._replay(candidate_files, observations)
+        except Exception as e:
+            logger.exception("Canary replay failed")
+            return {"passed": False, "reasons": ["replay failed: {}".format(e)], **result}
+
+        num_actions = len(baseline_pmfs[0])
+        invalid_pmf_rate = float(np.mean([not is_valid_pmf(pmf, num_actions) for pmf in candidate_pmfs]))
+        result.update({
+            "baseline_p50_ms": baseline_p50,
+            "baseline_p99_ms": baseline_p99,
+            "candidate_p50_ms": candidate_p50,
+            "candidate_p99_ms": candidate_p99,
+            "num_actions": num_actions,
+            "invalid_pmf_rate": invalid_pmf_rate,
+        })
+        if invalid_pmf_rate > self.max_invalid_pmf_rate:
+            reasons.append("{:.2%} of the action probabilities are invalid or not over {} actions".format(
+                invalid_pmf_rate, num_actions))
+        if len(observations) >= self.min_samples:
+            if self._regressed(baseline_p50, candidate_p50, self.max_p50_ratio):
+                reasons.append("p50 latency regressed from {:.3f} ms to {:.3f} ms".format(baseline_p50, candidate_p50))
+            if self._regressed(baseline_p99, candidate_p99, self.max_p99_ratio):
+                reasons.append("p99 latency regressed from {:.3f} ms to {:.3f} ms".format(baseline_p99, candidate_p99))
+        return {"passed": not reasons, "reasons": reasons, **result}
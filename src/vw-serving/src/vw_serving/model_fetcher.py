@@ -0,0 +1,177 @@
+"""Streaming fetch of model.tar.gz artifacts.
+
+The archive is downloaded with parallel ranged GETs and the parts are fed, in order, straight into a
+streaming gzip/tar decoder, so the archive is never written to disk and extraction overlaps the download.
+The MD5 of the stream is checked against the ETag of single part uploads that are not encrypted, or are
+encrypted with S3 managed keys. The ETags of multipart uploads and of objects encrypted with KMS or customer
+provided keys are not an MD5 of the content, only the size is checked for them.
+"""
+import hashlib
+import io
+import logging
+import os
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from vw_serving.sagemaker.exceptions import CustomerError
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILES = ("vw.metadata", "vw.model")
+# server side encryption of objects whose single part ETag is the MD5 of their content
+MD5_ETAG_ENCRYPTIONS = (None, "AES256")
+
+
+class S3ObjectStore:
+    """Ranged reads of S3 objects through a boto3 S3 client
+    """
+
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+
+    def head(self, bucket, key):
+        """Returns a tuple (int, str, str, str) of the size, the ETag, the server side encryption and the
+        customer provided key algorithm of an object, the last two are None if not used
+        """
+        response = self.s3_client.head_object(Bucket=bucket, Key=key)
+        return (response["ContentLength"], response["ETag"], response.get("ServerSideEncryption"),
+                response.get("SSECustomerAlgorithm"))
+
+    def get_range(self, bucket, key, start, end):
+        """Returns the bytes start to end, inclusive, of an object
+        """
+        response = self.s3_client.get_object(Bucket=bucket, Key=key, Range="bytes={}-{}".format(start, end))
+        return response["Body"].read()
+
+
+class LocalObjectStore:
+    """Stand-in of S3ObjectStore reading objects from the local file system, the bucket is a directory
+    """
+
+    def __init__(self, root="/"):
+        self.root = Path(root)
+
+    def _path(self, bucket, key):
+        return (self.root / bucket / key).as_posix()
+
+    def head(self, bucket, key):
+        path = self._path(bucket, key)
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        # like the ETag of an unencrypted single part upload
+        return os.path.getsize(path), '"{}"'.format(digest.hexdigest()), None, None
+
+    def get_range(self, bucket, key, start, end):
+        with open(self._path(bucket, key), "rb") as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+
+class RangedObjectReader(io.RawIOBase):
+    def __init__(self, store, bucket, key, size, part_size=8 * 1024 * 1024, max_concurrency=8):
+        """
+        Readable stream of an object, downloaded in parts of part_size bytes
+        with up to max_concurrency ranged GETs in flight. Parts are returned in
+        order, at most max_concurrency parts are buffered.
+        Args:
+            store: S3ObjectStore or LocalObjectStore
+            bucket (str): bucket of the object
+            key (str): key of the object
+            size (int): size of the object in bytes
+            part_size (int): bytes per ranged GET
+            max_concurrency (int): maximum number of ranged GETs in flight
+        """
+        super().__init__()
+        self.md5 = hashlib.md5()
+        self.bytes_read = 0
+        self._executor = ThreadPoolExecutor(max_concurrency)
+        self._max_concurrency = max_concurrency
+        self._ranges = iter([(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)])
+        self._parts = deque()
+        self._part = memoryview(b"")
+        self._get_range = lambda byte_range: store.get_range(bucket, key, *byte_range)
+        self._request_parts()
+
+    def _request_parts(self):
+        while len(self._parts) < self._max_concurrency:
+            byte_range = next(self._ranges, None)
+            if byte_range is None:
+                return
+            self._parts.append(self._executor.submit(self._get_range, byte_range))
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._part:
+            if not self._parts:
+                return 0
+            part = self._parts.popleft().result()
+            self._request_parts()
+            self.md5.update(part)
+            self.bytes_read += len(part)
+            self._part = memoryview(part)
+        num_bytes = min(len(buffer), len(self._part))
+        buffer[:num_bytes] = self._part[:num_bytes]
+        self._part = self._part[num_bytes:]
+        return num_bytes
+
+    def close(self):
+        for part in self._parts:
+            part.cancel()
+        self._executor.shutdown(wait=False)
+        super().close()
+
+
+def etag_is_md5(etag, server_side_encryption=None, sse_customer_algorithm=None):
+    """Returns True if the ETag of an object is the MD5 of its content
+    """
+    return "-" not in etag and server_side_encryption in MD5_ETAG_ENCRYPTIONS and sse_customer_algorithm is None
+
+
+def _is_within(directory, path):
+    directory = os.path.realpath(directory)
+    return os.path.commonpath([directory, os.path.realpath(path)]) == directory
+
+
+def fetch_model_archive(store, bucket, key, extract_dir, object_info=None, part_size=8 * 1024 * 1024,
+                        max_concurrency=8):
+    """Downloads a model.tar.gz with parallel ranged GETs and extracts it into extract_dir while it streams in.
+
+    :param store: S3ObjectStore or LocalObjectStore
+    :param extract_dir: (str) directory the archive is extracted into
+    :param object_info: (tuple) size, ETag and encryption of the object returned by store.head, requested if None
+    :return: (tuple) ETag of the object, MD5 hex digest of the archive and a dict of the paths of the extracted
+      vw.metadata and vw.model files by file name
+    """
+    size, etag, server_side_encryption, sse_customer_algorithm = object_info or store.head(bucket, key)
+    logger.info(f"Fetching {size} bytes from {bucket}/{key} in parts of {part_size} bytes")
+    model_files = {}
+    with RangedObjectReader(store, bucket, key, size, part_size=part_size,
+                            max_concurrency=max_concurrency) as reader:
+        buffered_reader = io.BufferedReader(reader, buffer_size=1024 * 1024)
+        with tarfile.open(fileobj=buffered_reader, mode="r|gz") as tar:
+            for member in tar:
+                if not _is_within(extract_dir, os.path.join(extract_dir, member.name)):
+                    raise CustomerError(f"Model archive member '{member.name}' is outside of the archive")
+                if not (member.isfile() or member.isdir()):
+                    continue
+                tar.extract(member, extract_dir)
+                file_name = os.path.basename(member.name)
+                if member.isfile() and file_name in MODEL_FILES and file_name not in model_files:
+                    model_files[file_name] = os.path.join(extract_dir, member.name)
+        # the tar reader stops at the end of archive marker, the padding after it is part of the checksum
+        while buffered_reader.read(1024 * 1024):
+            pass
+        md5 = reader.md5.hexdigest()
+        if reader.bytes_read != size:
+            raise CustomerError(f"Fetched {reader.bytes_read} bytes of {bucket}/{key}, expected {size}")
+
+    etag = etag.strip('"')
+    if etag_is_md5(etag, server_side_encryption, sse_customer_algorithm) and etag != md5:
+        raise CustomerError(f"Checksum mismatch of {bucket}/{key}: MD5 is {md5}, ETag is {etag}")
+    return etag, md5, model_files
@@ -5,18 +5,32 @@ import time
 import signal
 import json
 import logging
+from decimal import Decimal
 import subprocess
 import shutil
+import threading
 import multiprocessing
+import numpy as np
+import psutil
 from multiprocessing import Process
 from pathlib import Path
 
-from vw_serving.utils import dynamic_import, parse_s3_url, gen_random_string
+from vw_serving.utils import dynamic_import, parse_s3_url
 import vw_serving.sagemaker.config.environment as environment
 from vw_serving.sagemaker import integration as integ
 from vw_serving.firehose_producer import FirehoseProducer
 from vw_serving.sagemaker.exceptions import convert_to_algorithm_error, raise_with_traceback, AlgorithmError, CustomerError
-from vw_serving.serve import REDIS_PUBLISHER_CHANNEL
+from vw_serving.serve import REDIS_PUBLISHER_CHANNEL, REDIS_UNIX_SOCKET, SCORING_BACKEND_LINEAR, \
+    SCORING_BACKEND_DAEMON, ScoringService
+from vw_serving.linear_model import export_linear_model
+from vw_serving.vw_daemon import start_vw_daemon, stop_vw_daemon
+from vw_serving.vw_model import VWModel
+from vw_serving.model_canary import ModelCanary, ObservationSampler
+from vw_serving.experience_publisher import EXPERIENCE_TRANSPORT_PUBSUB, EXPERIENCE_TRANSPORT_STREAM, \
+    EXPERIENCE_TRANSPORT_SHM
+from vw_serving.model_notifier import PollingModelNotifier, RedisModelNotifier, MODEL_UPDATES_CHANNEL
+from vw_serving.model_cache import ModelArtifactCache, etag_cache_key, content_cache_key
+from vw_serving.model_fetcher import MODEL_FILES, LocalObjectStore, S3ObjectStore, fetch_model_archive
 from boto3.dynamodb.conditions import Key
 
 
@@ -42,6 +56,25 @@ class ModelDBClient(object):
             return i
         return None
 
+    def update_canary_result(self, experiment_id, model_id, canary_result):
+        # DynamoDB numbers must be decimals
+        canary_result = json.loads(json.dumps(canary_result), parse_float=Decimal)
+        self.table_session.update_item(
+            Key={'experiment_id': experiment_id, 'model_id': model_id},
+            UpdateExpression="set canary_result=:r",
+            ExpressionAttributeValues={':r': canary_result}
+        )
+
+    def get_model_records(self, experiment_id):
+        query_kwargs = {"KeyConditionExpression": Key('experiment_id').eq(experiment_id)}
+        while True:
+            response = self.table_session.query(**query_kwargs)
+            for i in response['Items']:
+                yield i
+            if 'LastEvaluatedKey' not in response:
+                return
+            query_kwargs["ExclusiveStartKey"] = response['LastEvaluatedKey']
+
 
 class ExperimentDBClient(object):
     def __init__(self, table_session):
@@ -56,6 +89,18 @@ class ExperimentDBClient(object):
             return i
         return None
 
+    def get_next_model_to_host_id(self, experiment_id):
+        # eventually consistent read of the one attribute that is polled, at half the read capacity
+        response = self.table_session.query(
+            ConsistentRead=False,
+            KeyConditionExpression=Key('experiment_id').eq(experiment_id),
+            ProjectionExpression="hosting_workflow_metadata.next_model_to_host_id",
+            Limit=1
+        )
+        for i in response['Items']:
+            return i.get("hosting_workflow_metadata", {}).get("next_model_to_host_id", "") or None
+        return None
+
 
 class ModelManager():
     def __init__(self):
@@ -64,9 +109,22 @@ class ModelManager():
         self.model_id = os.getenv(environment.MODEL_ID, "default_model")
 
         self.poll_db = os.getenv(environment.MODEL_METADATA_POLLING, 'false').lower() == 'true'
+        self.vw_daemons = {}
 
         if self.poll_db:
             self._setup_boto_clients()
+            model_cache_dir = os.getenv(environment.MODEL_CACHE_DIR, "/opt/ml/downloads")
+            model_cache_size = int(os.getenv(environment.MODEL_CACHE_MAX_SIZE_MB, 10240)) * 1024 * 1024
+            self.model_cache = ModelArtifactCache(model_cache_dir, model_cache_size)
+            self.model_fetch_part_size = int(os.getenv(environment.MODEL_FETCH_PART_SIZE_MB, 8)) * 1024 * 1024
+            self.model_fetch_concurrency = int(os.getenv(environment.MODEL_FETCH_CONCURRENCY, 8))
+            self.prefetch_models = os.getenv(environment.MODEL_PREFETCH, 'true').lower() == 'true'
+            self.prefetch_interval = float(os.getenv(environment.MODEL_PREFETCH_INTERVAL, 60))
+            self.prefetch_count = int(os.getenv(environment.MODEL_PREFETCH_COUNT, 2))
+            self.model_notifier = self._create_model_notifier()
+            self.canary = self._create_model_canary()
+            self.observation_sampler = None
+            self.refused_model_ids = set()
 
         self.log_inference_data = os.getenv(
             environment.LOG_INFERENCE_DATA, 'false').lower() == 'true'
@@ -75,6 +133,9 @@ class ModelManager():
             if not self.firehost_stream:
                 raise AlgorithmError(
                     f"Please specify a firehose stream as '{environment.FIREHOSE_STREAM}' environment variable.")
+            self.experience_transport = ScoringService.get_experience_transport()
+            self.num_experience_consumers = int(os.getenv(environment.EXPERIENCE_CONSUMERS, 1))
+            self.stream_read_count = int(os.getenv(environment.EXPERIENCE_STREAM_READ_COUNT, 500))
 
     def _check_ddb_table_existence(self, ddb_table_resource):
         # Ensure that the table exists. Throw an error otherwise.
@@ -138,45 +199,239 @@ class ModelManager():
             producer = FirehoseProducer(self.firehost_stream)
             producer.listen_to_redis_channel(channel=REDIS_PUBLISHER_CHANNEL)
 
+        def start_firehose_consumer(consumer):
+            producer = FirehoseProducer(self.firehost_stream)
+            producer.consume_redis_stream(REDIS_PUBLISHER_CHANNEL, consumer=consumer, count=self.stream_read_count)
+
+        def start_ring_consumer(ring_dir):
+            producer = FirehoseProducer(self.firehost_stream)
+            producer.consume_shm_rings(ring_dir)
+
+        if self.experience_transport == EXPERIENCE_TRANSPORT_SHM:
+            ring_dir, ring_size = ScoringService.get_experience_ring_settings()
+            # rings of a previous run are removed before the workers create theirs
+            shutil.rmtree(ring_dir, ignore_errors=True)
+            os.makedirs(ring_dir)
+            # ring files are sparse, a full tmpfs would only show when a worker writes to its ring
+            required_bytes = ScoringService.get_num_workers() * ring_size
+            free_bytes = shutil.disk_usage(ring_dir).free
+            if free_bytes >= required_bytes:
+                consumer_process = Process(target=start_ring_consumer, args=(ring_dir,))
+                consumer_process.start()
+                logger.info(f"Started ring consumer process with PID: {consumer_process.pid}")
+                return
+            logger.warning(f"Only {free_bytes} bytes free in {ring_dir} for {required_bytes} bytes of rings, "
+                           f"publishing inference data to redis instead.")
+            # the gunicorn workers, started afterwards, inherit the transport
+            os.environ[environment.EXPERIENCE_TRANSPORT] = EXPERIENCE_TRANSPORT_PUBSUB
+            self.experience_transport = EXPERIENCE_TRANSPORT_PUBSUB
+
+        if self.experience_transport == EXPERIENCE_TRANSPORT_STREAM:
+            # consumer names are stable across restarts, so that a restarted consumer reads its pending records
+            for i in range(self.num_experience_consumers):
+                consumer_process = Process(target=start_firehose_consumer, args=(f"consumer-{i}",))
+                consumer_process.start()
+                logger.info(f"Started stream consumer process consumer-{i} with PID: {consumer_process.pid}")
+            return
+
         producer_process = Process(target=start_firehose_producer)
         producer_process.start()
         logger.info(
             f"Started producer process with PID: {producer_process.pid}")
 
+    def _get_object_store(self, s3_uri):
+        """
+        Returns a tuple of the object store, bucket and key of an s3:// URI, or of a file:// URI for local testing
+        """
+        if s3_uri.startswith("file://"):
+            bucket, key = parse_s3_url(s3_uri.replace("file://", "").lstrip("/"))
+            return LocalObjectStore("/"), bucket, key
+        bucket, key = parse_s3_url(s3_uri)
+        return S3ObjectStore(self.s3_resource.meta.client), bucket, key
+
+    def _start_model_prefetcher(self):
+        prefetcher_process = Process(target=self._prefetch_candidate_models_forever)
+        prefetcher_process.daemon = True
+        prefetcher_process.start()
+        logger.info(f"Started model prefetcher process with PID: {prefetcher_process.pid}")
+
+    def _prefetch_candidate_models_forever(self):
+        # prefetching must not slow down scoring, run with the lowest CPU and I/O priority
+        os.nice(19)
+        try:
+            psutil.Process().ionice(psutil.IOPRIO_CLASS_IDLE)
+        except (AttributeError, psutil.Error):
+            logger.warning("Unable to lower the I/O priority of the model prefetcher")
+        # boto3 sessions must not be shared with the parent process
+        self._setup_boto_clients()
+        redis_client = redis.Redis()
+        while True:
+            try:
+                hosted_model_id = redis_client.get("model_id")
+                self._prefetch_candidate_models(hosted_model_id.decode() if hosted_model_id else self.model_id)
+            except Exception as e:
+                logger.exception(f"Could not prefetch candidate models due to {e}")
+            time.sleep(self.prefetch_interval)
+
+    def _get_candidate_model_ids(self, hosted_model_id):
+        """
+        Returns the ids of the most recently trained models of the experiment that are not hosted, newest first
+        """
+        candidates = [record for record in self.model_ddb_wrapper.get_model_records(self.experiment_id)
+                      if record.get("s3_model_output_path") and record["model_id"] != hosted_model_id
+                      and record.get("train_state", "TRAINED") == "TRAINED"]
+        candidates.sort(key=lambda record: (str(record.get("train_finish_time", "")), record["model_id"]),
+                        reverse=True)
+        return [record["model_id"] for record in candidates[:self.prefetch_count]]
+
+    def _prefetch_candidate_models(self, hosted_model_id):
+        """
+        Fetches candidate models into the model cache and validates them, so that promoting one of them does
+        not have to download it
+        """
+        shadow_model = None
+        for model_id in self._get_candidate_model_ids(hosted_model_id):
+            validated = self.model_cache.get_validated(model_id)
+            if validated is None:
+                logger.info(f"Prefetching candidate Model ID: {model_id}")
+                model_files = self._download_and_extract_model_tar_gz(model_id=model_id)
+                if model_files:
+                    validated = self._validate_model(*model_files)
+                    self.model_cache.set_validated(model_id, validated)
+                    logger.info(f"Prefetched candidate Model ID: {model_id}, validated: {validated}")
+            if validated and shadow_model is None:
+                shadow_model = model_id
+        if ScoringService.get_shadow_scoring():
+            self._publish_shadow_model(shadow_model)
+
+    def _publish_shadow_model(self, model_id):
+        """
+        Makes model_id, the newest validated candidate model, the model workers shadow score with, None to stop
+        shadow scoring
+        """
+        redis_client = redis.Redis()
+        shadow_model_id = redis_client.get("shadow_model_id")
+        if (shadow_model_id.decode() if shadow_model_id else None) == model_id:
+            return
+        if model_id is None:
+            redis_client.delete("shadow_model_id")
+            return
+        metadata_path, weights_path = self._download_and_extract_model_tar_gz(model_id=model_id)
+        redis_client.set("{}:weights".format(model_id), weights_path)
+        redis_client.set("{}:metadata".format(model_id), metadata_path)
+        redis_client.set("shadow_model_id", model_id)
+        logger.info(f"Workers shadow score with Model ID: {model_id}")
+
+    @staticmethod
+    def _validate_model(metadata_path, weights_path):
+        """
+        Returns whether the model loads and scores in a throwaway VW process
+        """
+        model = VWModel.load_vw_model(metadata_loc=metadata_path, weights_loc=weights_path, test_only=True,
+                                      quiet_mode=True, read_timeout=ScoringService.get_vw_read_timeout())
+        try:
+            model.start()
+            scores = model.predict([])
+            return bool(len(scores) > 0 and np.all(np.isfinite(scores)))
+        except Exception as e:
+            logger.warning(f"Model {weights_path} failed validation due to {e}")
+            return False
+        finally:
+            model.close()
+
     def _download_and_extract_model_tar_gz(self, model_id):
         """
         This function first gets the s3 location from dynamo db,
-        downloads the model, extracts it and then
-        returns a tuple (str, str) of metadata string and model weights URL on disk
+        downloads the model, extracts it into the local model cache and then
+        returns a tuple (str, str) of metadata string and model weights URL on disk.
+        Models already in the cache, e.g. on rollback, are not downloaded again.
         """
         deployable_model_id_record = self.model_ddb_wrapper.get_model_record(experiment_id=self.experiment_id,
                                                                              model_id=model_id)
         s3_uri = deployable_model_id_record.get("s3_model_output_path", "")
         if s3_uri:
+            tmp_dir = None
             try:
-                tmp_dir = Path(f"/opt/ml/downloads/{gen_random_string()}")
-                tmp_dir.mkdir(parents=True, exist_ok=True)
-                tmp_model_tar_gz = os.path.join(tmp_dir.as_posix(), "model.tar.gz")
-                bucket, key = parse_s3_url(s3_uri)
-                self.s3_resource.Bucket(bucket).download_file(key, tmp_model_tar_gz)
-                shutil.unpack_archive(filename=tmp_model_tar_gz, extract_dir=tmp_dir.as_posix())
-                return self.get_model(tmp_dir.as_posix())
+                store, bucket, key = self._get_object_store(s3_uri)
+                object_info = store.head(bucket, key)
+                etag = object_info[1]
+                cache_key = etag_cache_key(etag) if etag else None
+                if cache_key:
+                    model_files = self.model_cache.get(cache_key, model_id=model_id)
+                    if model_files:
+                        logger.info(f"Using cached artifacts of {model_id}")
+                        return model_files
+
+                tmp_dir = self.model_cache.staging_dir()
+                _, md5, model_files = fetch_model_archive(store, bucket, key, tmp_dir, object_info=object_info,
+                                                          part_size=self.model_fetch_part_size,
+                                                          max_concurrency=self.model_fetch_concurrency)
+                if any(file_name not in model_files for file_name in MODEL_FILES):
+                    raise CustomerError("'vw.metadata' or 'vw.model' not found in model files.")
+                return self.model_cache.add(cache_key or content_cache_key(md5), tmp_dir, model_id=model_id,
+                                            model_files=(model_files["vw.metadata"], model_files["vw.model"]))
             except Exception as e:
                 logger.exception(f"Could not parse or download {model_id} from {s3_uri} due to {e}")
+                if tmp_dir:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
                 return None
         else:
             logger.exception(f"Could not s3 location of {model_id}")
             return None
 
-    def _check_for_new_model(self):
-        experiment_record = self.exp_ddb_wrapper.get_experiment_record(self.experiment_id)
-        # if experiment_record.get("hosting_state", "") == "PENDING":
-        next_model_to_host_id = experiment_record.get("hosting_workflow_metadata", {}).get("next_model_to_host_id", "")
-        if next_model_to_host_id:
-            if next_model_to_host_id != self.model_id:
-                return next_model_to_host_id
-            else:
-                return None
+    def _create_model_canary(self):
+        if os.getenv(environment.MODEL_CANARY, 'true').lower() != 'true':
+            return None
+        return ModelCanary(max_p50_ratio=float(os.getenv(environment.CANARY_MAX_P50_RATIO, 1.5)),
+                           max_p99_ratio=float(os.getenv(environment.CANARY_MAX_P99_RATIO, 2.0)),
+                           latency_slack_ms=float(os.getenv(environment.CANARY_LATENCY_SLACK_MS, 0.5)),
+                           max_invalid_pmf_rate=float(os.getenv(environment.CANARY_MAX_INVALID_PMF_RATE, 0.0)),
+                           min_samples=int(os.getenv(environment.CANARY_MIN_SAMPLES, 100)),
+                           read_timeout=ScoringService.get_vw_read_timeout())
+
+    def _start_observation_sampler(self, redis_client):
+        max_samples = int(os.getenv(environment.CANARY_SAMPLES, 1000))
+        self.observation_sampler = ObservationSampler(
+            redis_client, REDIS_PUBLISHER_CHANNEL, max_samples=max_samples,
+            stream=self.experience_transport == EXPERIENCE_TRANSPORT_STREAM)
+        self.observation_sampler.start()
+
+    def _canary_passed(self, model_id, model_files):
+        """
+        Replays recent observations through the hosted model and model_id and records the decision in the model
+        record of model_id
+        """
+        observations = self.observation_sampler.samples() if self.observation_sampler else []
+        canary_result = self.canary.evaluate(self.model_files, model_files, observations)
+        if canary_result["passed"]:
+            logger.info(f"Model ID: {model_id} passed the canary: {canary_result}")
+        else:
+            logger.warning(f"Model ID: {model_id} failed the canary and will not be hosted: {canary_result}")
+        try:
+            self.model_ddb_wrapper.update_canary_result(self.experiment_id, model_id, canary_result)
+        except Exception as e:
+            logger.exception(f"Could not record the canary result of {model_id} due to {e}")
+        return canary_result["passed"]
+
+    def _create_model_notifier(self):
+        """
+        Returns the notifier of the next model to host selected by the MODEL_UPDATE_NOTIFIER environment variable,
+        "polling" (default) or "redis"
+        """
+        notifier_type = os.getenv(environment.MODEL_UPDATE_NOTIFIER, "polling").lower()
+        poller = PollingModelNotifier(
+            lambda: self.exp_ddb_wrapper.get_next_model_to_host_id(self.experiment_id),
+            min_interval=float(os.getenv(environment.MODEL_POLL_MIN_INTERVAL, 1)),
+            max_interval=float(os.getenv(environment.MODEL_POLL_MAX_INTERVAL, 10)))
+        if notifier_type == "polling":
+            return poller
+        if notifier_type == "redis":
+            redis_url = os.getenv(environment.MODEL_UPDATE_REDIS_URL, "")
+            redis_client = redis.Redis.from_url(redis_url) if redis_url else redis.Redis()
+            channel = os.getenv(environment.MODEL_UPDATE_CHANNEL, MODEL_UPDATES_CHANNEL)
+            return RedisModelNotifier(redis_client, poller, channel=channel)
+        raise CustomerError(f"Model update notifier '{notifier_type}' not supported. "
+                            f"Supported notifiers are: polling, redis")
 
     def get_model(self, disk_path=None, model_id=None):
         """
@@ -197,6 +452,43 @@ class ModelManager():
         elif model_id:
             return self._download_and_extract_model_tar_gz(model_id=model_id)
 
+    def _publish_model(self, redis_client, model_id, metadata_path, weights_path):
+        """
+        Stores the artifact locations of model_id in redis and makes it the model to serve
+        """
+        redis_client.set("{}:weights".format(model_id), weights_path)
+        redis_client.set("{}:metadata".format(model_id), metadata_path)
+        if ScoringService.get_scoring_backend() == SCORING_BACKEND_LINEAR:
+            try:
+                linear_weights_path = export_linear_model(metadata_path, weights_path)
+            except Exception as e:
+                logger.exception(f"Could not export linear weights of model {model_id} due to {e}")
+                linear_weights_path = None
+            if linear_weights_path:
+                redis_client.set("{}:linear_weights".format(model_id), linear_weights_path)
+        if ScoringService.get_scoring_backend() == SCORING_BACKEND_DAEMON:
+            try:
+                num_children = ScoringService.get_num_workers() * ScoringService.get_vw_processes_per_worker()
+                daemon_proc, daemon_port = start_vw_daemon(metadata_path, weights_path, num_children)
+            except Exception as e:
+                logger.exception(f"Could not start a VW daemon for model {model_id} due to {e}")
+            else:
+                self.vw_daemons[model_id] = daemon_proc
+                redis_client.set("{}:daemon_port".format(model_id), daemon_port)
+        redis_client.set("model_id", model_id)
+
+    def _unpublish_model(self, redis_client, model_id):
+        redis_client.delete(model_id)
+        redis_client.delete("{}:weights".format(model_id))
+        redis_client.delete("{}:metadata".format(model_id))
+        redis_client.delete("{}:linear_weights".format(model_id))
+        redis_client.delete("{}:daemon_port".format(model_id))
+        daemon_proc = self.vw_daemons.pop(model_id, None)
+        if daemon_proc is not None:
+            # let the workers of the old model finish their requests before stopping its daemon
+            grace_seconds = int(ScoringService._get_server_config().timeout)
+            threading.Timer(grace_seconds, stop_vw_daemon, args=(daemon_proc,)).start()
+
     def serve(self):
         if self.sagemaker_tar_gz:
             metadata_path, weights_path = self.get_model(disk_path=integ.ARTIFACTS_VOLUME)
@@ -204,9 +496,12 @@ class ModelManager():
             metadata_path, weights_path = self.get_model(model_id=self.model_id)
 
         redis_client = redis.Redis()
-        redis_client.set("model_id", self.model_id)
-        redis_client.set("{}:weights".format(self.model_id), weights_path)
-        redis_client.set("{}:metadata".format(self.model_id), metadata_path)
+        self._publish_model(redis_client, self.model_id, metadata_path, weights_path)
+        self.model_files = (metadata_path, weights_path)
+        if self.poll_db:
+            self.model_cache.set_active(self.model_id)
+            if self.canary is not None and self.log_inference_data:
+                self._start_observation_sampler(redis_client)
 
         if self.log_inference_data:
             self._start_experience_logger()
@@ -214,32 +509,39 @@ class ModelManager():
         logger.info("Starting gunicorn...")
         self._start_gunicorn_server()
         logger.info("Started gunicorn.")
-        sleep_seconds = 1
+        if self.poll_db and self.prefetch_models:
+            self._start_model_prefetcher()
         if self.poll_db:
             while True:
-                time.sleep(sleep_seconds)
-                next_model_to_host_id = self._check_for_new_model()
+                next_model_to_host_id = self.model_notifier.wait_for_new_model(self.model_id)
+                if next_model_to_host_id in self.refused_model_ids:
+                    continue
                 # logger.info("Fetching latest model from Dynamo")
                 if next_model_to_host_id:
                     logger.info(
                         f"Found new model! Trying to replace Model ID: {self.model_id} with Model ID: {next_model_to_host_id}")
 
+                    if self.model_cache.get_validated(next_model_to_host_id) is False:
+                        logger.warning(f"Model ID: {next_model_to_host_id} failed validation when it was prefetched")
                     try:
                         metadata, weights = self.get_model(model_id=next_model_to_host_id)
+                        if self.canary is not None and not self._canary_passed(next_model_to_host_id,
+                                                                               (metadata, weights)):
+                            self.refused_model_ids.add(next_model_to_host_id)
+                            continue
 
-                        # Delete the old model
-                        redis_client.delete(self.model_id)
-                        redis_client.delete("{}:weights".format(self.model_id))
-                        redis_client.delete("{}:weights".format(self.model_id))
-
+                        previous_model_id = self.model_id
                         self.model_id = next_model_to_host_id
-                        redis_client.set("model_id", self.model_id)
-                        redis_client.set("{}:weights".format(self.model_id), weights)
-                        redis_client.set("{}:metadata".format(self.model_id), metadata)
-                        self._restart_gunicorn_workers()
+                        self._publish_model(redis_client, self.model_id, metadata, weights)
+                        self.model_files = (metadata, weights)
+                        self.model_cache.set_active(self.model_id)
+
+                        # Delete the old model, workers that still serve it have already loaded it
+                        self._unpublish_model(redis_client, previous_model_id)
+                        if not ScoringService.get_model_swap_in_worker():
+                            self._restart_gunicorn_workers()
                     except Exception as e:
                         logger.exception(f"Error happened when deploying model {next_model_to_host_id} due to {e}")
-                        # TODO: Have a mechanism of testing if the model prediction works
 
 
 def start_redis_server():
@@ -250,7 +552,10 @@ def start_redis_server():
     if stdout.decode().strip() == "PONG":
         logger.info("Redis server is already running.")
     else:
-        p = subprocess.Popen("redis-server --bind 0.0.0.0 --loglevel warning", shell=True, stderr=subprocess.STDOUT)
+        # workers on the host publish experiences over the unix socket, which skips the TCP stack
+        redis_unix_socket = os.getenv(environment.REDIS_UNIX_SOCKET, REDIS_UNIX_SOCKET)
+        p = subprocess.Popen("redis-server --bind 0.0.0.0 --unixsocket {} --unixsocketperm 700 --loglevel warning"
+                             .format(redis_unix_socket), shell=True, stderr=subprocess.STDOUT)
         time.sleep(3)
         if p.poll() is not None:
             raise RuntimeError("Could not start Redis server.")
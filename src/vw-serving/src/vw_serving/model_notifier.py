@@ -0,0 +1,157 @@
+"""Notification of the model to host next.
+
+ModelManager waits on a notifier for the id of the next model to host instead of querying the experiment
+table every second:
+
+* PollingModelNotifier reads the experiment table with exponential back-off while the next model id does
+  not change.
+* RedisModelNotifier is pushed the next model id over redis pub/sub, or a keyspace notification of a key
+  holding it, and polls the experiment table at the back-off interval as a safety net for lost messages.
+* InMemoryModelNotifier is published to directly, e.g. by tests.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MODEL_UPDATES_CHANNEL = "MODEL_UPDATES"
+NEXT_MODEL_KEY = "next_model_to_host_id"
+
+
+class PollingModelNotifier:
+    def __init__(self, read_next_model_id, min_interval=1, max_interval=10, backoff_factor=2):
+        """
+        Polls the next model id, doubling the interval between two reads up to
+        max_interval while the id does not change, and going back to
+        min_interval once it changes.
+        Args:
+            read_next_model_id (callable): returns the id of the next model to host, or None
+            min_interval (float): seconds between two reads after a change
+            max_interval (float): maximum seconds between two reads
+            backoff_factor (float): growth of the interval after a read without change
+        """
+        self.read_next_model_id = read_next_model_id
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.interval = min_interval
+        self.num_reads = 0
+        self._last_seen_model_id = None
+
+    def poll(self):
+        """Reads the next model id and adapts the polling interval
+        """
+        next_model_id = self.read_next_model_id()
+        self.num_reads += 1
+        if next_model_id != self._last_seen_model_id:
+            self._last_seen_model_id = next_model_id
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff_factor, self.max_interval)
+        return next_model_id
+
+    def wait_for_new_model(self, hosted_model_id):
+        """Waits for the current polling interval, then returns the next model id if it is not hosted, else None
+        """
+        time.sleep(self.interval)
+        next_model_id = self.poll()
+        return next_model_id if next_model_id and next_model_id != hosted_model_id else None
+
+    def close(self):
+        pass
+
+
+class RedisModelNotifier:
+    def __init__(self, redis_client, poller, channel=MODEL_UPDATES_CHANNEL, next_model_key=NEXT_MODEL_KEY):
+        """
+        Receives the next model id over redis. Messages of channel carry the
+        next model id. A keyspace notification of next_model_key means the key
+        was written, and the id is read from it. Pub/sub messages are lost
+        while disconnected, so poller is still read at its back-off interval.
+        If redis cannot be subscribed to, the notifier only polls, and
+        subscribes again at every poll.
+        Args:
+            redis_client (redis.Redis): client of the redis server the orchestrator publishes to
+            poller (PollingModelNotifier): fallback reader of the next model id
+            channel (str): pub/sub channel of next model ids
+            next_model_key (str): key holding the next model id
+        """
+        self.redis_client = redis_client
+        self.poller = poller
+        self.channel = channel
+        self.next_model_key = next_model_key
+        self.num_messages = 0
+        self.subscribed = False
+        self._pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        self._subscribe()
+        self._next_poll = time.monotonic() + poller.interval
+
+    def _subscribe(self):
+        try:
+            self._pubsub.subscribe(self.channel)
+            self._pubsub.psubscribe("__keyspace@*__:{}".format(self.next_model_key))
+            self.subscribed = True
+        except Exception:
+            logger.exception("Unable to subscribe to model updates on redis, polling instead")
+
+    def _read_message(self, timeout):
+        message = self._pubsub.get_message(timeout=timeout)
+        if message is None:
+            return None
+        self.num_messages += 1
+        if message["type"] == "pmessage":
+            # keyspace notification, the message is the name of the command, e.g. "set"
+            next_model_id = self.redis_client.get(self.next_model_key)
+        else:
+            next_model_id = message["data"]
+        return next_model_id.decode() if isinstance(next_model_id, bytes) else next_model_id
+
+    def wait_for_new_model(self, hosted_model_id):
+        """Waits for a pushed model id until the next fallback poll, returns it if it is not hosted, else None
+        """
+        timeout = max(self._next_poll - time.monotonic(), 0)
+        next_model_id = None
+        if not self.subscribed:
+            time.sleep(timeout)
+        else:
+            try:
+                next_model_id = self._read_message(timeout)
+            except Exception:
+                logger.exception("Unable to read model updates from redis")
+                time.sleep(timeout)
+        if next_model_id is None and time.monotonic() >= self._next_poll:
+            if not self.subscribed:
+                self._subscribe()
+            next_model_id = self.poller.poll()
+            self._next_poll = time.monotonic() + self.poller.interval
+        return next_model_id if next_model_id and next_model_id != hosted_model_id else None
+
+    def close(self):
+        self._pubsub.close()
+
+
+class InMemoryModelNotifier:
+    def __init__(self, timeout=1):
+        """
+        Notifier published to in process, the stand-in of the other notifiers in tests
+        Args:
+            timeout (float): maximum seconds wait_for_new_model blocks
+        """
+        self.timeout = timeout
+        self._next_model_id = None
+        self._changed = threading.Condition()
+
+    def publish(self, model_id):
+        with self._changed:
+            self._next_model_id = model_id
+            self._changed.notify_all()
+
+    def wait_for_new_model(self, hosted_model_id):
+        with self._changed:
+            self._changed.wait_for(lambda: self._next_model_id not in (None, hosted_model_id), timeout=self.timeout)
+            next_model_id = self._next_model_id
+        return next_model_id if next_model_id and next_model_id != hosted_model_id else None
+
+    def close(self):
+        pass
@@ -0,0 +1,105 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from queue import Queue
+
+import numpy as np
+
+from vw_serving.vw_model import VWError
+
+
+class VWModelPool:
+    def __init__(self, models, min_shard_size=64):
+        """
+        Pool of VW models of the same weights. A batch of examples is split in
+        contiguous shards that are scored in parallel on different models, and
+        single models can be checked out by threaded workers.
+        Args:
+            models (list): VW models to pool, usually VWModel instances
+            min_shard_size (int): minimum number of examples scored by one model of a batch
+        """
+        self.logger = logging.getLogger("vw_model.VWModelPool")
+        if len(models) == 0:
+            raise VWError("Cannot create a pool without models")
+
+        self.models = models
+        self.min_shard_size = min_shard_size
+        self.closed = False
+        self._available_models = Queue()
+        self._executor = ThreadPoolExecutor(len(models))
+
+    def start(self):
+        """
+        Starts every model of the pool
+        """
+        if self.closed:
+            raise VWError("Cannot start a closed model pool")
+        for model in self.models:
+            model.start()
+            self._available_models.put(model)
+        self.logger.info("Started a pool of %s VW models", len(self.models))
+
+    def checkout(self, timeout=None):
+        """
+        Takes a model out of the pool, waiting for one to be checked in if all of them are in use
+        """
+        return self._available_models.get(timeout=timeout)
+
+    def checkin(self, model):
+        """
+        Returns a model to the pool
+        """
+        self._available_models.put(model)
+
+    @contextmanager
+    def model(self, timeout=None):
+        model = self.checkout(timeout=timeout)
+        try:
+            yield model
+        finally:
+            self.checkin(model)
+
+    def predict(self, context_vector):
+        """
+        Scores an example on the first available model
+        Args:
+            context_vector (list): A vector of context features
+        Returns:
+            np.array: A numpy array of action probabilities
+        """
+        with self.model() as model:
+            return model.predict(context_vector)
+
+    def _predict_shard(self, context_vectors):
+        with self.model() as model:
+            return model.predict_many(context_vectors)
+
+    def predict_many(self, context_vectors):
+        """
+        Scores a batch of examples, sharding the rows across the models of the pool
+        Args:
+            context_vectors (list): A list of context feature vectors
+        Returns:
+            np.array: A 2-D numpy array of action probabilities, in the order of the examples
+        """
+        num_examples = len(context_vectors)
+        if num_examples == 0:
+            return np.empty((0, 0))
+
+        num_shards = max(min(len(self.models), num_examples // self.min_shard_size), 1)
+        if num_shards == 1:
+            return self._predict_shard(context_vectors)
+
+        boundaries = np.linspace(0, num_examples, num_shards + 1).astype(int)
+        futures = [self._executor.submit(self._predict_shard, context_vectors[start:end])
+                   for start, end in zip(boundaries[:-1], boundaries[1:])]
+        return np.vstack([future.result() for future in futures])
+
+    def close(self):
+        """
+        Closes every model of the pool.
+        """
+        self._executor.shutdown()
+        training_info = [model.close() for model in self.models]
+        self.closed = True
+        return training_info
@@ -0,0 +1,202 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from vw_serving.sagemaker.exceptions import CustomerError
+
+REDIS_KEY_PREFIX = "pmf_cache"
+
+
+class PredictionCache:
+    def __init__(self, max_entries=10000, ttl_seconds=None, redis_client=None, redis_ttl_seconds=300):
+        """
+        Bounded LRU cache of action probabilities keyed by model and observation,
+        with an optional second tier shared through redis.
+        Args:
+            max_entries (int): maximum number of entries kept in memory
+            ttl_seconds (float): seconds an in memory entry is valid, None for no expiry
+            redis_client (redis.Redis): client of the shared second tier, None to disable it
+            redis_ttl_seconds (int): seconds an entry is kept in redis
+        """
+        self.logger = logging.getLogger("vw_model.PredictionCache")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.redis_client = redis_client
+        self.redis_ttl_seconds = redis_ttl_seconds
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_id, context_vector):
+        try:
+            values = np.asarray(context_vector, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise CustomerError("Observation values must be numbers, got {!r}".format(context_vector))
+        digest = hashlib.blake2b(values.tobytes(), digest_size=16)
+        return "{}:{}".format(model_id, digest.hexdigest())
+
+    def get(self, key):
+        """
+        Returns the cached action probabilities of key, or None
+        """
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """
+        Returns the cached action probabilities of every key, None for the
+        keys not cached. The keys missing in memory are read from redis with
+        a single MGET.
+        """
+        now = time.monotonic()
+        scores_list = [None] * len(keys)
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                scores, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    scores_list[i] = scores
+                else:
+                    del self._entries[key]
+
+        missing = [i for i, scores in enumerate(scores_list) if scores is None]
+        if missing and self.redis_client is not None:
+            try:
+                values = self.redis_client.mget(["{}:{}".format(REDIS_KEY_PREFIX, keys[i]) for i in missing])
+            except Exception:
+                self.logger.exception("Unable to read %s entries of the shared prediction cache", len(missing))
+                values = [None] * len(missing)
+            redis_hits = [(i, np.frombuffer(value, dtype=np.float64))
+                          for i, value in zip(missing, values) if value is not None]
+            for i, scores in redis_hits:
+                scores_list[i] = scores
+            self._put_local([(keys[i], scores) for i, scores in redis_hits])
+            with self._lock:
+                self.redis_hits += len(redis_hits)
+
+        with self._lock:
+            self.misses += sum(1 for scores in scores_list if scores is None)
+        return scores_list
+
+    def _put_local(self, items):
+        expires_at = None if self.ttl_seconds is None else time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for key, scores in items:
+                self._entries[key] = (scores, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key, scores):
+        """
+        Caches the action probabilities of key
+        """
+        self.put_many([(key, scores)])
+
+    def put_many(self, items):
+        """
+        Caches the action probabilities of a list of (key, scores) tuples.
+        They are written to redis with a single non-transactional pipeline.
+        """
+        items = [(key, np.array(scores, dtype=np.float64)) for key, scores in items]
+        for _, scores in items:
+            scores.setflags(write=False)
+        self._put_local(items)
+        if self.redis_client is not None and items:
+            try:
+                pipeline = self.redis_client.pipeline(transaction=False)
+                for key, scores in items:
+                    pipeline.set("{}:{}".format(REDIS_KEY_PREFIX, key), scores.tobytes(), ex=self.redis_ttl_seconds)
+                pipeline.execute()
+            except Exception:
+                self.logger.exception("Unable to write %s entries of the shared prediction cache", len(items))
+
+    def invalidate(self):
+        """
+        Drops every in memory entry. Entries in redis are keyed by model and expire on their own.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.redis_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+            }
+
+
+class CachedVWModel:
+    def __init__(self, model, cache, model_id, stats_log_interval=10000):
+        """
+        Serves the action probabilities of repeated observations from a
+        PredictionCache and scores the others on the wrapped model. Only valid
+        for --testonly models, whose scores are deterministic.
+        Args:
+            model: scoring engine with predict and predict_many
+            cache (PredictionCache): cache of action probabilities
+            model_id (str): id of the model, part of every cache key
+            stats_log_interval (int): number of lookups between two logs of the cache counters
+        """
+        self.logger = logging.getLogger("vw_model.CachedVWModel")
+        self.model = model
+        self.cache = cache
+        self.model_id = model_id
+        self.stats_log_interval = stats_log_interval
+        self._lookups = 0
+
+    def start(self):
+        self.model.start()
+
+    def _count_lookups(self, num_lookups):
+        previous_lookups = self._lookups
+        self._lookups += num_lookups
+        if self._lookups // self.stats_log_interval > previous_lookups // self.stats_log_interval:
+            self.logger.info("Prediction cache of Model ID:%s: %s", self.model_id, self.cache.stats())
+
+    def predict(self, context_vector):
+        key = self.cache.key(self.model_id, context_vector)
+        self._count_lookups(1)
+        scores = self.cache.get(key)
+        if scores is None:
+            scores = self.model.predict(context_vector)
+            self.cache.put(key, scores)
+        return scores
+
+    def predict_many(self, context_vectors):
+        num_examples = len(context_vectors)
+        if num_examples == 0:
+            return np.empty((0, 0))
+        self._count_lookups(num_examples)
+        keys = [self.cache.key(self.model_id, context_vector) for context_vector in context_vectors]
+        cached_scores = self.cache.get_many(keys)
+        # repeated observations of the batch are scored once
+        missing = OrderedDict()
+        for i, scores in enumerate(cached_scores):
+            if scores is None:
+                missing.setdefault(keys[i], []).append(i)
+        if missing:
+            missing_scores = self.model.predict_many([context_vectors[rows[0]] for rows in missing.values()])
+            self.cache.put_many(zip(missing.keys(), missing_scores))
+            for rows, scores in zip(missing.values(), missing_scores):
+                for i in rows:
+                    cached_scores[i] = scores
+        return np.vstack(cached_scores)
+
+    def close(self):
+        self.cache.invalidate()
+        return self.model.close()
@@ -23,6 +23,56 @@ LOG_INFERENCE_DATA = "LOG_INFERENCE_DATA"
 KINESIS_QUEUE = "KINESIS_QUEUE"
 FIREHOSE_STREAM = "FIREHOSE_STREAM"
 FIREHOSE_BUFFER_ON = "FIREHOSE_BUFFER_ON"
+FIREHOSE_MAX_IN_FLIGHT = "FIREHOSE_MAX_IN_FLIGHT"
+FIREHOSE_AGGREGATE = "FIREHOSE_AGGREGATE"
+FIREHOSE_AGGREGATE_GZIP = "FIREHOSE_AGGREGATE_GZIP"
+VW_SCORING_BACKEND = "VW_SCORING_BACKEND"
+VW_PROCESSES_PER_WORKER = "VW_PROCESSES_PER_WORKER"
+VW_READ_TIMEOUT = "VW_READ_TIMEOUT"
+VW_WARM_STANDBY = "VW_WARM_STANDBY"
+PREDICTION_CACHE_SIZE = "PREDICTION_CACHE_SIZE"
+PREDICTION_CACHE_TTL = "PREDICTION_CACHE_TTL"
+PREDICTION_CACHE_REDIS = "PREDICTION_CACHE_REDIS"
+BATCH_CHUNK_ROWS = "BATCH_CHUNK_ROWS"
+WORKER_THREADS = "WORKER_THREADS"
+MICRO_BATCH_MAX_SIZE = "MICRO_BATCH_MAX_SIZE"
+MICRO_BATCH_MAX_DELAY_US = "MICRO_BATCH_MAX_DELAY_US"
+CPU_AFFINITY = "CPU_AFFINITY"
+MODEL_SWAP_IN_WORKER = "MODEL_SWAP_IN_WORKER"
+MODEL_WATCH_INTERVAL = "MODEL_WATCH_INTERVAL"
+MODEL_CACHE_DIR = "MODEL_CACHE_DIR"
+MODEL_CACHE_MAX_SIZE_MB = "MODEL_CACHE_MAX_SIZE_MB"
+MODEL_FETCH_PART_SIZE_MB = "MODEL_FETCH_PART_SIZE_MB"
+MODEL_FETCH_CONCURRENCY = "MODEL_FETCH_CONCURRENCY"
+MODEL_PREFETCH = "MODEL_PREFETCH"
+MODEL_PREFETCH_INTERVAL = "MODEL_PREFETCH_INTERVAL"
+MODEL_PREFETCH_COUNT = "MODEL_PREFETCH_COUNT"
+MODEL_UPDATE_NOTIFIER = "MODEL_UPDATE_NOTIFIER"
+MODEL_UPDATE_REDIS_URL = "MODEL_UPDATE_REDIS_URL"
+MODEL_UPDATE_CHANNEL = "MODEL_UPDATE_CHANNEL"
+MODEL_POLL_MIN_INTERVAL = "MODEL_POLL_MIN_INTERVAL"
+MODEL_POLL_MAX_INTERVAL = "MODEL_POLL_MAX_INTERVAL"
+MODEL_CANARY = "MODEL_CANARY"
+CANARY_SAMPLES = "CANARY_SAMPLES"
+CANARY_MIN_SAMPLES = "CANARY_MIN_SAMPLES"
+CANARY_MAX_P50_RATIO = "CANARY_MAX_P50_RATIO"
+CANARY_MAX_P99_RATIO = "CANARY_MAX_P99_RATIO"
+CANARY_LATENCY_SLACK_MS = "CANARY_LATENCY_SLACK_MS"
+CANARY_MAX_INVALID_PMF_RATE = "CANARY_MAX_INVALID_PMF_RATE"
+SHADOW_SCORING = "SHADOW_SCORING"
+SHADOW_SAMPLE_RATE = "SHADOW_SAMPLE_RATE"
+SHADOW_QUEUE_SIZE = "SHADOW_QUEUE_SIZE"
+EXPERIENCE_BUFFER_SIZE = "EXPERIENCE_BUFFER_SIZE"
+EXPERIENCE_FLUSH_COUNT = "EXPERIENCE_FLUSH_COUNT"
+EXPERIENCE_FLUSH_INTERVAL_MS = "EXPERIENCE_FLUSH_INTERVAL_MS"
+EXPERIENCE_OVERFLOW_POLICY = "EXPERIENCE_OVERFLOW_POLICY"
+REDIS_UNIX_SOCKET = "REDIS_UNIX_SOCKET"
+EXPERIENCE_TRANSPORT = "EXPERIENCE_TRANSPORT"
+EXPERIENCE_STREAM_MAXLEN = "EXPERIENCE_STREAM_MAXLEN"
+EXPERIENCE_CONSUMERS = "EXPERIENCE_CONSUMERS"
+EXPERIENCE_STREAM_READ_COUNT = "EXPERIENCE_STREAM_READ_COUNT"
+EXPERIENCE_RING_DIR = "EXPERIENCE_RING_DIR"
+EXPERIENCE_RING_SIZE_MB = "EXPERIENCE_RING_SIZE_MB"
 
 # Type of weights store
 S3_REF = "S3REF"  # Weights are stored in S3
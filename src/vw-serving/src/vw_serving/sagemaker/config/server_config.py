@@ -60,6 +60,219 @@ class BaseServerConfig(object):
         """
         return False
 
+    @property
+    def scoring_backend(self):
+        """Select how each worker scores the VW model.
+        "subprocess" talks to a `vw` CLI process over pipes, "pyvw" loads the model in process through the
+        VW Python bindings and "linear" scores simple --cb_explore models with numpy from exported weights,
+        falling back to "subprocess" for other models. "daemon" shares one `vw --daemon` process per model
+        between all workers, so the weights are loaded once. Can be overridden with the VW_SCORING_BACKEND
+        environment variable.
+        :return: (str) scoring backend name
+        """
+        return "subprocess"
+
+    @property
+    def vw_processes_per_worker(self):
+        """Control the number of VW processes each Gunicorn worker starts with the "subprocess" scoring backend.
+        The rows of a batch request are sharded across them and scored in parallel. With the "daemon" backend
+        this is the number of connections, each served by one VW daemon child, a worker keeps open.
+        Can be overridden with the VW_PROCESSES_PER_WORKER environment variable.
+        :return: integer, number of VW processes per worker
+        """
+        return 1
+
+    @property
+    def vw_read_timeout(self):
+        """Control how long a VW process may go without answering a pending example before it is considered
+        hung and replaced. Can be overridden with the VW_READ_TIMEOUT environment variable.
+        :return: timeout in seconds
+        :rtype: float
+        """
+        return 10
+
+    @property
+    def vw_warm_standby(self):
+        """Control whether each VW process of the "subprocess" scoring backend has a started standby process
+        that replaces it immediately when it crashes or hangs. Doubles the number of VW processes.
+        Can be overridden with the VW_WARM_STANDBY environment variable.
+        :return: True to keep a standby process, False otherwise.
+        :rtype: bool
+        """
+        return False
+
+    @property
+    def prediction_cache_size(self):
+        """Control the number of action probability vectors each worker caches by observation, 0 disables the
+        cache. Actions are still sampled per request. Can be overridden with the PREDICTION_CACHE_SIZE
+        environment variable.
+        :return: integer, maximum number of cached observations per worker
+        """
+        return 0
+
+    @property
+    def prediction_cache_ttl(self):
+        """Control how long a cached prediction is valid. Can be overridden with the PREDICTION_CACHE_TTL
+        environment variable.
+        :return: time to live in seconds, None for no expiry
+        """
+        return None
+
+    @property
+    def prediction_cache_redis(self):
+        """Control whether workers share cached predictions through redis as a second cache tier.
+        Can be overridden with the PREDICTION_CACHE_REDIS environment variable.
+        :return: True to share cached predictions, False otherwise.
+        :rtype: bool
+        """
+        return False
+
+    @property
+    def worker_threads(self):
+        """Control the number of request threads of each Gunicorn worker, more than 1 selects the threaded
+        gthread worker. Can be overridden with the WORKER_THREADS environment variable.
+        :return: integer, number of threads per worker
+        """
+        return 1
+
+    @property
+    def micro_batch_max_size(self):
+        """Control the maximum number of concurrent single observation requests of a worker that are scored
+        together in one call to the model, 1 disables micro batching. Only useful with more than one worker
+        thread. Can be overridden with the MICRO_BATCH_MAX_SIZE environment variable.
+        :return: integer, maximum number of observations per micro batch
+        """
+        return 1
+
+    @property
+    def micro_batch_max_delay_us(self):
+        """Control how long the first request of a micro batch waits for concurrent requests before the batch
+        is scored. Can be overridden with the MICRO_BATCH_MAX_DELAY_US environment variable.
+        :return: integer, maximum delay in microseconds
+        """
+        return 500
+
+    @property
+    def cpu_affinity(self):
+        """Control whether each Gunicorn worker, together with the VW processes it starts, is pinned to its own
+        group of CPUs, one CPU for the worker and one per VW process. Also limits the number of workers to the
+        number of such groups, which can be fewer workers than CPUs. Disabled by default. Can be overridden with
+        the CPU_AFFINITY environment variable.
+        :return: True to pin workers, False otherwise.
+        :rtype: bool
+        """
+        return False
+
+    @property
+    def model_swap_in_worker(self):
+        """Control how workers switch to a newly promoted model. When enabled every worker watches the model_id
+        key in redis, starts and warms the new model in the background and switches to it between requests.
+        Otherwise the Gunicorn workers are restarted. Can be overridden with the MODEL_SWAP_IN_WORKER
+        environment variable.
+        :return: True to swap models inside the workers, False to restart the workers.
+        :rtype: bool
+        """
+        return True
+
+    @property
+    def model_watch_interval(self):
+        """Control how often each worker checks redis for a newly promoted model when models are swapped inside
+        the workers. Can be overridden with the MODEL_WATCH_INTERVAL environment variable.
+        :return: interval in seconds
+        :rtype: float
+        """
+        return 1
+
+    @property
+    def shadow_scoring(self):
+        """Control whether workers score live observations with the candidate model published by the model manager
+        in the background, and log its action probabilities next to those of the hosted model. Requires inference
+        data logging. Can be overridden with the SHADOW_SCORING environment variable.
+        :return: True to shadow score, False otherwise.
+        :rtype: bool
+        """
+        return False
+
+    @property
+    def shadow_sample_rate(self):
+        """Control the fraction of the observations that are shadow scored. Can be overridden with the
+        SHADOW_SAMPLE_RATE environment variable.
+        :return: fraction between 0 and 1
+        :rtype: float
+        """
+        return 1.0
+
+    @property
+    def shadow_queue_size(self):
+        """Control the number of observations waiting to be shadow scored in each worker, observations are dropped
+        when it is reached. Can be overridden with the SHADOW_QUEUE_SIZE environment variable.
+        :return: integer, maximum number of queued observations
+        """
+        return 1000
+
+    @property
+    def experience_buffer_size(self):
+        """Control the number of inference data records each worker buffers before they are published to redis in
+        the background. Can be overridden with the EXPERIENCE_BUFFER_SIZE environment variable.
+        :return: integer, maximum number of buffered records
+        """
+        return 10000
+
+    @property
+    def experience_flush_count(self):
+        """Control the number of buffered inference data records that are published in one redis pipeline. Can be
+        overridden with the EXPERIENCE_FLUSH_COUNT environment variable.
+        :return: integer, number of records per flush
+        """
+        return 100
+
+    @property
+    def experience_flush_interval_ms(self):
+        """Control the maximum time between two flushes of the buffered inference data records. Can be overridden
+        with the EXPERIENCE_FLUSH_INTERVAL_MS environment variable.
+        :return: interval in milliseconds
+        :rtype: float
+        """
+        return 50
+
+    @property
+    def experience_overflow_policy(self):
+        """Control what happens to inference data records when the buffer is full because redis is slow. "drop"
+        drops them and "block" blocks the request until the buffer is flushed. Can be overridden with the
+        EXPERIENCE_OVERFLOW_POLICY environment variable.
+        :return: (str) overflow policy
+        """
+        return "drop"
+
+    @property
+    def experience_transport(self):
+        """Control how inference data records travel from the workers to the Firehose producer. "pubsub" publishes
+        them to a redis channel, where they are lost while the producer is not listening. "stream" appends them to a
+        redis stream read by a consumer group, which acknowledges them once delivered. "shm" writes them to a
+        shared memory ring buffer per worker, without going through redis. Can be overridden with the
+        EXPERIENCE_TRANSPORT environment variable.
+        :return: (str) "pubsub", "stream" or "shm"
+        """
+        return "pubsub"
+
+    @property
+    def experience_ring_size_mb(self):
+        """Control the size of the shared memory ring buffer of each worker when inference data records are
+        transported with "shm". Records are dropped while the ring is full. Can be overridden with the
+        EXPERIENCE_RING_SIZE_MB environment variable.
+        :return: integer, size of the ring in MB
+        """
+        return 16
+
+    @property
+    def experience_stream_maxlen(self):
+        """Control the approximate maximum number of inference data records kept in the redis stream, older records
+        are trimmed even if they were not delivered. Can be overridden with the EXPERIENCE_STREAM_MAXLEN environment
+        variable.
+        :return: integer, maximum length of the stream
+        """
+        return 1000000
+
     @property
     def batch_strategy(self):
         """Get batch strategy for transform jobs.
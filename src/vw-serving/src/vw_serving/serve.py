@@ -1,14 +1,18 @@
 from __future__ import absolute_import
 import json
-from io import StringIO
 import logging
 import os
 import signal
 import sys
+import threading
 import warnings
 import uuid
 import datetime
+import functools
+import itertools
 import random
+import time
+from collections import deque
 
 import numpy as np
 from six import iteritems
@@ -21,6 +25,7 @@ try:
 except ImportError:
     import httplib  # python 2
 import werkzeug
+from werkzeug.exceptions import RequestEntityTooLarge
 
 from vw_serving.utils import dynamic_import
 from vw_serving.sagemaker.gpu import get_num_gpus
@@ -28,10 +33,22 @@ from vw_serving.sagemaker import integration as integ
 from vw_serving.sagemaker.error_handler import report_batch_inference_sdk_error, report_online_inference_sdk_error
 from vw_serving.sagemaker.exceptions import convert_to_algorithm_error, raise_with_traceback, CustomerError, \
     AlgorithmError
-from vw_serving.sagemaker.config.server_config import BaseServerConfig
+from vw_serving.sagemaker.config.server_config import BaseServerConfig, ServerConfigUtils
 import vw_serving.sagemaker.config.environment as environment
 
-from vw_serving.vw_model import VWModel
+from vw_serving.example_formatter import format_json_arrays
+from vw_serving.vw_model import VWModel, PyVWModel
+from vw_serving.linear_model import LinearVWModel
+from vw_serving.model_pool import VWModelPool
+from vw_serving.vw_daemon import VWDaemonModel
+from vw_serving.vw_supervisor import VWModelSupervisor
+from vw_serving.prediction_cache import CachedVWModel, PredictionCache
+from vw_serving.micro_batcher import MicroBatchingModel
+from vw_serving.shadow_scorer import ShadowScorer
+from vw_serving.experience_publisher import ExperiencePublisher, EXPERIENCE_TRANSPORTS, EXPERIENCE_TRANSPORT_STREAM, \
+    EXPERIENCE_TRANSPORT_SHM
+from vw_serving.shm_ring import DEFAULT_RING_DIR, ShmRingBuffer, ShmExperiencePublisher, worker_ring_path
+from vw_serving.cpu_layout import cpu_affinity_supported, get_cpu_layout, pin_process
 
 # TODO: Add metrics publishing
 # from vw_serving.metrics import metrics_wrapper
@@ -43,10 +60,24 @@ CONTENT_TYPE_CSV = 'text/csv'
 CONTENT_TYPE_RECORDIO = 'application/x-recordio-protobuf'
 
 REDIS_PUBLISHER_CHANNEL = "EXPERIENCES"
+REDIS_UNIX_SOCKET = "/tmp/redis.sock"
 KNOWN_CLI_ARGS = ['-r', '--resources', '-w']
 
 MODEL_DIR = integ.ARTIFACTS_VOLUME
 
+SCORING_BACKEND_SUBPROCESS = "subprocess"
+SCORING_BACKEND_PYVW = "pyvw"
+SCORING_BACKEND_LINEAR = "linear"
+SCORING_BACKEND_DAEMON = "daemon"
+SCORING_BACKENDS = (SCORING_BACKEND_SUBPROCESS, SCORING_BACKEND_PYVW, SCORING_BACKEND_LINEAR,
+                    SCORING_BACKEND_DAEMON)
+VW_MODEL_CLASSES = {
+    SCORING_BACKEND_SUBPROCESS: VWModel,
+    SCORING_BACKEND_PYVW: PyVWModel,
+}
+# models that can be called by the concurrent request threads of a worker
+THREAD_SAFE_MODEL_CLASSES = (VWModelPool, VWDaemonModel, LinearVWModel)
+
 
 class InferenceCustomerError(CustomerError):
     def public_failure_message(self):
@@ -152,6 +183,14 @@ class ScoringService(object):
 
     LOG_INFERENCE_DATA = os.getenv(environment.LOG_INFERENCE_DATA, 'true').lower() == 'true'
 
+    # NOTE: number of rows of a batch request parsed and scored at a time
+    BATCH_CHUNK_ROWS = int(os.getenv(environment.BATCH_CHUNK_ROWS, 10000))
+
+    # NOTE: failed swaps of a model are retried with exponential back-off, up to this many attempts in total
+    # before the worker is restarted to load it
+    MODEL_SWAP_MAX_ATTEMPTS = 3
+    MODEL_SWAP_MAX_BACKOFF_SECONDS = 60
+
     app = flask.Flask(__name__)
     request_iterators = {}
     response_encoders = {}
@@ -161,6 +200,14 @@ class ScoringService(object):
     _server_config = None
     _model = None
     _redis_client = None
+    _experience_publisher = None
+    # recent observations of the worker, used to warm up a new model before it is swapped in
+    _probe_observations = deque(maxlen=16)
+    # model id -> (number of failed swaps, monotonic time of the next attempt)
+    _failed_model_ids = {}
+    # shadow model id -> (number of failed starts, monotonic time of the next attempt)
+    _failed_shadow_model_ids = {}
+    _shadow_scorer = None
 
     @classmethod
     def _report_sdk_error(cls, sdk_error):
@@ -227,17 +274,213 @@ class ScoringService(object):
                 import redis
                 redis_client = redis.Redis()
                 cls._model_id = redis_client.get("model_id").decode()
-                model_weights_loc = redis_client.get("{}:weights".format(cls._model_id)).decode()
-                model_metadata_loc = redis_client.get("{}:metadata".format(cls._model_id)).decode()
-                cls._model = VWModel.load_vw_model(metadata_loc=model_metadata_loc,
-                                                   weights_loc=model_weights_loc,
-                                                   test_only=True,
-                                                   quiet_mode=True)
+                cls._model = cls._build_model(redis_client, cls._model_id)
                 cls.app.logger.info(f"Loaded weights successfully for Model ID:{cls._model_id}")
             except Exception as e:
                 raise_with_traceback(InferenceCustomerError("Unable to load model", caused_by=e))
         return cls._model
 
+    @classmethod
+    def _build_model(cls, redis_client, model_id):
+        model = cls._load_model(redis_client, model_id)
+        model = cls._add_micro_batching(model)
+        return cls._add_prediction_cache(model, model_id)
+
+    @classmethod
+    def _warm_model(cls, model):
+        probe_observations = list(cls._probe_observations)
+        for observation in probe_observations:
+            model.predict(observation)
+        if len(probe_observations) > 1:
+            model.predict_many(probe_observations)
+
+    @classmethod
+    def _swap_model(cls, redis_client, model_id):
+        """Start and warm the model published under model_id, then make it the model of the worker.
+
+        Requests that already hold the previous model finish on it, it is closed once the server timeout has
+        passed.
+        """
+        cls.app.logger.info("Starting Model ID:%s next to Model ID:%s", model_id, cls._model_id)
+        model = cls._build_model(redis_client, model_id)
+        try:
+            model.start()
+            cls._warm_model(model)
+        except Exception:
+            model.close()
+            raise
+
+        previous_model, previous_model_id = cls._model, cls._model_id
+        cls._model, cls._model_id = model, model_id
+        cls.app.logger.info("Swapped Model ID:%s for Model ID:%s", previous_model_id, model_id)
+        if previous_model is not None:
+            drain_seconds = int(cls._get_server_config().timeout)
+            threading.Timer(drain_seconds, cls._close_model, args=(previous_model, previous_model_id)).start()
+
+    @classmethod
+    def _close_model(cls, model, model_id):
+        try:
+            model.close()
+            cls.app.logger.info("Closed Model ID:%s", model_id)
+        except Exception:
+            cls.app.logger.exception("Unable to close Model ID:%s", model_id)
+
+    @classmethod
+    def _can_attempt(cls, failed_model_ids, model_id):
+        return time.monotonic() >= failed_model_ids.get(model_id, (0, 0))[1]
+
+    @classmethod
+    def _record_failure(cls, failed_model_ids, model_id, interval):
+        """Record a failed attempt to start model_id and back off its next attempt.
+
+        :return: (int) number of failed attempts of model_id
+        """
+        num_failures = failed_model_ids.get(model_id, (0, 0))[0] + 1
+        backoff_seconds = min(interval * 2 ** num_failures, cls.MODEL_SWAP_MAX_BACKOFF_SECONDS)
+        failed_model_ids[model_id] = (num_failures, time.monotonic() + backoff_seconds)
+        return num_failures
+
+    @classmethod
+    def _watch_model_id(cls, interval):
+        """Swap the model of the worker whenever the model_id key in redis changes.
+
+        A model that fails to swap in is retried with back-off. The worker is restarted to load it after
+        MODEL_SWAP_MAX_ATTEMPTS failures, or after the first one with the daemon backend, whose previous daemon
+        is stopped shortly after a new model is promoted.
+        """
+        import redis
+        redis_client = redis.Redis()
+        while True:
+            time.sleep(interval)
+            model_id = None
+            try:
+                model_id = redis_client.get("model_id")
+                if model_id is None:
+                    continue
+                model_id = model_id.decode()
+                if model_id != cls._model_id and cls._can_attempt(cls._failed_model_ids, model_id):
+                    cls._swap_model(redis_client, model_id)
+                    cls._failed_model_ids.pop(model_id, None)
+            except Exception:
+                # keep serving the current model until the next attempt
+                cls.app.logger.exception("Unable to swap to Model ID:%s", model_id)
+                if model_id is None:
+                    continue
+                num_failures = cls._record_failure(cls._failed_model_ids, model_id, interval)
+                if num_failures >= cls.MODEL_SWAP_MAX_ATTEMPTS or \
+                        cls.get_scoring_backend() == SCORING_BACKEND_DAEMON:
+                    # gunicorn replaces the worker once its requests are finished, the new one loads model_id
+                    cls.app.logger.error("Restarting the worker to load Model ID:%s", model_id)
+                    os.kill(os.getpid(), signal.SIGTERM)
+                    return
+
+    @classmethod
+    def _swap_shadow_model(cls, redis_client, shadow_model_id):
+        """Shadow score with the model published under shadow_model_id, or stop shadow scoring if it is None.
+        """
+        shadow_scorer = None
+        if shadow_model_id is not None:
+            cls.app.logger.info("Starting shadow Model ID:%s", shadow_model_id)
+            model = cls._load_model(redis_client, shadow_model_id)
+            try:
+                model.start()
+            except Exception:
+                model.close()
+                raise
+            shadow_scorer = ShadowScorer(model, shadow_model_id,
+                                         cls._experience_publisher.publish,
+                                         max_queue_size=cls.get_shadow_queue_size(),
+                                         sample_rate=cls.get_shadow_sample_rate())
+
+        previous_shadow_scorer, cls._shadow_scorer = cls._shadow_scorer, shadow_scorer
+        if previous_shadow_scorer is not None:
+            previous_shadow_scorer.close()
+
+    @classmethod
+    def _watch_shadow_model_id(cls, interval):
+        """Shadow score with the model of the shadow_model_id key in redis whenever it changes.
+        """
+        import redis
+        redis_client = redis.Redis()
+        while True:
+            time.sleep(interval)
+            shadow_model_id = None
+            try:
+                shadow_model_id = redis_client.get("shadow_model_id")
+                shadow_model_id = shadow_model_id.decode() if shadow_model_id else None
+                current_shadow_model_id = cls._shadow_scorer.model_id if cls._shadow_scorer else None
+                if shadow_model_id != current_shadow_model_id and \
+                        cls._can_attempt(cls._failed_shadow_model_ids, shadow_model_id):
+                    cls._swap_shadow_model(redis_client, shadow_model_id)
+            except Exception:
+                cls.app.logger.exception("Unable to shadow score with Model ID:%s", shadow_model_id)
+                if shadow_model_id is not None:
+                    cls._record_failure(cls._failed_shadow_model_ids, shadow_model_id, interval)
+
+    @classmethod
+    def _add_micro_batching(cls, model):
+        max_batch_size, max_delay_us = cls.get_micro_batch_settings()
+        if max_batch_size <= 1:
+            if cls.get_worker_threads() > 1 and not isinstance(model, THREAD_SAFE_MODEL_CLASSES):
+                # a pool of one model lets the request threads take turns on it
+                return VWModelPool([model])
+            return model
+
+        cls.app.logger.info("Micro batching up to %s observations within %s us", max_batch_size, max_delay_us)
+        return MicroBatchingModel(model, max_batch_size=max_batch_size, max_delay_us=max_delay_us)
+
+    @classmethod
+    def _add_prediction_cache(cls, model, model_id):
+        cache_size, cache_ttl, shared_cache = cls.get_prediction_cache_settings()
+        if cache_size <= 0:
+            return model
+
+        redis_client = None
+        if shared_cache:
+            import redis
+            redis_client = redis.Redis()
+        cache = PredictionCache(max_entries=cache_size, ttl_seconds=cache_ttl, redis_client=redis_client)
+        cls.app.logger.info("Caching up to %s predictions of Model ID:%s", cache_size, model_id)
+        return CachedVWModel(model, cache, model_id)
+
+    @classmethod
+    def _load_model(cls, redis_client, model_id):
+        """Create the scoring engine of the configured backend for the model published under model_id.
+        """
+        backend = cls.get_scoring_backend()
+        if backend == SCORING_BACKEND_LINEAR:
+            linear_weights_loc = redis_client.get("{}:linear_weights".format(model_id))
+            if linear_weights_loc:
+                return LinearVWModel.load_linear_model(linear_weights_loc.decode())
+            cls.app.logger.info("No linear weights exported for Model ID:%s, using the VW subprocess.", model_id)
+            backend = SCORING_BACKEND_SUBPROCESS
+
+        processes_per_worker = cls.get_vw_processes_per_worker()
+        if backend == SCORING_BACKEND_DAEMON:
+            daemon_port = redis_client.get("{}:daemon_port".format(model_id))
+            if daemon_port:
+                return VWDaemonModel(int(daemon_port), max_connections=processes_per_worker)
+            cls.app.logger.info("No VW daemon running for Model ID:%s, using the VW subprocess.", model_id)
+            backend = SCORING_BACKEND_SUBPROCESS
+
+        model_weights_loc = redis_client.get("{}:weights".format(model_id)).decode()
+        model_metadata_loc = redis_client.get("{}:metadata".format(model_id)).decode()
+        if backend == SCORING_BACKEND_SUBPROCESS:
+            model_factory = functools.partial(VWModel.load_vw_model,
+                                              metadata_loc=model_metadata_loc,
+                                              weights_loc=model_weights_loc,
+                                              test_only=True,
+                                              quiet_mode=True,
+                                              read_timeout=cls.get_vw_read_timeout())
+            warm_standby = cls.get_vw_warm_standby()
+            models = [VWModelSupervisor(model_factory, warm_standby=warm_standby)
+                      for _ in range(processes_per_worker)]
+            return VWModelPool(models) if len(models) > 1 else models[0]
+        return VW_MODEL_CLASSES[backend].load_vw_model(metadata_loc=model_metadata_loc,
+                                                       weights_loc=model_weights_loc,
+                                                       test_only=True,
+                                                       quiet_mode=True)
+
     @classmethod
     def _get_server_config(cls):
         if not cls._server_config:
@@ -251,12 +494,16 @@ class ScoringService(object):
         :return: (dict) a dictionary with two entries:
           max_concurrent_transforms: (int) number of concurrent transform requests to send.
             Platform can use this value to send appropriate number of concurrent requests to the container.
+            It is at most the number of requests the workers serve at once.
           max_payload_size: (int) maximum size of payload on /invocation request in bytes.
         """
         server_config = cls._get_server_config()
+        # the number of workers can be lower than the one of the server config, e.g. limited by the model size
+        max_concurrent_transforms = min(int(server_config.max_concurrent_transforms),
+                                        cls.get_num_workers() * cls.get_worker_threads())
 
         return {
-            'max_concurrent_transforms': server_config.max_concurrent_transforms,
+            'max_concurrent_transforms': max_concurrent_transforms,
             'batch_strategy': server_config.batch_strategy,
             'max_payload_size': cls.MAX_CONTENT_LENGTH,
         }
@@ -268,12 +515,39 @@ class ScoringService(object):
         :param worker:
         """
         # Model is being loaded per worker because each worker communicates through PIPE with the VW C++ CLI
+        try:
+            # pinned before the VW processes are started, which inherit the CPUs of the worker
+            ScoringService._pin_worker(worker)
+        except Exception:
+            ScoringService.app.logger.exception("Unable to pin the worker to its CPUs")
+
         try:
             if ScoringService.LOG_INFERENCE_DATA:
                 import redis
                 if ScoringService._redis_client is None:
-                    ScoringService._redis_client = redis.Redis()
+                    redis_unix_socket = os.getenv(environment.REDIS_UNIX_SOCKET, REDIS_UNIX_SOCKET)
+                    if redis_unix_socket and os.path.exists(redis_unix_socket):
+                        ScoringService._redis_client = redis.Redis(unix_socket_path=redis_unix_socket)
+                    else:
+                        ScoringService._redis_client = redis.Redis()
                     ScoringService.app.logger.info("Initiated redis client!")
+                if ScoringService._experience_publisher is None and \
+                        ScoringService.get_experience_transport() == EXPERIENCE_TRANSPORT_SHM:
+                    ring_dir, ring_size = ScoringService.get_experience_ring_settings()
+                    os.makedirs(ring_dir, exist_ok=True)
+                    # the pid makes the ring of each worker process unique, so each ring has a single producer
+                    ring_path = worker_ring_path(ring_dir, os.getpid(), slot=getattr(worker, "cpu_slot", None))
+                    ScoringService._experience_publisher = ShmExperiencePublisher(
+                        ShmRingBuffer(ring_path, capacity=ring_size))
+                    ScoringService.app.logger.info(f"Writing inference data to ring: {ring_path}")
+                if ScoringService._experience_publisher is None:
+                    buffer_size, flush_count, flush_interval_ms, overflow_policy = \
+                        ScoringService.get_experience_publisher_settings()
+                    ScoringService._experience_publisher = ExperiencePublisher(
+                        ScoringService._redis_client, REDIS_PUBLISHER_CHANNEL, buffer_size=buffer_size,
+                        flush_count=flush_count, flush_interval=flush_interval_ms / 1000.0,
+                        overflow_policy=overflow_policy,
+                        stream_maxlen=ScoringService.get_experience_stream_maxlen())
         except Exception as e:
             sdk_error = convert_to_algorithm_error(e)
             ScoringService._report_sdk_error(sdk_error)
@@ -287,6 +561,34 @@ class ScoringService(object):
             ScoringService._report_sdk_error(sdk_error)
             sys.exit(sdk_error.exit_code)
 
+        if ScoringService.get_model_swap_in_worker():
+            watcher = threading.Thread(target=ScoringService._watch_model_id,
+                                       args=(ScoringService.get_model_watch_interval(),), daemon=True)
+            watcher.start()
+
+        if ScoringService.get_shadow_scoring() and ScoringService.LOG_INFERENCE_DATA:
+            shadow_watcher = threading.Thread(target=ScoringService._watch_shadow_model_id,
+                                              args=(ScoringService.get_model_watch_interval(),), daemon=True)
+            shadow_watcher.start()
+
+    @staticmethod
+    def _pre_fork(server, worker):
+        """
+        Gunicorn server hook http://docs.gunicorn.org/en/stable/settings.html#pre-fork
+        Assigns the worker the first CPU group not used by a running worker.
+        """
+        used_cpu_slots = {getattr(running_worker, "cpu_slot", None) for running_worker in server.WORKERS.values()}
+        worker.cpu_slot = next(slot for slot in itertools.count() if slot not in used_cpu_slots)
+
+    @classmethod
+    def _pin_worker(cls, worker):
+        cpu_slot = getattr(worker, "cpu_slot", None)
+        if cpu_slot is None:
+            return
+        # workers started while the previous ones are still shutting down share their CPUs for a while
+        cpu_layout = get_cpu_layout(cls.get_cores_per_worker())
+        pin_process(cpu_layout[cpu_slot % len(cpu_layout)])
+
     @staticmethod
     def _worker_exit(server, worker):
         """Do not cleanup resources on exit when memory profiler is enabled.
@@ -298,6 +600,9 @@ class ScoringService(object):
           https://github.com/benoitc/gunicorn/issues/1391
           https://stackoverflow.com/questions/37692262
         """
+        if ScoringService._experience_publisher is not None:
+            # publish the buffered experiences of the worker, or remove its ring, before it exits
+            ScoringService._experience_publisher.close()
         if os.getenv(environment.ENABLE_PROFILER):
             os._exit(0)
 
@@ -327,8 +632,210 @@ class ScoringService(object):
             return forced_num_workers
         if cls.eia_enabled():
             return 1
+
+        nworkers = int(cls._get_server_config().number_of_workers)
+        if cls.get_cpu_affinity():
+            nworkers = min(nworkers, len(get_cpu_layout(cls.get_cores_per_worker())))
+        model_copies = cls.get_model_copies_per_worker()
+        model_size = cls._get_published_model_size() if model_copies else None
+        if model_size:
+            nworkers = min(nworkers, ServerConfigUtils.get_model_size_limited_num_workers(
+                model_size, buffer_factor=model_copies))
+        return nworkers
+
+    @classmethod
+    def get_cpu_affinity(cls):
+        forced_cpu_affinity = os.getenv(environment.CPU_AFFINITY, "")
+
+        if forced_cpu_affinity:
+            cpu_affinity = forced_cpu_affinity.lower() == "true"
         else:
-            return int(cls._get_server_config().number_of_workers)
+            cpu_affinity = bool(cls._get_server_config().cpu_affinity)
+        return cpu_affinity and cpu_affinity_supported()
+
+    @classmethod
+    def get_cores_per_worker(cls):
+        """Get the number of CPUs a worker is pinned to: one for the worker and one per VW process it starts.
+
+        :return: (int) number of CPUs per worker
+        """
+        if cls.get_scoring_backend() == SCORING_BACKEND_SUBPROCESS:
+            return 1 + cls.get_vw_processes_per_worker()
+        return 1
+
+    @classmethod
+    def get_model_copies_per_worker(cls):
+        """Get the number of copies of the model weights each worker keeps in memory.
+
+        :return: (int) number of copies, 0 when the weights are shared between workers
+        """
+        backend = cls.get_scoring_backend()
+        if backend in (SCORING_BACKEND_LINEAR, SCORING_BACKEND_DAEMON):
+            # memory mapped weights and the VW daemon are shared by all workers
+            return 0
+        if backend == SCORING_BACKEND_SUBPROCESS:
+            return cls.get_vw_processes_per_worker() * (2 if cls.get_vw_warm_standby() else 1)
+        return 1
+
+    @classmethod
+    def _get_published_model_size(cls):
+        try:
+            import redis
+            redis_client = redis.Redis()
+            model_id = redis_client.get("model_id").decode()
+            weights_loc = redis_client.get("{}:weights".format(model_id)).decode()
+            return os.path.getsize(weights_loc)
+        except Exception:
+            cls.app.logger.warning("Unable to get the size of the published model, "
+                                   "the number of workers is not limited by memory.")
+            return None
+
+    @classmethod
+    def get_scoring_backend(cls):
+        backend = os.getenv(environment.VW_SCORING_BACKEND, "") or cls._get_server_config().scoring_backend
+        backend = backend.lower()
+        if backend not in SCORING_BACKENDS:
+            raise CustomerError("Scoring backend '{}' not supported. Supported backends are: {}".format(
+                backend, ", ".join(SCORING_BACKENDS)))
+        return backend
+
+    @classmethod
+    def get_vw_processes_per_worker(cls):
+        forced_processes_per_worker = int(os.getenv(environment.VW_PROCESSES_PER_WORKER, 0))
+
+        if forced_processes_per_worker > 0:
+            return forced_processes_per_worker
+        return int(cls._get_server_config().vw_processes_per_worker)
+
+    @classmethod
+    def get_vw_read_timeout(cls):
+        forced_read_timeout = float(os.getenv(environment.VW_READ_TIMEOUT, 0))
+
+        if forced_read_timeout > 0:
+            return forced_read_timeout
+        return float(cls._get_server_config().vw_read_timeout)
+
+    @classmethod
+    def get_vw_warm_standby(cls):
+        forced_warm_standby = os.getenv(environment.VW_WARM_STANDBY, "")
+
+        if forced_warm_standby:
+            return forced_warm_standby.lower() == "true"
+        return bool(cls._get_server_config().vw_warm_standby)
+
+    @classmethod
+    def get_prediction_cache_settings(cls):
+        """Get the prediction cache settings.
+
+        :return: (tuple) maximum number of entries, time to live in seconds or None, whether to share through redis
+        """
+        server_config = cls._get_server_config()
+        cache_size = int(os.getenv(environment.PREDICTION_CACHE_SIZE, server_config.prediction_cache_size))
+        cache_ttl = float(os.getenv(environment.PREDICTION_CACHE_TTL, 0)) or server_config.prediction_cache_ttl
+        shared_cache = os.getenv(environment.PREDICTION_CACHE_REDIS, "")
+        shared_cache = shared_cache.lower() == "true" if shared_cache else bool(server_config.prediction_cache_redis)
+        return cache_size, cache_ttl, shared_cache
+
+    @classmethod
+    def get_model_swap_in_worker(cls):
+        forced_swap_in_worker = os.getenv(environment.MODEL_SWAP_IN_WORKER, "")
+
+        if forced_swap_in_worker:
+            return forced_swap_in_worker.lower() == "true"
+        return bool(cls._get_server_config().model_swap_in_worker)
+
+    @classmethod
+    def get_model_watch_interval(cls):
+        forced_watch_interval = float(os.getenv(environment.MODEL_WATCH_INTERVAL, 0))
+
+        if forced_watch_interval > 0:
+            return forced_watch_interval
+        return float(cls._get_server_config().model_watch_interval)
+
+    @classmethod
+    def get_shadow_scoring(cls):
+        forced_shadow_scoring = os.getenv(environment.SHADOW_SCORING, "")
+
+        if forced_shadow_scoring:
+            return forced_shadow_scoring.lower() == "true"
+        return bool(cls._get_server_config().shadow_scoring)
+
+    @classmethod
+    def get_shadow_sample_rate(cls):
+        return float(os.getenv(environment.SHADOW_SAMPLE_RATE, cls._get_server_config().shadow_sample_rate))
+
+    @classmethod
+    def get_shadow_queue_size(cls):
+        forced_queue_size = int(os.getenv(environment.SHADOW_QUEUE_SIZE, 0))
+
+        if forced_queue_size > 0:
+            return forced_queue_size
+        return int(cls._get_server_config().shadow_queue_size)
+
+    @classmethod
+    def get_worker_threads(cls):
+        forced_worker_threads = int(os.getenv(environment.WORKER_THREADS, 0))
+
+        if forced_worker_threads > 0:
+            return forced_worker_threads
+        return int(cls._get_server_config().worker_threads)
+
+    @classmethod
+    def get_micro_batch_settings(cls):
+        """Get the micro batching settings.
+
+        :return: (tuple) maximum number of observations per micro batch, maximum delay in microseconds
+        """
+        server_config = cls._get_server_config()
+        max_batch_size = int(os.getenv(environment.MICRO_BATCH_MAX_SIZE, server_config.micro_batch_max_size))
+        max_delay_us = int(os.getenv(environment.MICRO_BATCH_MAX_DELAY_US, server_config.micro_batch_max_delay_us))
+        return max_batch_size, max_delay_us
+
+    @classmethod
+    def get_experience_publisher_settings(cls):
+        """Get the settings of the background publisher of inference data records.
+
+        :return: (tuple) buffer size, number of records per flush, maximum milliseconds between two flushes,
+          overflow policy
+        """
+        server_config = cls._get_server_config()
+        buffer_size = int(os.getenv(environment.EXPERIENCE_BUFFER_SIZE, server_config.experience_buffer_size))
+        flush_count = int(os.getenv(environment.EXPERIENCE_FLUSH_COUNT, server_config.experience_flush_count))
+        flush_interval_ms = float(os.getenv(environment.EXPERIENCE_FLUSH_INTERVAL_MS,
+                                            server_config.experience_flush_interval_ms))
+        overflow_policy = os.getenv(environment.EXPERIENCE_OVERFLOW_POLICY,
+                                    server_config.experience_overflow_policy).lower()
+        return buffer_size, flush_count, flush_interval_ms, overflow_policy
+
+    @classmethod
+    def get_experience_transport(cls):
+        transport = os.getenv(environment.EXPERIENCE_TRANSPORT, "") or cls._get_server_config().experience_transport
+        transport = transport.lower()
+        if transport not in EXPERIENCE_TRANSPORTS:
+            raise CustomerError("Experience transport '{}' not supported. Supported transports are: {}".format(
+                transport, ", ".join(EXPERIENCE_TRANSPORTS)))
+        return transport
+
+    @classmethod
+    def get_experience_ring_settings(cls):
+        """Get the settings of the shared memory rings inference data records are written to.
+
+        :return: (tuple) directory of the ring files, size of a ring in bytes
+        """
+        ring_dir = os.getenv(environment.EXPERIENCE_RING_DIR, DEFAULT_RING_DIR)
+        ring_size_mb = int(os.getenv(environment.EXPERIENCE_RING_SIZE_MB,
+                                     cls._get_server_config().experience_ring_size_mb))
+        return ring_dir, ring_size_mb * 1024 * 1024
+
+    @classmethod
+    def get_experience_stream_maxlen(cls):
+        """Get the maximum length of the redis stream inference data records are appended to.
+
+        :return: (int) approximate maximum length of the stream, None if the records are published to a channel
+        """
+        if cls.get_experience_transport() != EXPERIENCE_TRANSPORT_STREAM:
+            return None
+        return int(os.getenv(environment.EXPERIENCE_STREAM_MAXLEN, cls._get_server_config().experience_stream_maxlen))
 
     @classmethod
     def _initialize(cls, daemon=False):
@@ -343,12 +850,19 @@ class ScoringService(object):
         cls.app.config["MAX_CONTENT_LENGTH"] = cls.MAX_CONTENT_LENGTH
         gunicorn_options = {
             "bind": "{}:{}".format("0.0.0.0", cls.PORT),
-            "workers": min(nworkers, 4),
+            "workers": nworkers,
             "timeout": timeout,
             "worker_exit": cls._worker_exit,
             "pidfile": environment.PIDFILE,
             "daemon": daemon
         }
+        if cls.get_cpu_affinity():
+            gunicorn_options["pre_fork"] = cls._pre_fork
+        worker_threads = cls.get_worker_threads()
+        if worker_threads > 1:
+            gunicorn_options["threads"] = worker_threads
+            gunicorn_options["worker_class"] = "gthread"
+            cls.app.logger.info("Number of threads per server worker: %s", worker_threads)
         # If prefork is chosen, call the model loading function immediately, otherwise register the model
         # loading function in the options map, os that the worker processes can call it after being forked.
         # if cls._server_config.prefork_load_model or True:
@@ -390,6 +904,12 @@ def internal_server_error(e):
     return flask.Response(response="Internal Server Error", status=httplib.INTERNAL_SERVER_ERROR)
 
 
+@ScoringService.app.errorhandler(CustomerError)
+def customer_error(e):
+    ScoringService._report_sdk_error(e)
+    return flask.Response(response=e.get_error_summary(), status=httplib.BAD_REQUEST)
+
+
 @ScoringService.app.route("/ping", methods=["GET"])
 def ping():
     # TODO: implement health checks
@@ -436,10 +956,213 @@ def _score_json(model, observation, response_content_type=CONTENT_TYPE_JSON):
                               "type": "actions"})
     if ScoringService.LOG_INFERENCE_DATA:
         # TODO: Log state, action, eventID
-        ScoringService._redis_client.publish(REDIS_PUBLISHER_CHANNEL, blob_to_log)
+        ScoringService._experience_publisher.publish(blob_to_log)
+    shadow_scorer = ScoringService._shadow_scorer
+    if shadow_scorer is not None:
+        shadow_scorer.submit(event_id, observation, ScoringService._model_id, action_probs)
     return response_payload
 
 
+JSON_RESPONSE_TEMPLATE = ('{"action": %d, "action_prob": %r, "event_id": %d, "timestamp": %d, '
+                          '"sample_prob": %r, "model_id": %s}')
+CSV_RESPONSE_TEMPLATE = "%d,%r,%d,%d,%r,%s"
+ACTIONS_LOG_TEMPLATE = ('{"action": %d, "action_prob": %r, "event_id": %d, "observation": %s, "timestamp": %d, '
+                        '"model_id": %s, "sample_prob": %r, "type": "actions"}')
+
+
+def _sample_actions(action_probs):
+    """Sample one action per row of a 2-D array of action probabilities with one uniform draw per row.
+
+    :return: (np.array) 0-based index of the sampled action of every row
+    """
+    cumulative_probs = np.cumsum(action_probs, axis=1)
+    draws = np.random.random_sample(len(action_probs)) * cumulative_probs[:, -1]
+    actions = (cumulative_probs <= draws[:, None]).sum(axis=1)
+    return np.minimum(actions, action_probs.shape[1] - 1)
+
+
+def _generate_event_ids(num_events):
+    """Generate num_events unique time based (version 1) UUIDs as integers.
+
+    One UUID is generated with a random node and the others are derived from it by incrementing its 100ns
+    timestamp, which only changes the time_low field as long as it does not wrap around.
+    """
+    # a random node has its multicast bit set, see RFC 4122 section 4.5
+    base_uuid = uuid.uuid1(node=random.getrandbits(48) | (1 << 40))
+    if base_uuid.time_low + num_events >= 1 << 32:
+        return [uuid.uuid1().int for _ in range(num_events)]
+    return [base_uuid.int + (i << 96) for i in range(num_events)]
+
+
+def _score_batch(model, observations, response_content_type=CONTENT_TYPE_JSONLINES, json_observations=None):
+    """Score a batch of observations, sample their actions, log them and queue them for shadow scoring.
+
+    The action probabilities of the whole batch are computed with one predict_many call, actions are sampled in
+    one vectorized step and the response and the logs are serialized with one template per batch.
+
+    :param json_observations: (list) JSON text of every observation, e.g. the lines of a jsonlines request,
+        so they are not serialized again for the logs
+    :return: (str) newline separated response rows
+    """
+    num_observations = len(observations)
+    if num_observations == 0:
+        return ""
+    action_probs = model.predict_many(observations)
+    action_probs = action_probs / action_probs.sum(axis=1, keepdims=True)
+    action_indices = _sample_actions(action_probs)
+    actions = (action_indices + 1).tolist()
+    chosen_action_probs = action_probs[np.arange(num_observations), action_indices].tolist()
+    event_ids = _generate_event_ids(num_observations)
+    timestamp = int(time.time())
+    # add sample_prob for later dataset sampling
+    sample_probs = np.random.uniform(0.0, 1.0, num_observations).tolist()
+    json_model_id = json.dumps(ScoringService._model_id)
+
+    if response_content_type in (CONTENT_TYPE_JSON, CONTENT_TYPE_JSONLINES):
+        response_rows = zip(actions, chosen_action_probs, event_ids, [timestamp] * num_observations,
+                            sample_probs, [json_model_id] * num_observations)
+        response_payload = "\n".join([JSON_RESPONSE_TEMPLATE % row for row in response_rows])
+    else:
+        response_rows = zip(actions, chosen_action_probs, event_ids, [timestamp] * num_observations,
+                            sample_probs, [ScoringService._model_id] * num_observations)
+        response_payload = "\n".join([CSV_RESPONSE_TEMPLATE % row for row in response_rows])
+
+    if ScoringService.LOG_INFERENCE_DATA:
+        if json_observations is None:
+            json_observations = format_json_arrays(observations)
+        log_rows = zip(actions, chosen_action_probs, event_ids, json_observations,
+                       [timestamp] * num_observations, [json_model_id] * num_observations, sample_probs)
+        ScoringService._experience_publisher.publish_many([ACTIONS_LOG_TEMPLATE % log_row for log_row in log_rows])
+
+    shadow_scorer = ScoringService._shadow_scorer
+    if shadow_scorer is not None:
+        # observations that do not fit in the queue of the shadow scorer are dropped, and counted
+        shadow_observations = observations.tolist() if isinstance(observations, np.ndarray) else observations
+        for event_id, observation, observation_action_probs in zip(event_ids, shadow_observations, action_probs):
+            shadow_scorer.submit(event_id, observation, ScoringService._model_id, observation_action_probs)
+    return response_payload
+
+
+def _iter_csv_chunks(stream, chunk_rows):
+    """Parse a CSV payload of numeric rows in chunks with the pandas C reader.
+
+    :param stream: file-like object with the CSV payload
+    :param chunk_rows: (int) number of rows per chunk
+    :return: generator of 2-D float arrays
+    """
+    import pandas as pd
+    try:
+        reader = pd.read_csv(stream, header=None, dtype=np.float64, chunksize=chunk_rows, engine="c")
+    except pd.errors.EmptyDataError:
+        # payloads sent without a content length are only known to be empty once read
+        return
+    for chunk in reader:
+        yield chunk.values
+
+
+def _iter_jsonlines_chunks(stream, chunk_rows):
+    """Parse a jsonlines payload in chunks, reading it line by line.
+
+    :param stream: binary file-like object with the jsonlines payload
+    :param chunk_rows: (int) number of rows per chunk
+    :return: generator of tuples (list, list) of observations and their JSON text
+    """
+    json_observations = []
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        json_observations.append(line.decode("utf-8"))
+        if len(json_observations) == chunk_rows:
+            yield [json.loads(observation) for observation in json_observations], json_observations
+            json_observations = []
+    if json_observations:
+        yield [json.loads(observation) for observation in json_observations], json_observations
+
+
+class _MaxLengthStream(object):
+    def __init__(self, stream, max_length):
+        """
+        Request stream that raises RequestEntityTooLarge once more than
+        max_length bytes were read from it, for payloads sent without a
+        content length.
+        Args:
+            stream: binary file-like object of the request payload
+            max_length (int): maximum number of bytes of the payload
+        """
+        self.stream = stream
+        self.max_length = max_length
+        self.length = 0
+
+    def _count(self, data):
+        self.length += len(data)
+        if self.length > self.max_length:
+            raise RequestEntityTooLarge()
+        return data
+
+    def read(self, size=-1):
+        return self._count(self.stream.read(size))
+
+    def readline(self, size=-1):
+        return self._count(self.stream.readline(size))
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+
+def _get_batch_request_stream():
+    """Return the payload stream of a batch request, limited to MAX_CONTENT_LENGTH bytes.
+
+    Flask only enforces MAX_CONTENT_LENGTH when it reads the whole payload, which batch requests do not.
+    """
+    max_length = int(ScoringService.MAX_CONTENT_LENGTH)
+    if flask.request.content_length is not None and flask.request.content_length > max_length:
+        raise RequestEntityTooLarge()
+    return _MaxLengthStream(flask.request.stream, max_length)
+
+
+def _score_batch_chunk(model, observations, json_observations, response_content_type):
+    response_payload = _score_batch(model, observations, response_content_type=response_content_type,
+                                    json_observations=json_observations)
+    if len(observations):
+        # copied, a row of a CSV chunk is a view of the whole chunk
+        ScoringService._probe_observations.append(np.asarray(observations[0], dtype=float).tolist())
+    return response_payload
+
+
+def _stream_batch_response(model, chunks, response_content_type):
+    """Score chunks of a batch request and yield the encoded response rows of every chunk as soon as it is scored.
+
+    The first chunk is parsed and scored before the response starts, so that invalid payloads and scoring errors
+    are returned with an error status. An error in a later chunk can only end the response early.
+
+    :param chunks: iterable of tuples (list, list or None) of observations and their JSON text
+    :return: generator of bytes
+    """
+    chunks = iter(chunks)
+    try:
+        first_chunk = next(chunks, None)
+    except (ValueError, UnicodeDecodeError) as e:
+        # pandas parser errors and json.JSONDecodeError are ValueErrors
+        raise InferenceCustomerError("Unable to parse the payload: {}".format(e))
+    first_payloads = [] if first_chunk is None else \
+        [_score_batch_chunk(model, *first_chunk, response_content_type=response_content_type)]
+
+    def generate():
+        separator = b""
+        try:
+            later_payloads = (_score_batch_chunk(model, *chunk, response_content_type=response_content_type)
+                              for chunk in chunks)
+            for response_payload in itertools.chain(first_payloads, later_payloads):
+                if response_payload:
+                    yield separator + response_payload.encode("utf-8")
+                    separator = b"\n"
+        except Exception:
+            ScoringService.app.logger.exception("Batch response ended early")
+            raise
+    return generate()
+
+
 @ScoringService.app.route("/invocations", methods=["POST"])
 # @METRICS.count("invocations")
 # @METRICS.count_when("invocations_error", _error_predicate)
@@ -453,8 +1176,13 @@ def invocations():
             response="content-type {} not supported".format(content_type), status=httplib.UNSUPPORTED_MEDIA_TYPE
         )
 
-    payload = flask.request.data
-    if len(payload) == 0:
+    # batch requests are consumed incrementally from the request stream
+    if content_type == CONTENT_TYPE_JSON:
+        payload = flask.request.data
+        is_empty = len(payload) == 0
+    else:
+        is_empty = flask.request.content_length == 0
+    if is_empty:
         return flask.Response(response="", status=httplib.NO_CONTENT)
 
     try:
@@ -476,15 +1204,25 @@ def invocations():
             blob_to_log = {"event_id": int(event_id), "reward": float(reward), "type": "rewards"}
             blob_to_log = json.dumps(blob_to_log)
             if ScoringService.LOG_INFERENCE_DATA:
-                ScoringService._redis_client.publish(REDIS_PUBLISHER_CHANNEL, blob_to_log)
+                ScoringService._experience_publisher.publish(blob_to_log)
                 status = "success"
             else:
                 status = "failure"
             return flask.Response(response='{"status": "%s"}' % status, status=httplib.OK)
 
         elif request_type == "model_id":
-            model_info_payload = json.dumps({"model_id": ScoringService._model_id,
-                                             "soft_model_update_status": "TBD: To be used for indicating rollbacks"})
+            model_info = {"model_id": ScoringService._model_id,
+                          "soft_model_update_status": "TBD: To be used for indicating rollbacks"}
+            if isinstance(model, CachedVWModel):
+                model_info["prediction_cache"] = model.cache.stats()
+                model = model.model
+            if isinstance(model, MicroBatchingModel):
+                model_info["micro_batching"] = model.stats()
+            if ScoringService._shadow_scorer is not None:
+                model_info["shadow_scoring"] = ScoringService._shadow_scorer.stats()
+            if ScoringService._experience_publisher is not None:
+                model_info["experience_publisher"] = ScoringService._experience_publisher.stats()
+            model_info_payload = json.dumps(model_info)
             return flask.Response(response=model_info_payload, status=httplib.OK, mimetype="application/json",
                                   content_type="application/json")
 
@@ -492,36 +1230,23 @@ def invocations():
             observation = data["observation"]
 
             response_payload = _score_json(model, observation)
+            ScoringService._probe_observations.append(observation)
             return flask.Response(response=response_payload, status=httplib.OK, mimetype="application/json",
                                   content_type="application/json")
     elif content_type == CONTENT_TYPE_JSONLINES:
         #  Content type is application/jsonlines, which means this is Batch Inference mode
-        data = payload.decode("utf-8")
-        f = StringIO(data)
-        response = [_score_json(model, json.loads(line), response_content_type=response_content_type) for line in f.readlines()]
-        response_payload = "\n".join(response)
-        return flask.Response(response=response_payload, status=httplib.OK, mimetype=response_content_type,
-                              content_type=response_content_type)
+        # rows are parsed, scored and streamed back chunk by chunk so that memory stays flat for large payloads
+        chunks = _iter_jsonlines_chunks(_get_batch_request_stream(), ScoringService.BATCH_CHUNK_ROWS)
+        response = _stream_batch_response(model, chunks, response_content_type)
+        return flask.Response(response=flask.stream_with_context(response), status=httplib.OK,
+                              mimetype=response_content_type, content_type=response_content_type)
     else:
         # content type is csv, batch inference
-        data = payload.decode("utf-8")
-        rows_ = np.genfromtxt(StringIO(data), delimiter=',').astype(float)
-        rows = rows_.tolist()
-        # if this was a single record, we will just have a single list
-        # the loop below expects a list of lists, so pack it up
-        if len(rows_.shape) == 1:
-            rows = [rows]
-        response = [
-            _score_json(
-                model,
-                row,
-                response_content_type=response_content_type
-            )
-            for row in rows
-        ]
-        response_payload = "\n".join(response)
-        return flask.Response(response=response_payload, status=httplib.OK, mimetype=response_content_type,
-                              content_type=response_content_type)
+        rows_chunks = _iter_csv_chunks(_get_batch_request_stream(), ScoringService.BATCH_CHUNK_ROWS)
+        chunks = ((rows, None) for rows in rows_chunks)
+        response = _stream_batch_response(model, chunks, response_content_type)
+        return flask.Response(response=flask.stream_with_context(response), status=httplib.OK,
+                              mimetype=response_content_type, content_type=response_content_type)
 
 
 @ScoringService.app.route("/execution-parameters", methods=["GET"])
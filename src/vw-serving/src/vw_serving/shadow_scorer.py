@@ -0,0 +1,90 @@
+import json
+import logging
+import random
+import threading
+import time
+from queue import Queue, Full
+
+import numpy as np
+
+SHADOW_LOG_TEMPLATE = ('{"event_id": %d, "observation": %s, "model_id": %s, "action_probs": %s, '
+                       '"shadow_model_id": %s, "shadow_action_probs": %s, "timestamp": %d, "type": "shadow"}')
+
+
+class ShadowScorer:
+    def __init__(self, model, model_id, publish, max_queue_size=1000, sample_rate=1.0):
+        """
+        Scores copies of live observations with a candidate model in a
+        background thread and logs the action probabilities of the hosted and
+        the candidate model side by side. Observations are dropped, never
+        waited for, when the queue is full, so scoring requests is not slowed
+        down by the candidate.
+        Args:
+            model: started scoring engine of the candidate model
+            model_id (str): id of the candidate model
+            publish (callable): logs a shadow record, e.g. to the experience channel
+            max_queue_size (int): maximum number of observations waiting to be scored
+            sample_rate (float): fraction of the observations that are shadow scored
+        """
+        self.logger = logging.getLogger("vw_model.ShadowScorer")
+        self.model = model
+        self.model_id = model_id
+        self.publish = publish
+        self.sample_rate = sample_rate
+        self.num_scored = 0
+        self.num_dropped = 0
+        self.num_errors = 0
+        self._queue = Queue(maxsize=max_queue_size)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._score_forever, daemon=True)
+        self._thread.start()
+
+    def submit(self, event_id, observation, model_id, action_probs):
+        """
+        Queues an observation scored by the hosted model, returns immediately
+        """
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        try:
+            self._queue.put_nowait((event_id, observation, model_id, action_probs))
+        except Full:
+            self.num_dropped += 1
+
+    def _score_forever(self):
+        while not self._closed.is_set():
+            item = self._queue.get()
+            if item is None:
+                return
+            event_id, observation, model_id, action_probs = item
+            try:
+                shadow_action_probs = self.model.predict(observation)
+                self.publish(SHADOW_LOG_TEMPLATE % (
+                    event_id, json.dumps(observation), json.dumps(model_id),
+                    json.dumps(np.asarray(action_probs).tolist()), json.dumps(self.model_id),
+                    json.dumps(np.asarray(shadow_action_probs).tolist()), int(time.time())))
+                self.num_scored += 1
+            except Exception:
+                self.num_errors += 1
+                self.logger.exception("Unable to shadow score with Model ID:%s", self.model_id)
+
+    def stats(self):
+        return {
+            "shadow_model_id": self.model_id,
+            "scored": self.num_scored,
+            "dropped": self.num_dropped,
+            "errors": self.num_errors,
+            "queued": self._queue.qsize(),
+        }
+
+    def close(self):
+        """
+        Stops scoring, drops the queued observations and closes the candidate model.
+        """
+        self._closed.set()
+        try:
+            self._queue.put_nowait(None)
+        except Full:
+            pass
+        self._thread.join(timeout=5)
+        self.logger.info("Shadow scoring stats: %s", self.stats())
+        return self.model.close()
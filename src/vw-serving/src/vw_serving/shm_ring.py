@@ -0,0 +1,220 @@
+"""Single producer, single consumer ring buffers of length-prefixed records in shared memory.
+
+Each gunicorn worker writes its experience records to its own ring, a file mapped into memory, and the
+experience logger process of ModelManager reads every ring in the directory. There is no lock between the
+processes: the producer only writes the tail offset and the consumer only writes the head offset. Offsets
+grow forever and are taken modulo the capacity, so the ring is empty when they are equal.
+
+The header holds, in separate cache lines so the two processes do not share one:
+
+* tail (u64), number of records written (u64), number of records dropped because the ring was full (u64)
+  and pid of the producer (u64), written by the producer
+* head (u64), written by the consumer
+
+The producer creates its ring and removes it when it exits. Ring paths hold the pid of their producer, so a
+path is never reused by another producer. The consumer drains and forgets the rings that were removed, and
+removes the rings of producers that died without removing theirs.
+
+A record is a u32 length followed by the payload, and wraps around the end of the ring. The producer writes
+a record before the tail that exposes it, which the consumer sees in that order on x86, whose stores are not
+reordered.
+"""
+import glob
+import mmap
+import os
+import struct
+import threading
+
+RING_SUFFIX = ".ring"
+DEFAULT_RING_DIR = "/dev/shm/vw_experiences" if os.path.isdir("/dev/shm") else "/tmp/vw_experiences"
+
+_U64 = struct.Struct("<Q")
+_LENGTH = struct.Struct("<I")
+_TAIL_OFFSET = 0
+_WRITTEN_OFFSET = 8
+_DROPPED_OFFSET = 16
+_WRITER_PID_OFFSET = 24
+_HEAD_OFFSET = 64
+_HEADER_SIZE = 128
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ShmRingBuffer:
+    def __init__(self, path, capacity=None):
+        """
+        Ring buffer mapped from the file at path. If capacity is given, the
+        caller is the producer and creates the file with capacity bytes of
+        records. A new file is initialized under a temporary name and renamed,
+        so that the consumer never maps a partial header.
+        Args:
+            path (str): file of the ring, e.g. in /dev/shm
+            capacity (int): bytes of records, only used to create the file
+        """
+        self.path = path
+        if capacity is not None:
+            temp_path = "{}.{}.tmp".format(path, os.getpid())
+            with open(temp_path, "wb") as f:
+                f.truncate(_HEADER_SIZE + capacity)
+                f.seek(_WRITER_PID_OFFSET)
+                f.write(_U64.pack(os.getpid()))
+            os.rename(temp_path, path)
+        with open(path, "r+b") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0)
+            self._inode = os.fstat(f.fileno()).st_ino
+        self.capacity = len(self._mmap) - _HEADER_SIZE
+
+    def _get(self, offset):
+        return _U64.unpack_from(self._mmap, offset)[0]
+
+    def _set(self, offset, value):
+        _U64.pack_into(self._mmap, offset, value)
+
+    def _copy_in(self, position, data):
+        start = _HEADER_SIZE + position % self.capacity
+        first = min(len(data), _HEADER_SIZE + self.capacity - start)
+        self._mmap[start:start + first] = data[:first]
+        if first < len(data):
+            self._mmap[_HEADER_SIZE:_HEADER_SIZE + len(data) - first] = data[first:]
+
+    def _copy_out(self, position, size):
+        start = _HEADER_SIZE + position % self.capacity
+        first = min(size, _HEADER_SIZE + self.capacity - start)
+        data = self._mmap[start:start + first]
+        if first < size:
+            data += self._mmap[_HEADER_SIZE:_HEADER_SIZE + size - first]
+        return data
+
+    def write(self, record):
+        """
+        Appends a record, producer side. Returns False and counts the record
+        as dropped if the ring does not have room for it.
+        """
+        tail = self._get(_TAIL_OFFSET)
+        size = _LENGTH.size + len(record)
+        if size > self.capacity - (tail - self._get(_HEAD_OFFSET)):
+            self._set(_DROPPED_OFFSET, self._get(_DROPPED_OFFSET) + 1)
+            return False
+        self._copy_in(tail, _LENGTH.pack(len(record)) + record)
+        self._set(_WRITTEN_OFFSET, self._get(_WRITTEN_OFFSET) + 1)
+        self._set(_TAIL_OFFSET, tail + size)
+        return True
+
+    def read_all(self, max_records=None):
+        """
+        Removes and returns the records written so far, consumer side
+        """
+        head = self._get(_HEAD_OFFSET)
+        tail = self._get(_TAIL_OFFSET)
+        records = []
+        while head < tail and (max_records is None or len(records) < max_records):
+            length = _LENGTH.unpack(self._copy_out(head, _LENGTH.size))[0]
+            records.append(self._copy_out(head + _LENGTH.size, length))
+            head += _LENGTH.size + length
+        self._set(_HEAD_OFFSET, head)
+        return records
+
+    @property
+    def writer_pid(self):
+        return self._get(_WRITER_PID_OFFSET)
+
+    def is_linked(self):
+        """
+        Returns False if the file of the ring was removed
+        """
+        try:
+            return os.stat(self.path).st_ino == self._inode
+        except FileNotFoundError:
+            return False
+
+    def is_orphaned(self):
+        """
+        Returns True if no producer will write to the ring anymore
+        """
+        return not self.is_linked() or (self.writer_pid != 0 and not pid_alive(self.writer_pid))
+
+    def unlink(self):
+        """
+        Removes the file of the ring, if it was not removed already. The
+        mapping stays readable until the ring is closed.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        tail = self._get(_TAIL_OFFSET)
+        return {
+            "written": self._get(_WRITTEN_OFFSET),
+            "dropped": self._get(_DROPPED_OFFSET),
+            "used_bytes": tail - self._get(_HEAD_OFFSET),
+            "capacity_bytes": self.capacity,
+        }
+
+    def close(self):
+        self._mmap.close()
+
+
+class ShmExperiencePublisher:
+    def __init__(self, ring):
+        """
+        Stand-in of ExperiencePublisher writing the records of a worker to its
+        ring buffer. The threads of a worker take turns on a lock, the ring
+        has a single producer.
+        Args:
+            ring (ShmRingBuffer): ring of the worker
+        """
+        self.ring = ring
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def publish(self, message):
+        """
+        Writes a record, returns False if it was dropped
+        """
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        with self._lock:
+            return not self.closed and self.ring.write(message)
+
+    def publish_many(self, messages):
+        """
+        Writes a list of records, returns False if any was dropped
+        """
+        messages = [message.encode("utf-8") if isinstance(message, str) else message for message in messages]
+        with self._lock:
+            return not self.closed and all([self.ring.write(message) for message in messages])
+
+    def stats(self):
+        return self.ring.stats()
+
+    def close(self):
+        """
+        Stops writing and removes the ring, the consumer reads the records
+        left in it from its own mapping
+        """
+        with self._lock:
+            self.closed = True
+            self.ring.unlink()
+            self.ring.close()
+
+
+def worker_ring_path(ring_dir, pid, slot=None):
+    """Returns the path of the ring of a worker, unique to its process so that a respawned worker never
+    reuses the path of the ring of the worker it replaces
+    """
+    name = "worker-{}".format(pid) if slot is None else "worker-{}-{}".format(slot, pid)
+    return os.path.join(ring_dir, name + RING_SUFFIX)
+
+
+def find_rings(ring_dir):
+    return sorted(glob.glob(os.path.join(ring_dir, "*" + RING_SUFFIX)))
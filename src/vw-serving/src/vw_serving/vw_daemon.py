@@ -0,0 +1,200 @@
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+from queue import Queue, Empty
+
+import numpy as np
+
+from vw_serving.example_formatter import format_example, iter_example_slices
+from vw_serving.vw_model import VWError, VWModelDown
+
+DAEMON_HOST = "127.0.0.1"
+
+
+def get_free_port():
+    """Returns a TCP port on the loopback interface that is currently free
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((DAEMON_HOST, 0))
+        return s.getsockname()[1]
+
+
+def start_vw_daemon(metadata_loc, weights_loc, num_children, port=None, startup_timeout=30):
+    """Starts one `vw --daemon` process serving the model on a loopback port.
+
+    The daemon loads the weights once and forks num_children children to score connections, so the
+    weights are shared by every Gunicorn worker.
+
+    Returns a tuple (subprocess.Popen, int) of the daemon process and its port.
+    """
+    with open(metadata_loc) as f:
+        metadata = f.read().strip()
+    port = port or get_free_port()
+    cmd = ["vw", *metadata.split(), "--quiet", "--testonly", "-i", os.path.expanduser(weights_loc),
+           "--daemon", "--foreground", "--port", str(port), "--num_children", str(num_children)]
+    logging.info("Starting VW daemon: %s", cmd)
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+
+    deadline = time.time() + startup_timeout
+    while True:
+        if proc.poll() is not None:
+            raise VWError("VW daemon exited with code %s" % proc.returncode)
+        try:
+            socket.create_connection((DAEMON_HOST, port), timeout=1).close()
+            break
+        except OSError:
+            if time.time() > deadline:
+                stop_vw_daemon(proc)
+                raise VWError("VW daemon did not accept connections on port %s" % port)
+            time.sleep(0.1)
+    logging.info("VW daemon started on port %s with PID: %s", port, proc.pid)
+    return proc, port
+
+
+def stop_vw_daemon(proc):
+    proc.terminate()
+    proc.wait()
+
+
+class VWDaemonConnection:
+    def __init__(self, host, port, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class VWDaemonModel:
+    def __init__(self, port, host=DAEMON_HOST, max_connections=1, timeout=None):
+        """
+        Scores a model served by a shared VW daemon over pooled persistent
+        socket connections. Every VW daemon child serves one connection until
+        it is closed, so the daemon needs max_connections children per worker.
+        Connections are opened on demand and kept for reuse.
+        Args:
+            port (int): port of the VW daemon
+            host (str): host of the VW daemon
+            max_connections (int): maximum number of connections opened by this model
+            timeout (float): socket timeout in seconds
+        """
+        self.logger = logging.getLogger("vw_model.VWDaemonModel")
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.closed = False
+        self._connection_slots = threading.BoundedSemaphore(max_connections)
+        self._idle_connections = Queue()
+
+    def start(self):
+        """
+        Checks the daemon is scoring
+        """
+        if self.closed:
+            raise VWError("Cannot start a closed model")
+        try:
+            self.predict([])
+        except Exception as e:
+            self.logger.exception("Unable to score on the VW daemon.")
+            raise VWError("Cannot score on the VW daemon at port %s: %s" % (self.port, e))
+
+    def _checkout(self):
+        self._connection_slots.acquire()
+        try:
+            return self._idle_connections.get_nowait()
+        except Empty:
+            pass
+        try:
+            return VWDaemonConnection(self.host, self.port, timeout=self.timeout)
+        except OSError:
+            self._connection_slots.release()
+            raise VWModelDown()
+
+    def _checkin(self, connection, broken=False):
+        if broken or self.closed:
+            connection.close()
+        else:
+            self._idle_connections.put_nowait(connection)
+        self._connection_slots.release()
+
+    def _score(self, payload, num_examples):
+        connection = self._checkout()
+        writer_errors = []
+
+        def write_examples():
+            try:
+                connection.sock.sendall(payload)
+            except Exception as e:
+                writer_errors.append(e)
+
+        try:
+            if num_examples == 1:
+                write_examples()
+                lines = [connection.reader.readline()]
+            else:
+                writer = threading.Thread(target=write_examples, daemon=True)
+                writer.start()
+                lines = [connection.reader.readline() for _ in range(num_examples)]
+                writer.join()
+        except OSError:
+            self._checkin(connection, broken=True)
+            raise VWModelDown()
+
+        if writer_errors or not all(lines):
+            self._checkin(connection, broken=True)
+            raise VWModelDown()
+        self._checkin(connection)
+        return lines
+
+    def predict(self, context_vector):
+        """
+        Scores an example on the VW daemon
+        Args:
+            context_vector (list): A vector of context features
+        Returns:
+            np.array: A numpy array of action probabilities
+        """
+        if self.closed:
+            raise VWError("trying to score a closed model")
+        line = self._score((format_example(context_vector) + "\n").encode(), 1)[0]
+        scores = np.array(line.split(), dtype=float)
+        scores = (scores / scores.sum())
+        return scores
+
+    def predict_many(self, context_vectors):
+        """
+        Scores a batch of examples pipelined over one connection of the VW daemon,
+        one slice of FORMAT_SLICE_ROWS examples at a time
+        Args:
+            context_vectors (list): A list of context feature vectors
+        Returns:
+            np.array: A 2-D numpy array of action probabilities, one row per example
+        """
+        if self.closed:
+            raise VWError("trying to score a closed model")
+        num_examples = len(context_vectors)
+        if num_examples == 0:
+            return np.empty((0, 0))
+        lines = []
+        for examples, num_slice_examples in iter_example_slices(context_vectors):
+            lines += self._score(examples.encode(), num_slice_examples)
+        try:
+            scores = np.array(b" ".join(lines).split(), dtype=float).reshape(num_examples, -1)
+        except ValueError as e:
+            raise VWError("Unable to parse the scores returned by VW: %s" % e)
+        scores = scores / scores.sum(axis=1, keepdims=True)
+        return scores
+
+    def close(self):
+        """
+        Closes the connections to the VW daemon. The daemon itself is owned by the model manager.
+        """
+        self.closed = True
+        while not self._idle_connections.empty():
+            self._idle_connections.get_nowait().close()
+        return ""
@@ -1,8 +1,13 @@
 import subprocess
 import os
 import logging
+import select
+import threading
+from collections import deque
 import numpy as np
 
+from vw_serving.example_formatter import format_example, iter_example_slices
+
 
 class VWError(Exception):
     """ Class for errors """
@@ -19,12 +24,25 @@ class VWModelDown(Exception):
         super(VWModelDown, self).__init__("The model is down")
 
 
+class VWModelTimeout(VWModelDown):
+    """ When the model does not answer before the read deadline """
+
+    def __init__(self, timeout):
+        super(VWModelDown, self).__init__("The model did not answer within %s seconds" % timeout)
+
+
 class VWModel:
-    def __init__(self, model_path=None, cli_args="", test_only=True, quiet_mode=True):
+    # number of trailing stderr lines kept to be returned by close()
+    STDERR_TAIL_LINES = 100
+    CLOSE_TIMEOUT = 5
+
+    def __init__(self, model_path=None, cli_args="", test_only=True, quiet_mode=True, read_timeout=None):
         """
         Args:
             model_path (str): location of the model weights
             cli_args (str): additional args to pass to VW
+            read_timeout (float): seconds VW may go without answering a pending example
+                before it is considered hung, None to wait forever
         """
         self.logger = logging.getLogger("vw_model.VWModel")
         self.logger.info("creating an instance of VWModel")
@@ -34,6 +52,10 @@ class VWModel:
         self.closed = False
         self.current_proc = None
         self.test_mode = test_only
+        self.read_timeout = read_timeout
+        self._stdout_buffer = b""
+        self._stderr_tail = deque(maxlen=self.STDERR_TAIL_LINES)
+        self._stderr_thread = None
 
         if len(cli_args) == 0:
             raise VWError("No arguments specified to create/load a VW model.")
@@ -75,6 +97,12 @@ class VWModel:
 
         self.logger.info("Started VW process!")
 
+        # VW keeps writing progress and warnings to stderr. Drain it so a
+        # full pipe buffer can never stall scoring.
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, args=(self.current_proc.stderr,),
+                                               daemon=True)
+        self._stderr_thread.start()
+
         # Check if process didn't close with some error
         if self.test_mode:
             try:
@@ -83,6 +111,41 @@ class VWModel:
                 self.logger.exception("Unable to load VW model. Please check the arguments.")
                 raise VWError("Cannot load the model with the provided arguments: %s" % e)
 
+    def _drain_stderr(self, stderr):
+        for line in iter(stderr.readline, b""):
+            self._stderr_tail.append(line)
+            self.logger.debug("VW: %s", line.decode(errors="replace").rstrip())
+
+    def _write(self, payload):
+        try:
+            self.current_proc.stdin.write(payload)
+            self.current_proc.stdin.flush()
+        except OSError:
+            raise VWModelDown()
+
+    def _read_lines(self, num_lines):
+        """
+        Reads num_lines lines from the VW process. Raises VWModelTimeout if VW
+        does not produce any output for read_timeout seconds while lines are
+        pending and VWModelDown if the process exits.
+        """
+        fd = self.current_proc.stdout.fileno()
+        chunks = [self._stdout_buffer]
+        num_newlines = self._stdout_buffer.count(b"\n")
+        while num_newlines < num_lines:
+            if self.read_timeout is not None:
+                readable, _, _ = select.select([fd], [], [], self.read_timeout)
+                if not readable:
+                    raise VWModelTimeout(self.read_timeout)
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise VWModelDown()
+            chunks.append(chunk)
+            num_newlines += chunk.count(b"\n")
+
+        *lines, self._stdout_buffer = b"".join(chunks).split(b"\n", num_lines)
+        return lines
+
     def learn(self, context_vector, action, cost, probability):
         parsed_example = self.parse_example(context_vector) + "\n"
 
@@ -97,12 +160,10 @@ class VWModel:
         if self.current_proc.returncode is not None:
             raise VWModelDown()
 
-        self.current_proc.stdin.write(parsed_example.encode())
-        self.current_proc.stdin.flush()
-        self.current_proc.stdout.flush()
+        self._write(parsed_example.encode())
 
         # VW will make a prediction on each training instance too.
-        self.current_proc.stdout.readline()
+        self._read_lines(1)
 
     def predict(self, context_vector):
         """
@@ -121,34 +182,94 @@ class VWModel:
         if self.current_proc.returncode is not None:
             raise VWModelDown()
 
-        self.current_proc.stdin.write(parsed_example.encode())
-
         # we need to flush to score & collect the score
         # otherwise one needs to wait for the process to end
-        self.current_proc.stdin.flush()
-        self.current_proc.stdout.flush()
+        self._write(parsed_example.encode())
 
-        scores = np.array(list(map(float, self.current_proc.stdout.readline().split())))
+        scores = np.array(self._read_lines(1)[0].split(), dtype=float)
         scores = (scores / scores.sum())
         return scores
 
+    def predict_many(self, context_vectors):
+        """
+        Scores a batch of examples using the shell process.
+        The examples are formatted in slices of FORMAT_SLICE_ROWS rows and every
+        slice is streamed into stdin from a writer thread while the scores are
+        read back, so a large batch cannot deadlock on a full pipe, does not pay
+        one pipe round trip per example and is never held as one large text.
+        Args:
+            context_vectors (list): A list of context feature vectors
+        Returns:
+            np.array: A 2-D numpy array of action probabilities, one row per example
+        """
+        if self.current_proc is None:
+            raise VWError("trying to score model when current_proc is None")
+
+        if self.current_proc.returncode is not None:
+            raise VWModelDown()
+
+        num_examples = len(context_vectors)
+        if num_examples == 0:
+            return np.empty((0, 0))
+
+        lines = []
+        writer_errors = []
+        pending = None
+        try:
+            # the next slice is formatted while VW scores the written one, whose
+            # scores are read before the next slice is written
+            for examples, num_slice_examples in iter_example_slices(context_vectors):
+                if pending is not None:
+                    written, pending = pending, None
+                    lines += self._read_slice(*written, writer_errors)
+                pending = self._start_writer(examples.encode(), writer_errors), num_slice_examples
+        finally:
+            # a slice that failed to format is never written, the written ones
+            # are still read so the pipe stays in sync
+            if pending is not None:
+                lines += self._read_slice(*pending, writer_errors)
+
+        try:
+            scores = np.array(b" ".join(lines).split(), dtype=float).reshape(num_examples, -1)
+        except ValueError as e:
+            raise VWError("Unable to parse the scores returned by VW: %s" % e)
+        scores = scores / scores.sum(axis=1, keepdims=True)
+        return scores
+
+    def _start_writer(self, payload, writer_errors):
+        def write_examples():
+            try:
+                self._write(payload)
+            except Exception as e:
+                writer_errors.append(e)
+
+        writer = threading.Thread(target=write_examples, daemon=True)
+        writer.start()
+        return writer
+
+    def _read_slice(self, writer, num_examples, writer_errors):
+        lines = self._read_lines(num_examples)
+        writer.join()
+        if writer_errors:
+            raise VWModelDown()
+        return lines
+
     @staticmethod
     def parse_example(context_vector):
         """
         Parses the list of context features to
         a feature string interpretable by VowpalWabbit
         """
-        out_string = " ".join(["%s:%s" % (i + 1, j) for i, j in enumerate(context_vector)])
-        out_string = "| %s" % out_string
-        return out_string
+        return format_example(context_vector)
 
     @staticmethod
-    def load_vw_model(metadata_loc, weights_loc, test_only=True, quiet_mode=True):
+    def load_vw_model(metadata_loc, weights_loc, test_only=True, quiet_mode=True, read_timeout=None):
         """Initialize vw model with given metadata and weights locations
         """
         with open(metadata_loc) as f:
             metadata = f.read().strip()
-        return VWModel(model_path=weights_loc, cli_args=metadata, test_only=test_only, quiet_mode=quiet_mode)
+        return VWModel(model_path=weights_loc, cli_args=metadata, test_only=test_only, quiet_mode=quiet_mode,
+                       read_timeout=read_timeout)
 
     def close(self):
         """
@@ -156,18 +277,143 @@ class VWModel:
         """
         training_info = ""
         if self.current_proc is not None:
-            self.current_proc.stdin.close()
+            try:
+                self.current_proc.stdin.close()
+            except OSError:
+                pass
             self.current_proc.stdout.close()
-            training_info = self.current_proc.stderr.read()
-            self.current_proc.stderr.close()
 
-            # putting wait after terminate will
-            # make sure the process is terminated
-            # before going to the next line
-            self.current_proc.terminate()
-            self.current_proc.wait()
+            # VW writes its summary to stderr and exits once stdin is closed,
+            # a hung process is terminated after CLOSE_TIMEOUT seconds
+            try:
+                self.current_proc.wait(timeout=self.CLOSE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.current_proc.terminate()
+                self.current_proc.wait()
+
+            self._stderr_thread.join()
+            self.current_proc.stderr.close()
+            training_info = b"".join(self._stderr_tail)
 
             self.current_proc = None
 
         self.closed = True
         return training_info
+
+
+class PyVWModel:
+    def __init__(self, model_path=None, cli_args="", test_only=True, quiet_mode=True):
+        """
+        VW model scored in process through the pyvw bindings. It exposes the
+        same interface as VWModel without the text pipes and the context
+        switch to a separate process.
+        Args:
+            model_path (str): location of the model weights
+            cli_args (str): additional args to pass to VW
+        """
+        self.logger = logging.getLogger("vw_model.PyVWModel")
+        self.logger.info("creating an instance of PyVWModel")
+
+        self.closed = False
+        self.current_vw = None
+        self.test_mode = test_only
+
+        if len(cli_args) == 0:
+            raise VWError("No arguments specified to create/load a VW model.")
+
+        self.args = cli_args.split()
+
+        if quiet_mode:
+            self.args.append("--quiet")
+
+        if self.test_mode:
+            self.args.extend(["--testonly"])
+
+        if model_path:
+            self.model_file = os.path.expanduser(os.path.expandvars(model_path))
+            self.args.extend(["-i", self.model_file])
+
+        self.logger.info("successfully created PyVWModel")
+        self.logger.info("arguments: %s", self.args)
+
+    def start(self):
+        """
+        Loads the model into the current process
+        """
+        if self.closed:
+            raise VWError("Cannot start a closed model")
+        if self.current_vw is not None:
+            raise VWError("Cannot start a model with an active current_vw")
+
+        try:
+            from vowpalwabbit import pyvw
+            self._prediction_type = pyvw.pylibvw.vw.pACTION_PROBS
+            self.current_vw = pyvw.vw(" ".join(self.args))
+        except Exception as e:
+            self.logger.exception("Unable to load VW model. Please check the arguments.")
+            raise VWError("Cannot load the model with the provided arguments: %s" % e)
+
+        self.logger.info("Loaded VW model in process!")
+
+        if self.test_mode:
+            try:
+                self.predict([])
+            except Exception as e:
+                self.logger.exception("Unable to score VW model. Please check the arguments.")
+                raise VWError("Cannot load the model with the provided arguments: %s" % e)
+
+    def predict(self, context_vector):
+        """
+        Scores an example in process
+        Args:
+            context_vector (list): A vector of context features
+        Returns:
+            np.array: A numpy array of action probabilities
+        """
+        if self.current_vw is None:
+            raise VWError("trying to score model when current_vw is None")
+
+        scores = np.array(self.current_vw.predict(VWModel.parse_example(context_vector),
+                                                  prediction_type=self._prediction_type), dtype=float)
+        scores = (scores / scores.sum())
+        return scores
+
+    def predict_many(self, context_vectors):
+        """
+        Scores a batch of examples in process. The pyvw bindings score one
+        example per call, so the examples are still scored sequentially: only
+        the formatting of the examples, one slice of FORMAT_SLICE_ROWS rows at
+        a time, and the normalization of the scores are done in bulk.
+        Args:
+            context_vectors (list): A list of context feature vectors
+        Returns:
+            np.array: A 2-D numpy array of action probabilities, one row per example
+        """
+        if self.current_vw is None:
+            raise VWError("trying to score model when current_vw is None")
+        if len(context_vectors) == 0:
+            return np.empty((0, 0))
+
+        scores = np.array([self.current_vw.predict(example, prediction_type=self._prediction_type)
+                           for examples, _ in iter_example_slices(context_vectors)
+                           for example in examples.splitlines()], dtype=float)
+        return scores / scores.sum(axis=1, keepdims=True)
+
+    @staticmethod
+    def load_vw_model(metadata_loc, weights_loc, test_only=True, quiet_mode=True):
+        """Initialize pyvw model with given metadata and weights locations
+        """
+        with open(metadata_loc) as f:
+            metadata = f.read().strip()
+        return PyVWModel(model_path=weights_loc, cli_args=metadata, test_only=test_only, quiet_mode=quiet_mode)
+
+    def close(self):
+        """
+        Closes the model.
+        """
+        if self.current_vw is not None:
+            self.current_vw.finish()
+            self.current_vw = None
+
+        self.closed = True
+        return ""
@@ -0,0 +1,107 @@
+import logging
+import threading
+
+from vw_serving.vw_model import VWError, VWModelDown
+
+
+class VWModelSupervisor:
+    def __init__(self, model_factory, warm_standby=False):
+        """
+        Supervises a VW process and replaces it when it crashes or hangs.
+        With warm_standby a second, already started process is kept ready so
+        that a replacement is swapped in without waiting for VW to load the
+        model. The request that hit the failure is retried once on the
+        replacement, which is safe because --testonly scoring is stateless.
+        Args:
+            model_factory (callable): returns a new, not started VW model
+            warm_standby (bool): keep a started standby process
+        """
+        self.logger = logging.getLogger("vw_model.VWModelSupervisor")
+        self.model_factory = model_factory
+        self.warm_standby = warm_standby
+        self.closed = False
+        self.active_model = None
+        self.standby_model = None
+        self.num_respawns = 0
+        self._lock = threading.Lock()
+        self._replace_lock = threading.Lock()
+
+    def _start_model(self):
+        model = self.model_factory()
+        model.start()
+        return model
+
+    def _start_standby(self):
+        try:
+            standby_model = self._start_model()
+        except Exception:
+            self.logger.exception("Unable to start a standby VW process")
+            standby_model = None
+        with self._lock:
+            if self.closed:
+                if standby_model is not None:
+                    standby_model.close()
+                return
+            self.standby_model = standby_model
+
+    def _start_standby_in_background(self):
+        threading.Thread(target=self._start_standby, daemon=True).start()
+
+    def start(self):
+        """
+        Starts the active process and, with warm_standby, a standby process in the background
+        """
+        if self.closed:
+            raise VWError("Cannot start a closed model")
+        self.active_model = self._start_model()
+        if self.warm_standby:
+            self._start_standby_in_background()
+
+    def _replace(self, failed_model):
+        with self._replace_lock:
+            if self.active_model is not failed_model:
+                # another thread already replaced it
+                return
+            with self._lock:
+                standby_model, self.standby_model = self.standby_model, None
+            if standby_model is None:
+                standby_model = self._start_model()
+            self.active_model = standby_model
+            self.num_respawns += 1
+
+        self.logger.warning("Replaced a failed VW process (%s replacements so far)", self.num_respawns)
+        threading.Thread(target=self._close_failed_model, args=(failed_model,), daemon=True).start()
+        if self.warm_standby:
+            self._start_standby_in_background()
+
+    def _close_failed_model(self, model):
+        try:
+            training_info = model.close()
+            self.logger.warning("Failed VW process output: %s", training_info)
+        except Exception:
+            self.logger.exception("Unable to close a failed VW process")
+
+    def _call(self, method_name, *args):
+        model = self.active_model
+        try:
+            return getattr(model, method_name)(*args)
+        except VWModelDown as e:
+            self.logger.warning("VW process is down: %s", e)
+            self._replace(model)
+        return getattr(self.active_model, method_name)(*args)
+
+    def predict(self, context_vector):
+        return self._call("predict", context_vector)
+
+    def predict_many(self, context_vectors):
+        return self._call("predict_many", context_vectors)
+
+    def close(self):
+        """
+        Closes the active and the standby processes.
+        """
+        with self._lock:
+            self.closed = True
+            models = [self.active_model, self.standby_model]
+            self.active_model = self.standby_model = None
+        return [model.close() for model in models if model is not None]
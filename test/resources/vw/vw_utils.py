@@ -1,6 +1,8 @@
 import os
 import json
 
+from vw_serving.example_formatter import format_features
+
 TRAIN_CHANNEL = "training"
 EVAL_CHANNEL = "evaluation"
 MODEL_CHANNEL = "pretrained_model"
@@ -19,5 +21,4 @@ def save_vw_model(model, meta):
 
 
 def transform_to_vw(x):
-    x = json.loads(x)
-    return " ".join(["%s:%s" % (i + 1, j) for i, j in enumerate(x)])
+    return format_features(json.loads(x))
@@ -0,0 +1,21 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import os
+import sys
+
+# unit tests import vw_serving from the source tree, without building the serving image
+VW_SERVING_SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'src', 'vw-serving', 'src'))
+if VW_SERVING_SRC_PATH not in sys.path:
+    sys.path.insert(0, VW_SERVING_SRC_PATH)
@@ -0,0 +1,55 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import json
+
+import numpy as np
+import pytest
+
+from vw_serving.example_formatter import format_examples, format_features, format_json_arrays, iter_example_slices
+from vw_serving.sagemaker.exceptions import CustomerError
+
+
+def test_format_features():
+    assert format_features([0.5, -1, 2]) == "1:0.5 2:-1 3:2"
+
+
+def test_format_features_converts_numeric_strings():
+    assert format_features(["0.5", True]) == "1:0.5 2:1"
+
+
+def test_format_examples_rows_of_different_lengths():
+    assert format_examples([[1, 2], [3]]).splitlines() == ["| 1:1 2:2", "| 1:3"]
+
+
+@pytest.mark.parametrize("context_vectors", [[[1, 2], [3, 4], [5, 6], [7, 8], [9, 10]],
+                                             np.arange(10).reshape(5, 2)])
+def test_iter_example_slices_bounds_the_rows_per_slice(context_vectors):
+    slices = list(iter_example_slices(context_vectors, slice_rows=2))
+
+    assert [num_examples for _, num_examples in slices] == [2, 2, 1]
+    assert "".join([examples for examples, _ in slices]) == "".join(
+        ["| " + format_features(context_vector) + "\n" for context_vector in context_vectors])
+
+
+@pytest.mark.parametrize("values", [["abc", 1], [None, 1], [float("nan"), 1], [1, float("inf")]])
+def test_format_features_rejects_invalid_values(values):
+    with pytest.raises(CustomerError):
+        format_features(values)
+
+
+def test_format_json_arrays_writes_non_finite_values_as_null():
+    json_arrays = format_json_arrays([[1.5, float("nan")], [float("-inf"), 2]])
+
+    assert [json.loads(json_array) for json_array in json_arrays] == [[1.5, None], [None, 2]]
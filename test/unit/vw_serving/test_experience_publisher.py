@@ -0,0 +1,139 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+
+import pytest
+
+from vw_serving.experience_publisher import OVERFLOW_BLOCK, ExperiencePublisher
+
+JOIN_TIMEOUT = 5
+
+
+class _FakePipeline:
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.commands = []
+
+    def publish(self, channel, message):
+        self.commands.append(("publish", channel, message))
+
+    def xadd(self, stream, fields, maxlen=None, approximate=True):
+        self.commands.append(("xadd", stream, fields["data"], maxlen, approximate))
+
+    def execute(self):
+        if self.redis_client.down:
+            raise ConnectionError("redis is down")
+        self.redis_client.executed.append(self.commands)
+
+
+class _FakeRedis:
+    def __init__(self, down=False):
+        self.down = down
+        self.executed = []
+
+    def pipeline(self, transaction=True):
+        assert not transaction
+        return _FakePipeline(self)
+
+
+def _wait_for(condition):
+    deadline = time.monotonic() + JOIN_TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def redis_client():
+    return _FakeRedis()
+
+
+def test_buffer_is_flushed_once_it_holds_flush_count_records(redis_client):
+    publisher = ExperiencePublisher(redis_client, "channel", flush_count=3, flush_interval=60)
+
+    publisher.publish_many([b"a", b"b"])
+    publisher.publish(b"c")
+    _wait_for(lambda: publisher.num_published == 3)
+
+    assert redis_client.executed == [[("publish", "channel", message) for message in (b"a", b"b", b"c")]]
+    publisher.close()
+
+
+def test_buffer_is_flushed_after_flush_interval(redis_client):
+    publisher = ExperiencePublisher(redis_client, "channel", flush_count=100, flush_interval=0.02)
+
+    start = time.monotonic()
+    publisher.publish(b"a")
+    _wait_for(lambda: publisher.num_published == 1)
+
+    assert time.monotonic() - start >= 0.02
+    assert redis_client.executed == [[("publish", "channel", b"a")]]
+    publisher.close()
+
+
+def test_records_are_dropped_when_the_buffer_is_full(redis_client):
+    publisher = ExperiencePublisher(redis_client, "channel", buffer_size=2, flush_count=100, flush_interval=60)
+
+    assert publisher.publish_many([b"a", b"b"])
+    assert not publisher.publish(b"c")
+    assert not publisher.publish_many([b"d", b"e"])
+    publisher.close()
+
+    assert publisher.stats() == {"published": 2, "dropped": 3, "blocked": 0, "failed": 0, "buffered": 0}
+    assert not publisher.publish(b"f")
+    assert publisher.num_dropped == 4
+
+
+def test_publishers_wait_for_the_flush_of_a_full_buffer(redis_client):
+    # the flush interval is longer than the join timeout, only a blocked publisher triggers the flush
+    publisher = ExperiencePublisher(redis_client, "channel", buffer_size=2, flush_count=100, flush_interval=60,
+                                    overflow_policy=OVERFLOW_BLOCK)
+    publisher.publish_many([b"a", b"b"])
+
+    blocked = threading.Thread(target=publisher.publish, args=(b"c",), daemon=True)
+    blocked.start()
+    blocked.join(JOIN_TIMEOUT)
+    assert not blocked.is_alive()
+    publisher.close()
+
+    assert [[command[2] for command in commands] for commands in redis_client.executed] == [[b"a", b"b"], [b"c"]]
+    assert publisher.stats() == {"published": 3, "dropped": 0, "blocked": 1, "failed": 0, "buffered": 0}
+
+
+def test_records_of_a_failed_flush_are_counted(caplog):
+    publisher = ExperiencePublisher(_FakeRedis(down=True), "channel", flush_count=2, flush_interval=60)
+
+    with caplog.at_level(logging.ERROR):
+        publisher.publish_many([b"a", b"b"])
+        publisher.close()
+
+    assert publisher.stats() == {"published": 0, "dropped": 0, "blocked": 0, "failed": 2, "buffered": 0}
+    assert "Unable to publish 2 experience records" in caplog.text
+
+
+def test_records_are_appended_to_a_trimmed_stream(redis_client):
+    publisher = ExperiencePublisher(redis_client, "stream", flush_count=100, flush_interval=60, stream_maxlen=1000)
+
+    publisher.publish(b"a")
+    publisher.close()
+
+    assert redis_client.executed == [[("xadd", "stream", b"a", 1000, True)]]
+
+
+def test_unknown_overflow_policy(redis_client):
+    with pytest.raises(ValueError):
+        ExperiencePublisher(redis_client, "channel", overflow_policy="spill")
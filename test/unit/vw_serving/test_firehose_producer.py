@@ -0,0 +1,208 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import gzip
+import logging
+
+import pytest
+import redis
+
+from vw_serving.firehose_producer import MAX_RECORD_BYTES, FirehoseProducer, aggregate_records
+
+
+class _FakeFirehoseClient:
+    def __init__(self, fail=False, failed_indices=()):
+        self.fail = fail
+        self.failed_indices = set(failed_indices)
+        self.batches = []
+
+    def put_record_batch(self, DeliveryStreamName, Records):
+        if self.fail:
+            raise RuntimeError("firehose failure")
+        self.batches.append(Records)
+        return {"FailedPutCount": len(self.failed_indices),
+                "RequestResponses": [{"ErrorCode": "ServiceUnavailable"} if i in self.failed_indices else {}
+                                     for i in range(len(Records))]}
+
+
+def _records(num_records):
+    return [{"Data": "record {}\n".format(i).encode()} for i in range(num_records)]
+
+
+def test_send_batches():
+    client = _FakeFirehoseClient()
+    producer = FirehoseProducer("stream", firehose_client=client)
+
+    assert producer.send_batches(_records(501)) == []
+    producer.close()
+
+    assert [len(batch) for batch in client.batches] == [500, 1]
+    assert producer.num_failed == 0
+
+
+def test_failed_batches_are_logged_and_counted(caplog):
+    producer = FirehoseProducer("stream", firehose_client=_FakeFirehoseClient(fail=True))
+    records = _records(3)
+
+    with caplog.at_level(logging.ERROR):
+        assert producer.send_batches(records) == records
+        producer.close()
+
+    assert producer.num_failed == 3
+    assert "Unable to send 3 records to Firehose stream: stream" in caplog.text
+
+
+def test_records_failing_every_retry_are_counted():
+    producer = FirehoseProducer("stream", max_retries=0, firehose_client=_FakeFirehoseClient(failed_indices=[1]))
+    records = _records(3)
+
+    assert producer.send_batches(records) == [records[1]]
+    producer.close()
+
+    assert producer.num_failed == 1
+
+
+def _lines(num_records, line_bytes=100):
+    return [{"Data": "{:0{}d}\n".format(i, line_bytes - 1).encode()} for i in range(num_records)]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_aggregate_records_round_trip(compress):
+    records = _lines(30000)
+
+    aggregates = aggregate_records(records, compress=compress)
+
+    assert len(aggregates) == 3
+    data = b"".join(aggregate["Data"] for aggregate, _ in aggregates)
+    # the aggregates of a delivered object are a multi member gzip stream
+    if compress:
+        data = gzip.decompress(data)
+    assert data == b"".join(record["Data"] for record in records)
+    assert [record for _, parts in aggregates for record in parts] == records
+
+
+def test_aggregate_records_respect_the_record_limit():
+    records = _lines(3000, line_bytes=1000)
+
+    aggregates = aggregate_records(records)
+
+    assert all(len(aggregate["Data"]) <= MAX_RECORD_BYTES for aggregate, _ in aggregates)
+    # whole lines, as many as fit
+    assert [len(parts) for _, parts in aggregates] == [1024, 1024, 952]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_failed_aggregates_map_back_to_their_records(compress):
+    producer = FirehoseProducer("stream", aggregate=True, compress=compress,
+                                firehose_client=_FakeFirehoseClient(fail=True))
+    records = _lines(20000)
+
+    assert producer.send_batches(records) == records
+    producer.close()
+
+    assert producer.num_failed == 20000
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_aggregates_failing_every_retry_count_their_records(compress):
+    producer = FirehoseProducer("stream", max_retries=0, aggregate=True, compress=compress,
+                                firehose_client=_FakeFirehoseClient(failed_indices=[0]))
+    records = _lines(20000)
+
+    # the first aggregate holds the first 10240 records
+    assert producer.send_batches(records) == records[:10240]
+    producer.close()
+
+    assert producer.num_failed == 10240
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_buffered_aggregates_round_trip(compress):
+    client = _FakeFirehoseClient()
+    producer = FirehoseProducer("stream", aggregate=True, compress=compress, firehose_client=client)
+    lines = ["line {}".format(i) for i in range(25000)]
+
+    producer.put_records(lines)
+    producer.close()
+
+    aggregates = [record["Data"] for batch in client.batches for record in batch]
+    assert all(len(aggregate) <= MAX_RECORD_BYTES for aggregate in aggregates)
+    data = b"".join(gzip.decompress(aggregate) if compress else aggregate for aggregate in aggregates)
+    assert data.decode().splitlines() == lines
+
+
+class _StopConsuming(Exception):
+    pass
+
+
+class _FakeStreamRedis:
+    """Answers the reads of a consumer group with scripted responses, stops the consumer once they run out"""
+
+    def __init__(self, responses, group_exists=False):
+        self.responses = list(responses)
+        self.group_exists = group_exists
+        self.reads = []
+        self.acks = []
+
+    def xgroup_create(self, stream, group, id="$", mkstream=False):
+        if self.group_exists:
+            raise redis.exceptions.ResponseError("BUSYGROUP Consumer Group name already exists")
+
+    def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        self.reads.append((streams["stream"], block))
+        if not self.responses:
+            raise _StopConsuming()
+        entries = self.responses.pop(0)
+        return [[b"stream", entries]] if entries else []
+
+    def xack(self, stream, group, *ids):
+        self.acks.append(ids)
+
+
+def _consume(producer, redis_client):
+    with pytest.raises(_StopConsuming):
+        producer.consume_redis_stream("stream", block_ms=0, redis_client=redis_client)
+    producer.close()
+
+
+def test_consume_redis_stream_reads_pending_records_first():
+    client = _FakeFirehoseClient()
+    redis_client = _FakeStreamRedis([
+        # pending records of the previous run, the second one was trimmed from the stream
+        [(b"1-0", {b"data": b"a"}), (b"2-0", {})],
+        [],
+        [(b"3-0", {b"data": b"b"})],
+    ], group_exists=True)
+
+    _consume(FirehoseProducer("stream", firehose_client=client), redis_client)
+
+    assert redis_client.reads == [("0", None), (b"2-0", None), (">", 0), (">", 0)]
+    assert redis_client.acks == [(b"1-0", b"2-0"), (b"3-0",)]
+    assert [[record["Data"] for record in batch] for batch in client.batches] == [[b"a\n"], [b"b\n"]]
+
+
+def test_consume_redis_stream_acknowledges_delivered_records_only():
+    # the second record of every batch fails, the pending one is read again alone and delivered
+    client = _FakeFirehoseClient(failed_indices=[1])
+    redis_client = _FakeStreamRedis([
+        [],
+        [(b"1-0", {b"data": b"a"}), (b"2-0", {b"data": b"b"}), (b"3-0", {b"data": b"c"})],
+        [(b"2-0", {b"data": b"b"})],
+        [],
+    ])
+
+    _consume(FirehoseProducer("stream", max_retries=0, firehose_client=client), redis_client)
+
+    assert redis_client.reads == [("0", None), (">", 0), ("0", None), (b"2-0", None), (">", 0)]
+    assert redis_client.acks == [(b"1-0", b"3-0"), (b"2-0",)]
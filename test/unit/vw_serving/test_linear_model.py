@@ -0,0 +1,145 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from vw_serving.linear_model import VW_CONSTANT_HASH, LinearVWModel, export_linear_model, parse_linear_cli_args, \
+    read_readable_model
+from vw_serving.sagemaker.exceptions import CustomerError
+
+READABLE_MODEL = """Version 8.7.0
+Id
+Min label:-1
+Max label:0
+bits:4
+lda:0
+0 ngram:
+0 skip:
+options: --cb_explore 3 --cb_type dr --epsilon 0.1
+Checksum: 2280154932
+:0
+2:0.25
+7:-1.5
+15:3
+"""
+
+
+def test_parse_linear_cli_args():
+    settings = parse_linear_cli_args("--cb_explore 3 --cb_type ips --epsilon 0.2 -b 20 --quiet -i vw.model")
+    assert settings == {"num_actions": 3, "cb_type": "ips", "epsilon": 0.2, "bits": 20}
+
+
+def test_parse_linear_cli_args_defaults():
+    assert parse_linear_cli_args("--cb_explore 4") == {"num_actions": 4, "cb_type": "dr", "epsilon": 0.05}
+
+
+@pytest.mark.parametrize("cli_args", [
+    "--cb_explore 3 -q ab",
+    "--cb_explore 3 --cb_type mtr",
+    "--cb_explore_adf",
+    "--cb 3",
+    "--cb_explore",
+])
+def test_parse_linear_cli_args_unsupported(cli_args):
+    assert parse_linear_cli_args(cli_args) is None
+
+
+def test_read_readable_model(tmpdir):
+    path = tmpdir.join("readable_model.txt")
+    path.write(READABLE_MODEL)
+
+    header, weights = read_readable_model(str(path))
+
+    assert header == {"bits": 4, "options": "--cb_explore 3 --cb_type dr --epsilon 0.1"}
+    # the ":0" line after the checksum is not a weight
+    assert weights == {2: 0.25, 7: -1.5, 15: 3.0}
+
+
+def _linear_model(feature_costs, bias, weights_per_feature, bits=10, epsilon=0.1):
+    """Builds the dense weights VW would hold for per action feature costs, at (hash * wpf + action) & mask
+    """
+    num_actions = len(bias)
+    weights = np.zeros(2 ** bits, dtype=np.float32)
+    mask = len(weights) - 1
+    for action in range(num_actions):
+        weights[((VW_CONSTANT_HASH & mask) * weights_per_feature + action) & mask] = bias[action]
+        for feature, costs in enumerate(feature_costs, start=1):
+            weights[(feature * weights_per_feature + action) & mask] = costs[action]
+    return LinearVWModel(weights, num_actions, weights_per_feature, epsilon=epsilon)
+
+
+def test_linear_model_epsilon_greedy():
+    # costs: action 0 = x1 + 0.5, action 1 = -x2, action 2 = 0.1
+    model = _linear_model(feature_costs=[[1, 0, 0], [0, -1, 0]], bias=[0.5, 0, 0.1], weights_per_feature=6)
+
+    scores = model.predict_many([[0, 1], [-1, 0], [0, 0]])
+
+    greedy = 0.9 + 0.1 / 3
+    explore = 0.1 / 3
+    np.testing.assert_allclose(scores, [[explore, greedy, explore],
+                                        [greedy, explore, explore],
+                                        [explore, greedy, explore]], rtol=1e-6)
+    np.testing.assert_allclose(scores.sum(axis=1), 1)
+
+
+def test_linear_model_predict_matches_predict_many():
+    model = _linear_model(feature_costs=np.random.uniform(-1, 1, size=(5, 4)).tolist(),
+                          bias=[0.1, 0.2, 0.3, 0.4], weights_per_feature=4)
+    contexts = np.random.uniform(-1, 1, size=(20, 5)).tolist()
+
+    np.testing.assert_allclose(model.predict_many(contexts), np.vstack([model.predict(c) for c in contexts]))
+
+
+def test_linear_model_weight_indices_wrap_around_the_mask():
+    # with 3 bits and 2 weights per feature, action 1 of feature 3 is at (3 * 2 + 1) & 7 = 7
+    weights = np.zeros(8, dtype=np.float32)
+    weights[7] = -2
+    model = LinearVWModel(weights, num_actions=2, weights_per_feature=2, epsilon=0.0)
+
+    np.testing.assert_allclose(model.predict([0, 0, 1]), [0, 1])
+    np.testing.assert_allclose(model.predict([0, 0, 0]), [1, 0])
+
+
+@pytest.mark.skipif(shutil.which("vw") is None, reason="requires the vw binary")
+def test_export_linear_model_matches_vw(tmpdir):
+    data = "\n".join(["{}:{}:0.5 | 1:{} 2:{} 3:{}".format(action, cost, *np.random.uniform(-1, 1, 3).round(3))
+                      for action, cost in zip(np.random.randint(1, 4, 500), np.random.uniform(-1, 0, 500).round(2))])
+    data_path = str(tmpdir.join("train.txt"))
+    with open(data_path, "w") as f:
+        f.write(data + "\n")
+    weights_path = str(tmpdir.join("vw.model"))
+    metadata_path = str(tmpdir.join("vw.metadata"))
+    with open(metadata_path, "w") as f:
+        f.write("--cb_explore 3 --epsilon 0.1")
+    subprocess.run(["vw", "--cb_explore", "3", "--epsilon", "0.1", "-d", data_path, "-f", weights_path, "--quiet"],
+                   check=True)
+
+    # export_linear_model returns None unless the parity check against the VW process passes
+    linear_weights_path = export_linear_model(metadata_path, weights_path, output_dir=str(tmpdir))
+
+    assert linear_weights_path is not None
+    assert os.path.exists(linear_weights_path)
+
+
+@pytest.mark.parametrize("contexts", [[["a", 1]], [[1, 2], ["x"]], [[float("nan"), 1]], [[1, float("inf")]]])
+def test_linear_model_rejects_invalid_values(contexts):
+    model = LinearVWModel(np.zeros(16, dtype=np.float32), num_actions=2, weights_per_feature=2)
+
+    with pytest.raises(CustomerError):
+        model.predict_many(contexts)
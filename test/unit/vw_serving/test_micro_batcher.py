@@ -0,0 +1,160 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from vw_serving.micro_batcher import MicroBatchingModel
+from vw_serving.vw_model import VWError
+
+JOIN_TIMEOUT = 5
+
+
+class _RecordingModel:
+    """Scores every context as the row [context[0], 1], records the batches and blocks while the gate is closed"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.scoring = threading.Event()
+        self.closed = False
+
+    def start(self):
+        pass
+
+    def predict_many(self, context_vectors):
+        self.scoring.set()
+        self.gate.wait(JOIN_TIMEOUT)
+        self.batches.append(list(context_vectors))
+        if self.error is not None:
+            raise self.error
+        return np.array([[context_vector[0], 1.0] for context_vector in context_vectors])
+
+    def close(self):
+        self.closed = True
+        return ""
+
+
+def _predict_in_threads(batcher, context_vectors):
+    results = [None] * len(context_vectors)
+
+    def predict(index):
+        try:
+            results[index] = batcher.predict(context_vectors[index])
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=predict, args=(index,), daemon=True) for index in range(len(context_vectors))]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def _join(threads):
+    for thread in threads:
+        thread.join(JOIN_TIMEOUT)
+    assert not any(thread.is_alive() for thread in threads)
+
+
+def _wait_for(condition):
+    deadline = time.monotonic() + JOIN_TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def model():
+    return _RecordingModel()
+
+
+def test_every_caller_gets_its_own_row(model):
+    batcher = MicroBatchingModel(model, max_batch_size=8, max_delay_us=10 ** 7)
+    batcher.start()
+
+    threads, results = _predict_in_threads(batcher, [[index] for index in range(8)])
+    _join(threads)
+
+    for index, scores in enumerate(results):
+        np.testing.assert_array_equal(scores, [index, 1.0])
+    assert sorted(context_vector[0] for batch in model.batches for context_vector in batch) == list(range(8))
+    batcher.close()
+
+
+def test_batch_is_scored_once_it_holds_max_batch_size_examples(model):
+    # the delay is longer than the join timeout, only a full batch is scored in time
+    batcher = MicroBatchingModel(model, max_batch_size=4, max_delay_us=10 ** 8)
+    batcher.start()
+
+    threads, _ = _predict_in_threads(batcher, [[index] for index in range(4)])
+    _join(threads)
+
+    assert [len(batch) for batch in model.batches] == [4]
+    assert batcher.stats() == {"batches": 1, "examples": 4, "mean_batch_size": 4.0}
+    batcher.close()
+
+
+def test_partial_batch_is_scored_after_max_delay_us(model):
+    batcher = MicroBatchingModel(model, max_batch_size=100, max_delay_us=20000)
+    batcher.start()
+
+    start = time.perf_counter()
+    scores = batcher.predict([3])
+
+    assert time.perf_counter() - start >= 0.02
+    np.testing.assert_array_equal(scores, [3, 1.0])
+    assert model.batches == [[[3]]]
+    batcher.close()
+
+
+def test_model_error_is_raised_to_every_waiter():
+    error = RuntimeError("model failure")
+    model = _RecordingModel(error=error)
+    batcher = MicroBatchingModel(model, max_batch_size=3, max_delay_us=10 ** 7)
+    batcher.start()
+
+    threads, results = _predict_in_threads(batcher, [[index] for index in range(3)])
+    _join(threads)
+
+    assert results == [error, error, error]
+    batcher.close()
+
+
+def test_close_scores_the_waiting_requests(model):
+    batcher = MicroBatchingModel(model, max_batch_size=2, max_delay_us=0)
+    batcher.start()
+    model.gate.clear()
+
+    # the first request holds the model while the next ones wait in the queue
+    first_threads, first_results = _predict_in_threads(batcher, [[0]])
+    assert model.scoring.wait(JOIN_TIMEOUT)
+    waiting_threads, waiting_results = _predict_in_threads(batcher, [[1], [2]])
+    _wait_for(lambda: len(batcher._pending) == 2)
+
+    closer = threading.Thread(target=batcher.close, daemon=True)
+    closer.start()
+    _wait_for(lambda: batcher.closed)
+    with pytest.raises(VWError):
+        batcher.predict([3])
+    model.gate.set()
+    _join([closer, *first_threads, *waiting_threads])
+
+    for index, scores in enumerate(first_results + waiting_results):
+        np.testing.assert_array_equal(scores, [index, 1.0])
+    assert model.closed
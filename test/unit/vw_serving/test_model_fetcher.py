@@ -0,0 +1,114 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import hashlib
+import io
+import os
+import tarfile
+
+import pytest
+
+from vw_serving.model_fetcher import LocalObjectStore, S3ObjectStore, etag_is_md5, fetch_model_archive
+from vw_serving.sagemaker.exceptions import CustomerError
+
+
+def _write_archive(path, members):
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+@pytest.fixture
+def bucket(tmpdir):
+    return tmpdir.mkdir("bucket")
+
+
+def test_local_object_store(bucket):
+    bucket.join("object").write_binary(b"0123456789")
+    store = LocalObjectStore(str(bucket.dirpath()))
+
+    assert store.head("bucket", "object") == (10, '"{}"'.format(hashlib.md5(b"0123456789").hexdigest()), None, None)
+    assert store.get_range("bucket", "object", 2, 5) == b"2345"
+
+
+def test_fetch_model_archive(bucket, tmpdir):
+    model = os.urandom(100000)
+    md5 = _write_archive(str(bucket.join("model.tar.gz")), {"model/vw.metadata": b"--cb_explore 3",
+                                                            "model/vw.model": model})
+    extract_dir = str(tmpdir.mkdir("extracted"))
+
+    etag, actual_md5, model_files = fetch_model_archive(LocalObjectStore(str(tmpdir)), "bucket", "model.tar.gz",
+                                                        extract_dir, part_size=1000, max_concurrency=3)
+
+    assert etag == actual_md5 == md5
+    assert model_files == {"vw.metadata": os.path.join(extract_dir, "model/vw.metadata"),
+                           "vw.model": os.path.join(extract_dir, "model/vw.model")}
+    with open(model_files["vw.model"], "rb") as f:
+        assert f.read() == model
+
+
+@pytest.mark.parametrize("name", ["../outside", "/tmp/outside", "model/../../outside"])
+def test_fetch_model_archive_rejects_members_outside_of_the_archive(bucket, tmpdir, name):
+    _write_archive(str(bucket.join("model.tar.gz")), {name: b"data"})
+    extract_dir = str(tmpdir.mkdir("extracted"))
+
+    with pytest.raises(CustomerError):
+        fetch_model_archive(LocalObjectStore(str(tmpdir)), "bucket", "model.tar.gz", extract_dir)
+    assert not tmpdir.join("outside").exists()
+
+
+def test_fetch_model_archive_checksum_mismatch(bucket, tmpdir):
+    _write_archive(str(bucket.join("model.tar.gz")), {"vw.model": b"data"})
+    size = bucket.join("model.tar.gz").size()
+    object_info = (size, '"{}"'.format("0" * 32), None, None)
+
+    with pytest.raises(CustomerError, match="Checksum mismatch"):
+        fetch_model_archive(LocalObjectStore(str(tmpdir)), "bucket", "model.tar.gz", str(tmpdir.mkdir("extracted")),
+                            object_info=object_info)
+
+
+@pytest.mark.parametrize("etag, server_side_encryption, sse_customer_algorithm, is_md5", [
+    ("9b2cf535f27731c974343645a3985328", None, None, True),
+    ("9b2cf535f27731c974343645a3985328", "AES256", None, True),
+    ("9b2cf535f27731c974343645a3985328-2", None, None, False),
+    ("9b2cf535f27731c974343645a3985328", "aws:kms", None, False),
+    ("9b2cf535f27731c974343645a3985328", "aws:kms:dsse", None, False),
+    ("9b2cf535f27731c974343645a3985328", None, "AES256", False),
+])
+def test_etag_is_md5(etag, server_side_encryption, sse_customer_algorithm, is_md5):
+    assert etag_is_md5(etag, server_side_encryption, sse_customer_algorithm) == is_md5
+
+
+def test_fetch_model_archive_of_kms_encrypted_object(bucket, tmpdir):
+    _write_archive(str(bucket.join("model.tar.gz")), {"vw.model": b"data"})
+    size = bucket.join("model.tar.gz").size()
+    # the ETag of an object encrypted with KMS is not the MD5 of its content
+    object_info = (size, '"{}"'.format("0" * 32), "aws:kms", None)
+
+    _, _, model_files = fetch_model_archive(LocalObjectStore(str(tmpdir)), "bucket", "model.tar.gz",
+                                            str(tmpdir.mkdir("extracted")), object_info=object_info)
+
+    assert "vw.model" in model_files
+
+
+def test_s3_object_store_head():
+    class FakeS3Client:
+        def head_object(self, Bucket, Key):
+            return {"ContentLength": 10, "ETag": '"etag"', "ServerSideEncryption": "aws:kms"}
+
+    assert S3ObjectStore(FakeS3Client()).head("bucket", "key") == (10, '"etag"', "aws:kms", None)
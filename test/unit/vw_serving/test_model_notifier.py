@@ -0,0 +1,143 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import threading
+import time
+
+import pytest
+
+from vw_serving import model_notifier
+from vw_serving.model_notifier import InMemoryModelNotifier, PollingModelNotifier, RedisModelNotifier
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(model_notifier.time, "sleep", lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    monkeypatch.setattr(model_notifier.time, "monotonic", lambda: clock[0])
+    return clock
+
+
+class _FakePubSub:
+    def __init__(self, messages=(), subscribe_error=None, get_message_error=None):
+        self.messages = list(messages)
+        self.subscribe_error = subscribe_error
+        self.get_message_error = get_message_error
+
+    def subscribe(self, channel):
+        if self.subscribe_error is not None:
+            raise self.subscribe_error
+
+    def psubscribe(self, pattern):
+        pass
+
+    def get_message(self, timeout):
+        if self.get_message_error is not None:
+            raise self.get_message_error
+        if self.messages:
+            return self.messages.pop(0)
+        # no message before the timeout, e.g. keyspace notifications are disabled
+        time.sleep(timeout)
+        return None
+
+    def close(self):
+        pass
+
+
+class _FakeRedis:
+    def __init__(self, pubsub, values=None):
+        self._pubsub = pubsub
+        self.values = values or {}
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return self._pubsub
+
+    def get(self, key):
+        return self.values.get(key)
+
+
+def test_in_memory_notifier_wakes_up_on_publish():
+    notifier = InMemoryModelNotifier(timeout=10)
+    threading.Timer(0.05, notifier.publish, args=("model-2",)).start()
+
+    start = time.monotonic()
+    assert notifier.wait_for_new_model("model-1") == "model-2"
+    assert time.monotonic() - start < 5
+
+
+def test_in_memory_notifier_ignores_the_hosted_model():
+    notifier = InMemoryModelNotifier(timeout=0.05)
+    notifier.publish("model-1")
+
+    assert notifier.wait_for_new_model("model-1") is None
+
+
+def test_polling_notifier_backoff_bounds(fake_clock):
+    next_model_ids = ["model-1"] * 6 + ["model-2"]
+    notifier = PollingModelNotifier(lambda: next_model_ids.pop(0), min_interval=1, max_interval=5)
+
+    intervals = []
+    for _ in range(7):
+        notifier.wait_for_new_model("model-1")
+        intervals.append(notifier.interval)
+
+    # back to the minimum interval as soon as the next model id changes
+    assert intervals == [1, 2, 4, 5, 5, 5, 1]
+    assert fake_clock[0] == 1 + 1 + 2 + 4 + 5 + 5 + 5
+
+
+def test_polling_notifier_returns_new_models():
+    notifier = PollingModelNotifier(lambda: "model-2", min_interval=0, max_interval=0)
+
+    assert notifier.wait_for_new_model("model-1") == "model-2"
+    assert notifier.wait_for_new_model("model-2") is None
+
+
+@pytest.mark.parametrize("message", [
+    {"type": "message", "data": b"model-2"},
+    {"type": "pmessage", "data": b"set"},
+])
+def test_redis_notifier_receives_pushed_models(fake_clock, message):
+    poller = PollingModelNotifier(lambda: "model-1", min_interval=10)
+    redis_client = _FakeRedis(_FakePubSub(messages=[message]), values={"next_model_to_host_id": b"model-2"})
+    notifier = RedisModelNotifier(redis_client, poller)
+
+    assert notifier.wait_for_new_model("model-1") == "model-2"
+    assert fake_clock[0] == 0
+    assert poller.num_reads == 0
+
+
+@pytest.mark.parametrize("pubsub", [
+    _FakePubSub(),
+    _FakePubSub(subscribe_error=ConnectionError("redis is down")),
+    _FakePubSub(get_message_error=ConnectionError("redis is down")),
+], ids=["no keyspace events", "subscribe error", "get_message error"])
+def test_redis_notifier_falls_back_to_polling(fake_clock, pubsub):
+    poller = PollingModelNotifier(lambda: "model-2", min_interval=10)
+    notifier = RedisModelNotifier(_FakeRedis(pubsub), poller)
+
+    assert notifier.wait_for_new_model("model-1") == "model-2"
+    assert fake_clock[0] == 10
+    assert poller.num_reads == 1
+
+
+def test_redis_notifier_subscribes_again_when_redis_is_back(fake_clock):
+    pubsub = _FakePubSub(subscribe_error=ConnectionError("redis is down"))
+    notifier = RedisModelNotifier(_FakeRedis(pubsub), PollingModelNotifier(lambda: None, min_interval=10))
+    assert not notifier.subscribed
+
+    pubsub.subscribe_error = None
+    notifier.wait_for_new_model("model-1")
+
+    assert notifier.subscribed
@@ -0,0 +1,148 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import threading
+import time
+from queue import Empty
+
+import numpy as np
+import pytest
+
+from vw_serving.model_pool import VWModelPool
+from vw_serving.vw_model import VWError
+
+
+class _SlowModel:
+    """Scores every context as the row [model index, context[0]] after delay seconds"""
+
+    def __init__(self, index, delay=0.0):
+        self.index = index
+        self.delay = delay
+        self.batches = []
+        self.started = False
+        self.closed = False
+        self.in_use = 0
+        self.max_in_use = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.started = True
+
+    def _use(self):
+        with self._lock:
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_use -= 1
+
+    def predict(self, context_vector):
+        return self.predict_many([context_vector])[0]
+
+    def predict_many(self, context_vectors):
+        self._use()
+        self.batches.append(list(context_vectors))
+        return np.array([[self.index, context_vector[0]] for context_vector in context_vectors], dtype=float)
+
+    def close(self):
+        self.closed = True
+        return "model {}".format(self.index)
+
+
+def _start_pool(models, **kwargs):
+    pool = VWModelPool(models, **kwargs)
+    pool.start()
+    return pool
+
+
+def test_pool_requires_models():
+    with pytest.raises(VWError):
+        VWModelPool([])
+
+
+def test_batch_shards_are_scored_in_parallel_and_stacked_in_order():
+    # the first shard is the slowest, so the shards complete out of order
+    models = [_SlowModel(index, delay) for index, delay in enumerate([0.05, 0.01, 0.0])]
+    pool = _start_pool(models, min_shard_size=2)
+
+    scores = pool.predict_many([[row] for row in range(7)])
+
+    np.testing.assert_array_equal(scores[:, 1], np.arange(7))
+    assert sorted(len(model.batches[0]) for model in models) == [2, 2, 3]
+    for model in models:
+        rows = scores[scores[:, 0] == model.index, 1]
+        assert list(rows) == [context_vector[0] for context_vector in model.batches[0]]
+        assert list(np.diff(rows)) == [1] * (len(rows) - 1)
+    assert pool.close() == ["model 0", "model 1", "model 2"]
+    assert all(model.closed for model in models)
+
+
+def test_small_batch_is_scored_on_one_model():
+    models = [_SlowModel(index) for index in range(3)]
+    pool = _start_pool(models, min_shard_size=64)
+
+    scores = pool.predict_many([[row] for row in range(10)])
+
+    assert scores.shape == (10, 2)
+    assert sum(len(model.batches) for model in models) == 1
+    assert pool.predict_many([]).shape == (0, 0)
+    pool.close()
+
+
+def test_models_are_never_shared_by_concurrent_checkouts():
+    models = [_SlowModel(index, delay=0.001) for index in range(2)]
+    pool = _start_pool(models)
+    errors = []
+
+    def score():
+        try:
+            for row in range(20):
+                assert pool.predict([row])[1] == row
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=score, daemon=True) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert errors == []
+    assert [model.max_in_use for model in models] == [1, 1]
+    assert sum(len(model.batches) for model in models) == 160
+    pool.close()
+
+
+def test_checkout_waits_for_a_checked_in_model():
+    pool = _start_pool([_SlowModel(0)])
+
+    model = pool.checkout()
+    with pytest.raises(Empty):
+        pool.checkout(timeout=0.01)
+    threading.Timer(0.01, pool.checkin, args=(model,)).start()
+
+    assert pool.checkout(timeout=5) is model
+    pool.checkin(model)
+    pool.close()
+
+
+def test_model_is_checked_in_after_a_failure():
+    pool = _start_pool([_SlowModel(0)])
+
+    with pytest.raises(TypeError):
+        pool.predict(None)
+
+    assert pool.checkout(timeout=0) is pool.models[0]
+    pool.close()
@@ -0,0 +1,171 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import logging
+
+import numpy as np
+import pytest
+
+from vw_serving import prediction_cache
+from vw_serving.prediction_cache import REDIS_KEY_PREFIX, CachedVWModel, PredictionCache
+from vw_serving.sagemaker.exceptions import CustomerError
+
+
+class _FakePipeline:
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.commands = []
+
+    def set(self, key, value, ex=None):
+        self.commands.append((key, value, ex))
+
+    def execute(self):
+        self.redis_client.round_trips += 1
+        if self.redis_client.down:
+            raise ConnectionError("redis is down")
+        for key, value, ex in self.commands:
+            self.redis_client.values[key] = value
+            self.redis_client.expiries[key] = ex
+
+
+class _FakeRedis:
+    def __init__(self, down=False):
+        self.down = down
+        self.values = {}
+        self.expiries = {}
+        self.round_trips = 0
+
+    def mget(self, keys):
+        self.round_trips += 1
+        if self.down:
+            raise ConnectionError("redis is down")
+        return [self.values.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        assert not transaction
+        return _FakePipeline(self)
+
+
+class _CountingModel:
+    def __init__(self):
+        self.scored = []
+        self.closed = False
+
+    def predict(self, context_vector):
+        return self.predict_many([context_vector])[0]
+
+    def predict_many(self, context_vectors):
+        self.scored.append([list(context_vector) for context_vector in context_vectors])
+        return np.array([[context_vector[0], 1 - context_vector[0]] for context_vector in context_vectors])
+
+    def close(self):
+        self.closed = True
+        return ""
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(prediction_cache.time, "monotonic", lambda: clock[0])
+    return clock
+
+
+def test_key_rejects_non_numeric_values():
+    with pytest.raises(CustomerError, match="Observation values must be numbers"):
+        PredictionCache.key("model", ["a", 1])
+
+
+def test_key_depends_on_model_and_values():
+    assert PredictionCache.key("model", [1, 2]) == PredictionCache.key("model", [1.0, 2.0])
+    assert PredictionCache.key("model", [1, 2]) != PredictionCache.key("model", [2, 1])
+    assert PredictionCache.key("model", [1, 2]) != PredictionCache.key("other", [1, 2])
+
+
+def test_lru_bound():
+    cache = PredictionCache(max_entries=2)
+    cache.put("a", [1])
+    cache.put("b", [2])
+    # a becomes the most recently used entry, b is evicted first
+    cache.get("a")
+    cache.put("c", [3])
+
+    assert cache.get_many(["a", "b", "c"])[1] is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["entries"] == 2
+
+
+def test_ttl_expiry(fake_clock):
+    cache = PredictionCache(ttl_seconds=10)
+    cache.put("a", [1])
+
+    fake_clock[0] = 9
+    assert cache.get("a") is not None
+    fake_clock[0] = 10
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_redis_tier_is_read_and_written_in_one_round_trip_per_batch():
+    redis_client = _FakeRedis()
+    writer = PredictionCache(redis_client=redis_client, redis_ttl_seconds=60)
+    writer.put_many([("a", [0.25, 0.75]), ("b", [1, 0])])
+    assert redis_client.round_trips == 1
+    assert redis_client.expiries == {"{}:a".format(REDIS_KEY_PREFIX): 60, "{}:b".format(REDIS_KEY_PREFIX): 60}
+
+    reader = PredictionCache(redis_client=redis_client)
+    scores = reader.get_many(["a", "b", "c"])
+
+    assert redis_client.round_trips == 2
+    np.testing.assert_allclose(scores[0], [0.25, 0.75])
+    np.testing.assert_allclose(scores[1], [1, 0])
+    assert scores[2] is None
+    assert reader.stats()["redis_hits"] == 2 and reader.stats()["misses"] == 1
+    # redis hits are kept in memory
+    reader.get_many(["a", "b"])
+    assert redis_client.round_trips == 2
+
+
+def test_redis_failures_are_logged_once_per_batch(caplog):
+    cache = PredictionCache(redis_client=_FakeRedis(down=True))
+
+    with caplog.at_level(logging.ERROR):
+        assert cache.get_many(["a", "b", "c"]) == [None, None, None]
+        cache.put_many([("a", [1]), ("b", [2]), ("c", [3])])
+
+    assert len(caplog.records) == 2
+    assert cache.get("a") is not None
+
+
+def test_cached_model_scores_repeated_observations_once():
+    model = _CountingModel()
+    cached_model = CachedVWModel(model, PredictionCache(), "model")
+
+    scores = cached_model.predict_many([[0.1], [0.2], [0.1]])
+    np.testing.assert_allclose(scores, [[0.1, 0.9], [0.2, 0.8], [0.1, 0.9]])
+    scores = cached_model.predict_many([[0.2], [0.3]])
+    np.testing.assert_allclose(scores, [[0.2, 0.8], [0.3, 0.7]])
+
+    assert model.scored == [[[0.1], [0.2]], [[0.3]]]
+
+
+def test_cached_model_close_invalidates_the_cache():
+    model = _CountingModel()
+    cache = PredictionCache()
+    cached_model = CachedVWModel(model, cache, "model")
+    cached_model.predict([0.1])
+
+    cached_model.close()
+
+    assert model.closed
+    assert cache.stats()["entries"] == 0
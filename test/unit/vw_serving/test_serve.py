@@ -0,0 +1,236 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import io
+import json
+import multiprocessing
+import signal
+
+import numpy as np
+import pytest
+import redis
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from vw_serving.micro_batcher import MicroBatchingModel
+from vw_serving.model_pool import VWModelPool
+from vw_serving.prediction_cache import CachedVWModel, PredictionCache
+from vw_serving import serve
+from vw_serving.serve import ScoringService, _MaxLengthStream
+
+
+class _FakeModel:
+    def __init__(self, num_actions=2):
+        self.num_actions = num_actions
+
+    def predict(self, context_vector):
+        return self.predict_many([context_vector])[0]
+
+    def predict_many(self, context_vectors):
+        if any(len(context_vector) > 2 for context_vector in context_vectors):
+            raise RuntimeError("model failure")
+        return np.full((len(context_vectors), self.num_actions), 1.0 / self.num_actions)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(ScoringService, "get_model", classmethod(lambda cls: _FakeModel()))
+    monkeypatch.setattr(ScoringService, "LOG_INFERENCE_DATA", False)
+    monkeypatch.setattr(ScoringService, "BATCH_CHUNK_ROWS", 1)
+    return ScoringService.app.test_client()
+
+
+@pytest.mark.parametrize("payload, content_type", [
+    (b"1,2\n3,4\n", "text/csv"),
+    (b"[1, 2]\n[3, 4]\n", "application/jsonlines"),
+])
+def test_batch_invocations(client, payload, content_type):
+    response = client.post("/invocations", data=payload, content_type=content_type)
+
+    assert response.status_code == 200
+    assert len(response.data.splitlines()) == 2
+
+
+@pytest.mark.parametrize("payload, content_type", [
+    (b"a,b\n", "text/csv"),
+    (b"{not json\n", "application/jsonlines"),
+])
+def test_batch_invocations_invalid_payload(client, payload, content_type):
+    response = client.post("/invocations", data=payload, content_type=content_type)
+
+    assert response.status_code == 400
+
+
+def test_batch_invocations_scoring_error_of_first_chunk(client):
+    response = client.post("/invocations", data=b"[1, 2, 3]\n", content_type="application/jsonlines")
+
+    assert response.status_code == 500
+
+
+def test_batch_invocations_payload_too_large(client, monkeypatch):
+    monkeypatch.setattr(ScoringService, "MAX_CONTENT_LENGTH", 16)
+
+    response = client.post("/invocations", data=b"1,2\n" * 5, content_type="text/csv")
+
+    assert response.status_code == 413
+
+
+def test_max_length_stream():
+    stream = _MaxLengthStream(io.BytesIO(b"1,2\n3,4\n5,6\n"), max_length=10)
+
+    assert stream.readline() == b"1,2\n"
+    assert stream.read(4) == b"3,4\n"
+    with pytest.raises(RequestEntityTooLarge):
+        list(stream)
+
+
+@pytest.mark.parametrize("worker_threads, max_batch_size, expected_class", [
+    ("1", "1", _FakeModel),
+    ("4", "1", VWModelPool),
+    ("4", "8", MicroBatchingModel),
+])
+def test_add_micro_batching_serializes_threaded_workers(monkeypatch, worker_threads, max_batch_size,
+                                                        expected_class):
+    monkeypatch.setenv("WORKER_THREADS", worker_threads)
+    monkeypatch.setenv("MICRO_BATCH_MAX_SIZE", max_batch_size)
+
+    assert type(ScoringService._add_micro_batching(_FakeModel())) is expected_class
+
+
+def test_execution_parameters_max_concurrent_transforms(monkeypatch):
+    monkeypatch.setenv("NUM_WORKERS", "1")
+    monkeypatch.setenv("WORKER_THREADS", "2")
+
+    response = ScoringService.app.test_client().get("/execution-parameters")
+
+    assert response.status_code == 200
+    assert response.get_json()["MaxConcurrentTransforms"] == min(2, multiprocessing.cpu_count())
+
+
+class _FakeRedis:
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, key):
+        value = self.values.get(key)
+        return value.encode() if value is not None else None
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(serve.time, "sleep", lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    monkeypatch.setattr(serve.time, "monotonic", lambda: clock[0])
+    return clock
+
+
+@pytest.mark.parametrize("backend, expected_attempts", [("subprocess", 3), ("daemon", 1)])
+def test_watch_model_id_restarts_worker_after_failed_swaps(monkeypatch, fake_clock, backend, expected_attempts):
+    attempts = []
+    kills = []
+
+    def swap_model(redis_client, model_id):
+        attempts.append((fake_clock[0], model_id))
+        raise RuntimeError("model failure")
+
+    monkeypatch.setenv("VW_SCORING_BACKEND", backend)
+    monkeypatch.setattr(redis, "Redis", lambda: _FakeRedis({"model_id": "model-2"}))
+    monkeypatch.setattr(ScoringService, "_model_id", "model-1")
+    monkeypatch.setattr(ScoringService, "_failed_model_ids", {})
+    monkeypatch.setattr(ScoringService, "_swap_model", staticmethod(swap_model))
+    monkeypatch.setattr(serve.os, "kill", lambda pid, sig: kills.append(sig))
+
+    ScoringService._watch_model_id(1)
+
+    assert kills == [signal.SIGTERM]
+    assert [model_id for _, model_id in attempts] == ["model-2"] * expected_attempts
+    # every retry waits for twice the back-off of the previous one
+    retry_delays = np.diff([attempted_at for attempted_at, _ in attempts])
+    assert all(retry_delays[1:] >= 2 * retry_delays[:-1])
+
+
+def test_watch_model_id_retries_failed_swap(monkeypatch, fake_clock):
+    failures = [RuntimeError("model failure")]
+
+    def swap_model(redis_client, model_id):
+        if failures:
+            raise failures.pop()
+        ScoringService._model_id = model_id
+        raise SystemExit
+
+    monkeypatch.setenv("VW_SCORING_BACKEND", "subprocess")
+    monkeypatch.setattr(redis, "Redis", lambda: _FakeRedis({"model_id": "model-2"}))
+    monkeypatch.setattr(ScoringService, "_model_id", "model-1")
+    monkeypatch.setattr(ScoringService, "_failed_model_ids", {})
+    monkeypatch.setattr(ScoringService, "_swap_model", staticmethod(swap_model))
+
+    with pytest.raises(SystemExit):
+        ScoringService._watch_model_id(1)
+
+    assert ScoringService._model_id == "model-2"
+
+
+class _FakeShadowScorer:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, event_id, observation, model_id, action_probs):
+        self.submitted.append(observation)
+
+
+@pytest.mark.parametrize("payload, content_type", [
+    (b"1,2\n3,4\n", "text/csv"),
+    (b"[1, 2]\n[3, 4]\n", "application/jsonlines"),
+])
+def test_batch_invocations_are_shadow_scored(client, monkeypatch, payload, content_type):
+    shadow_scorer = _FakeShadowScorer()
+    monkeypatch.setattr(ScoringService, "_shadow_scorer", shadow_scorer)
+
+    response = client.post("/invocations", data=payload, content_type=content_type)
+
+    assert len(response.data.splitlines()) == 2
+    assert shadow_scorer.submitted == [[1, 2], [3, 4]]
+
+
+def test_failed_shadow_model_is_retried_apart_from_the_model(monkeypatch, fake_clock):
+    attempts = []
+
+    def swap_shadow_model(redis_client, shadow_model_id):
+        attempts.append(fake_clock[0])
+        if len(attempts) == 3:
+            raise SystemExit
+        raise RuntimeError("model failure")
+
+    monkeypatch.setattr(redis, "Redis", lambda: _FakeRedis({"shadow_model_id": "model-2"}))
+    monkeypatch.setattr(ScoringService, "_shadow_scorer", None)
+    monkeypatch.setattr(ScoringService, "_failed_model_ids", {})
+    monkeypatch.setattr(ScoringService, "_failed_shadow_model_ids", {})
+    monkeypatch.setattr(ScoringService, "_swap_shadow_model", staticmethod(swap_shadow_model))
+
+    with pytest.raises(SystemExit):
+        ScoringService._watch_shadow_model_id(1)
+
+    assert ScoringService._failed_model_ids == {}
+    assert ScoringService._failed_shadow_model_ids["model-2"][0] == 2
+    # back-off of 2 and 4 intervals
+    assert attempts == [1, 3, 7]
+
+
+def test_cached_model_rejects_non_numeric_observation(client, monkeypatch):
+    cached_model = CachedVWModel(_FakeModel(), PredictionCache(), "model")
+    monkeypatch.setattr(ScoringService, "get_model", classmethod(lambda cls: cached_model))
+
+    response = client.post("/invocations", data=json.dumps({"observation": ["a", 1]}),
+                           content_type="application/json")
+
+    assert response.status_code == 400
@@ -0,0 +1,88 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import os
+import subprocess
+import sys
+
+from vw_serving.shm_ring import ShmExperiencePublisher, ShmRingBuffer, find_rings, worker_ring_path
+
+
+def test_ring_round_trip(tmpdir):
+    path = worker_ring_path(str(tmpdir), os.getpid(), slot=0)
+    producer = ShmRingBuffer(path, capacity=64)
+    consumer = ShmRingBuffer(path)
+
+    # 3 records of 4 + 20 bytes, the last one does not fit and wraps around once the first is read
+    assert producer.write(b"a" * 20) and producer.write(b"b" * 20)
+    assert not producer.write(b"c" * 20)
+    assert consumer.read_all(max_records=1) == [b"a" * 20]
+    assert producer.write(b"d" * 20)
+    assert consumer.read_all() == [b"b" * 20, b"d" * 20]
+    assert consumer.stats() == {"written": 3, "dropped": 1, "used_bytes": 0, "capacity_bytes": 64}
+
+
+def test_ring_writer_pid(tmpdir):
+    path = worker_ring_path(str(tmpdir), os.getpid(), slot=0)
+    ShmRingBuffer(path, capacity=64)
+
+    consumer = ShmRingBuffer(path)
+
+    assert consumer.writer_pid == os.getpid()
+    assert not consumer.is_orphaned()
+
+
+def test_publisher_close_removes_the_ring(tmpdir):
+    path = worker_ring_path(str(tmpdir), os.getpid(), slot=0)
+    publisher = ShmExperiencePublisher(ShmRingBuffer(path, capacity=64))
+    consumer = ShmRingBuffer(path)
+    publisher.publish("record")
+
+    publisher.close()
+
+    assert find_rings(str(tmpdir)) == []
+    assert consumer.is_orphaned()
+    # the records left in the ring are still read from the mapping of the consumer
+    assert consumer.read_all() == [b"record"]
+
+
+def test_ring_of_a_dead_writer_is_orphaned(tmpdir):
+    path = worker_ring_path(str(tmpdir), os.getpid(), slot=0)
+    subprocess.run([sys.executable, "-c", "from vw_serving.shm_ring import ShmRingBuffer; "
+                                          "ShmRingBuffer({!r}, capacity=64).write(b'record')".format(path)],
+                   check=True, env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+
+    consumer = ShmRingBuffer(path)
+
+    assert consumer.is_orphaned()
+    assert consumer.read_all() == [b"record"]
+    consumer.unlink()
+    assert find_rings(str(tmpdir)) == []
+
+
+def test_worker_ring_paths_are_unique_per_process(tmpdir):
+    # a respawned worker in the same cpu slot writes to a new ring
+    assert worker_ring_path(str(tmpdir), 100, slot=0) != worker_ring_path(str(tmpdir), 101, slot=0)
+    assert worker_ring_path(str(tmpdir), 100) != worker_ring_path(str(tmpdir), 101)
+    assert worker_ring_path(str(tmpdir), 100, slot=0).endswith(".ring")
+
+
+def test_unlink_of_a_removed_ring(tmpdir):
+    path = worker_ring_path(str(tmpdir), os.getpid(), slot=0)
+    ShmRingBuffer(path, capacity=64)
+    consumer = ShmRingBuffer(path)
+    os.remove(path)
+
+    assert consumer.is_orphaned()
+    consumer.unlink()
@@ -0,0 +1,131 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from vw_serving.vw_model import VWModelDown, VWModelTimeout
+from vw_serving.vw_supervisor import VWModelSupervisor
+
+
+class _FlakyModel:
+    """Raises the queued failures on its next calls, then scores every context as the row [model index, 1]"""
+
+    def __init__(self, index):
+        self.index = index
+        self.failures = []
+        self.started = False
+        self.closed = threading.Event()
+
+    def start(self):
+        self.started = True
+
+    def predict(self, context_vector):
+        return self.predict_many([context_vector])[0]
+
+    def predict_many(self, context_vectors):
+        if self.failures:
+            raise self.failures.pop(0)
+        return np.array([[self.index, 1.0]] * len(context_vectors))
+
+    def close(self):
+        self.closed.set()
+        return "model {}".format(self.index)
+
+
+class _ModelFactory:
+    def __init__(self):
+        self.models = []
+
+    def __call__(self):
+        self.models.append(_FlakyModel(len(self.models)))
+        return self.models[-1]
+
+
+def _wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def factory():
+    return _ModelFactory()
+
+
+@pytest.mark.parametrize("failure", [VWModelDown(), VWModelTimeout(1)])
+def test_request_is_retried_once_on_a_replacement(factory, failure):
+    supervisor = VWModelSupervisor(factory)
+    supervisor.start()
+    factory.models[0].failures.append(failure)
+
+    np.testing.assert_array_equal(supervisor.predict([0.5]), [1, 1.0])
+
+    assert supervisor.active_model is factory.models[1]
+    assert supervisor.num_respawns == 1
+    assert factory.models[0].closed.wait(5)
+    supervisor.close()
+
+
+def test_failure_of_the_replacement_is_raised(factory):
+    supervisor = VWModelSupervisor(factory)
+    supervisor.start()
+    factory.models[0].failures.append(VWModelDown())
+
+    def failing_factory():
+        model = factory()
+        model.failures.append(VWModelDown())
+        return model
+
+    supervisor.model_factory = failing_factory
+    with pytest.raises(VWModelDown):
+        supervisor.predict_many([[0.5], [0.5]])
+
+    assert len(factory.models) == 2
+    assert supervisor.num_respawns == 1
+    supervisor.close()
+
+
+def test_other_errors_are_raised_without_replacement(factory):
+    supervisor = VWModelSupervisor(factory)
+    supervisor.start()
+    factory.models[0].failures.append(ValueError("bad example"))
+
+    with pytest.raises(ValueError):
+        supervisor.predict([0.5])
+
+    assert supervisor.active_model is factory.models[0]
+    assert supervisor.num_respawns == 0
+    supervisor.close()
+
+
+def test_standby_is_swapped_in_and_replaced(factory):
+    supervisor = VWModelSupervisor(factory, warm_standby=True)
+    supervisor.start()
+    _wait_for(lambda: supervisor.standby_model is not None)
+    standby_model = supervisor.standby_model
+    factory.models[0].failures.append(VWModelDown())
+
+    scores = supervisor.predict_many([[0.5], [0.5]])
+
+    np.testing.assert_array_equal(scores[:, 0], [standby_model.index] * 2)
+    assert supervisor.active_model is standby_model
+    # a new standby is started in the background
+    _wait_for(lambda: supervisor.standby_model is not None)
+    assert len(factory.models) == 3
+    assert supervisor.close() == ["model 1", "model 2"]